@@ -13,6 +13,13 @@ for %%d in (libsrtp) do (
 git clone https://github.com/cisco/libsrtp/ %source_dir%
 cd %source_dir%
 git checkout -qf v2.7.0
+rem The hash-indexed stream list is experimental, so it is only built on demand.
+rem The package-wheel-hashed-stream-list CI job builds it on Linux.
+if not "%PYLIBSRTP_HASHED_STREAM_LIST%" == "1" goto stream_list_done
+copy ..\scripts\srtp_stream_list_hash.c srtp
+echo target_sources(srtp2 PRIVATE srtp/srtp_stream_list_hash.c) >> CMakeLists.txt
+echo target_compile_definitions(srtp2 PRIVATE SRTP_NO_STREAM_LIST) >> CMakeLists.txt
+:stream_list_done
 cd ..
 
 if "%PYTHON_ARCH%" == "64" (
@@ -23,6 +30,7 @@ if "%PYTHON_ARCH%" == "64" (
 mkdir %build_dir%
 cd %build_dir%
 cmake ..\%source_dir% -G "Visual Studio 17 2022" %CMAKE_OPTIONS% -DENABLE_OPENSSL=ON
+findstr /c:"#define GCM 1" config.h || exit /b 1
 cmake --build . --config Release
 cd ..
 
@@ -35,3 +43,4 @@ for %%d in (include\srtp.h crypto\include\auth.h crypto\include\cipher.h crypto\
 	 copy %source_dir%\%%d %dest_dir%\include\srtp2
 )
 copy %build_dir%\Release\srtp2.lib %dest_dir%\lib\srtp2.lib
+if "%PYLIBSRTP_HASHED_STREAM_LIST%" == "1" echo /* libsrtp was built with a hash-indexed stream list. */ > %dest_dir%\include\srtp2\stream_list_hash.h
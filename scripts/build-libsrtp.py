@@ -9,6 +9,10 @@ if len(sys.argv) < 2:
     sys.exit(1)
 
 dest_dir = sys.argv[1]
+# The hash-indexed stream list is experimental, so it is only built on demand,
+# which the package-wheel-hashed-stream-list CI job does.
+hashed_stream_list = os.environ.get("PYLIBSRTP_HASHED_STREAM_LIST") == "1"
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
 build_dir = os.path.abspath("libsrtp.build")
 source_dir = os.path.abspath("libsrtp.source")
 
@@ -22,7 +26,10 @@ def run(cmd):
     subprocess.run(cmd, check=True, stderr=sys.stderr.buffer, stdout=sys.stdout.buffer)
 
 
+# Link against OpenSSL, which provides AES-GCM and uses AES-NI / PCLMULQDQ
+# (or the ARMv8 cryptography extensions) when the CPU supports them.
 cmake_args = [
+    "-DCMAKE_BUILD_TYPE=Release",
     "-DCMAKE_INSTALL_PREFIX=" + dest_dir,
     "-DCMAKE_POSITION_INDEPENDENT_CODE=ON",
     "-DCMAKE_VERBOSE_MAKEFILE:BOOL=ON",
@@ -38,8 +45,30 @@ run(["git", "clone", "https://github.com/cisco/libsrtp/", source_dir])
 os.chdir(source_dir)
 run(["git", "checkout", "-qf", "v2.7.0"])
 
+# Replace libsrtp's stream list, which is searched linearly, with a hash table.
+if hashed_stream_list:
+    shutil.copy(os.path.join(scripts_dir, "srtp_stream_list_hash.c"), "srtp")
+    with open("CMakeLists.txt", "a") as fp:
+        fp.write(
+            "target_sources(srtp2 PRIVATE srtp/srtp_stream_list_hash.c)\n"
+            "target_compile_definitions(srtp2 PRIVATE SRTP_NO_STREAM_LIST)\n"
+        )
+
 os.mkdir(build_dir)
 os.chdir(build_dir)
 run(["cmake", source_dir] + cmake_args)
+
+# Refuse to ship a libsrtp without AES-GCM support.
+with open(os.path.join(build_dir, "config.h")) as fp:
+    if "#define GCM 1" not in fp.read():
+        sys.stderr.write("libsrtp was configured without AES-GCM support\n")
+        sys.exit(1)
+
 run(["make"])
 run(["make", "install"])
+
+# Let the bindings know the stream list is hash-indexed.
+if hashed_stream_list:
+    marker = os.path.join(dest_dir, "include", "srtp2", "stream_list_hash.h")
+    with open(marker, "w") as fp:
+        fp.write("/* libsrtp was built with a hash-indexed stream list. */\n")
@@ -0,0 +1,171 @@
+/*
+ * Hash-indexed stream list for libsrtp.
+ *
+ * libsrtp looks up the stream of every packet it processes by SSRC. Its
+ * default stream list is an array which is searched linearly, so the cost of
+ * each packet grows with the number of streams in the session. This file
+ * replaces it with a hash table of chained entries, whose lookups take a
+ * constant time.
+ *
+ * It is compiled into libsrtp by scripts/build-libsrtp.py when the
+ * PYLIBSRTP_HASHED_STREAM_LIST environment variable is set to 1, along with
+ * the SRTP_NO_STREAM_LIST define which removes the default implementation.
+ * This is experimental: published wheels use the default stream list.
+ */
+
+#ifdef HAVE_CONFIG_H
+#include <config.h>
+#endif
+
+#include "alloc.h"
+#include "srtp_priv.h"
+#include "stream_list_priv.h"
+
+#define INITIAL_BITS 4
+
+typedef struct entry_t {
+    srtp_stream_t stream;
+    struct entry_t *next;
+} entry_t;
+
+struct srtp_stream_list_ctx_t_ {
+    entry_t **buckets;
+    unsigned int bits;
+    size_t size;
+};
+
+/* Fibonacci hashing of the SSRC, which is in network byte order. */
+static size_t bucket_index(unsigned int bits, uint32_t ssrc)
+{
+    return (size_t)((uint32_t)(ssrc * 2654435769u) >> (32 - bits));
+}
+
+static srtp_err_status_t resize(srtp_stream_list_t list, unsigned int bits)
+{
+    entry_t **buckets;
+    entry_t *entry, *next;
+    size_t i, index;
+
+    buckets = (entry_t **)srtp_crypto_alloc(sizeof(entry_t *) << bits);
+    if (buckets == NULL)
+        return srtp_err_status_alloc_fail;
+
+    for (i = 0; i < ((size_t)1 << list->bits); i++) {
+        for (entry = list->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            index = bucket_index(bits, entry->stream->ssrc);
+            entry->next = buckets[index];
+            buckets[index] = entry;
+        }
+    }
+
+    srtp_crypto_free(list->buckets);
+    list->buckets = buckets;
+    list->bits = bits;
+    return srtp_err_status_ok;
+}
+
+srtp_err_status_t srtp_stream_list_alloc(srtp_stream_list_t *list_ptr)
+{
+    srtp_stream_list_t list;
+
+    list = (srtp_stream_list_t)srtp_crypto_alloc(sizeof(*list));
+    if (list == NULL)
+        return srtp_err_status_alloc_fail;
+
+    list->buckets =
+        (entry_t **)srtp_crypto_alloc(sizeof(entry_t *) << INITIAL_BITS);
+    if (list->buckets == NULL) {
+        srtp_crypto_free(list);
+        return srtp_err_status_alloc_fail;
+    }
+    list->bits = INITIAL_BITS;
+    list->size = 0;
+
+    *list_ptr = list;
+    return srtp_err_status_ok;
+}
+
+srtp_err_status_t srtp_stream_list_dealloc(srtp_stream_list_t list)
+{
+    /* The streams must have been removed before the list is deallocated. */
+    if (list->size != 0)
+        return srtp_err_status_fail;
+
+    srtp_crypto_free(list->buckets);
+    srtp_crypto_free(list);
+    return srtp_err_status_ok;
+}
+
+srtp_err_status_t srtp_stream_list_insert(srtp_stream_list_t list,
+                                          srtp_stream_t stream)
+{
+    entry_t *entry;
+    size_t index;
+    srtp_err_status_t status;
+
+    /* Keep the load factor at most 1. */
+    if (list->size >= ((size_t)1 << list->bits) && list->bits < 31) {
+        status = resize(list, list->bits + 1);
+        if (status)
+            return status;
+    }
+
+    entry = (entry_t *)srtp_crypto_alloc(sizeof(*entry));
+    if (entry == NULL)
+        return srtp_err_status_alloc_fail;
+
+    index = bucket_index(list->bits, stream->ssrc);
+    entry->stream = stream;
+    entry->next = list->buckets[index];
+    list->buckets[index] = entry;
+    list->size++;
+    return srtp_err_status_ok;
+}
+
+srtp_stream_t srtp_stream_list_get(srtp_stream_list_t list, uint32_t ssrc)
+{
+    entry_t *entry;
+
+    for (entry = list->buckets[bucket_index(list->bits, ssrc)]; entry != NULL;
+         entry = entry->next) {
+        if (entry->stream->ssrc == ssrc)
+            return entry->stream;
+    }
+    return NULL;
+}
+
+void srtp_stream_list_remove(srtp_stream_list_t list,
+                             srtp_stream_t stream_to_remove)
+{
+    entry_t **link;
+    entry_t *entry;
+
+    link = &list->buckets[bucket_index(list->bits, stream_to_remove->ssrc)];
+    for (entry = *link; entry != NULL; link = &entry->next, entry = *link) {
+        if (entry->stream == stream_to_remove) {
+            *link = entry->next;
+            srtp_crypto_free(entry);
+            list->size--;
+            return;
+        }
+    }
+}
+
+void srtp_stream_list_for_each(srtp_stream_list_t list,
+                               int (*callback)(srtp_stream_t, void *),
+                               void *data)
+{
+    entry_t *entry, *next;
+    size_t i;
+
+    /* The callback may remove the stream it is given from the list, so the
+     * next entry is fetched beforehand. */
+    for (i = 0; i < ((size_t)1 << list->bits); i++) {
+        for (entry = list->buckets[i]; entry != NULL; entry = next) {
+            next = entry->next;
+            if (callback(entry->stream, data))
+                return;
+        }
+    }
+}
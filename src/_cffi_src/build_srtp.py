@@ -10,13 +10,653 @@ else:
 
 ffibuilder = FFI()
 ffibuilder.set_source(
-    "pylibsrtp._binding", "#include <srtp2/srtp.h>", libraries=libraries
+    "pylibsrtp._binding",
+    """
+#include <stdlib.h>
+#include <string.h>
+
+#include <srtp2/srtp.h>
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
+/* The libsrtp built by scripts/build-libsrtp.py installs this header to
+ * signal that its stream list is a hash table. */
+#if defined __has_include
+#if __has_include(<srtp2/stream_list_hash.h>)
+#define PYLIBSRTP_HASHED_STREAM_LIST 1
+#endif
+#endif
+#ifndef PYLIBSRTP_HASHED_STREAM_LIST
+#define PYLIBSRTP_HASHED_STREAM_LIST 0
+#endif
+
+#if defined(__x86_64__) || defined(__i386__) || defined(_M_X64) || \
+    defined(_M_IX86)
+#define PYLIBSRTP_X86 1
+#ifdef _MSC_VER
+#include <intrin.h>
+#else
+#include <cpuid.h>
+#endif
+#elif defined(__aarch64__) && defined(__linux__)
+#include <sys/auxv.h>
+#ifndef HWCAP_AES
+#define HWCAP_AES (1 << 3)
+#endif
+#ifndef HWCAP_PMULL
+#define HWCAP_PMULL (1 << 4)
+#endif
+#endif
+
+#define PYLIBSRTP_PROTECT 0
+#define PYLIBSRTP_PROTECT_RTCP 1
+#define PYLIBSRTP_UNPROTECT 2
+#define PYLIBSRTP_UNPROTECT_RTCP 3
+#define PYLIBSRTP_UNPROTECT_AUTO 4
+
+#define PYLIBSRTP_KIND_UNKNOWN 0
+#define PYLIBSRTP_KIND_STUN 1
+#define PYLIBSRTP_KIND_ZRTP 2
+#define PYLIBSRTP_KIND_DTLS 3
+#define PYLIBSRTP_KIND_TURN 4
+#define PYLIBSRTP_KIND_RTP 5
+#define PYLIBSRTP_KIND_RTCP 6
+#define PYLIBSRTP_KIND_VALID 8
+
+#define PYLIBSRTP_CPU_AES 1
+#define PYLIBSRTP_CPU_CLMUL 2
+
+#define PYLIBSRTP_ERROR_CODES 32
+#define PYLIBSRTP_REJECT_BITS 10
+#define PYLIBSRTP_MAX_SRTCP_TRAILER_LEN (4 + SRTP_MAX_TRAILER_LEN)
+
+/* An SSRC whose unprotect failures are counted towards rejecting it, with
+ * the number of failures and the time of the first one, or once rejected
+ * the status its packets get and the time until which it is rejected. ssrc
+ * is -1 when the entry is free. */
+typedef struct {
+    int64_t ssrc;
+    int failures;
+    srtp_err_status_t status;
+    double time;
+} pylibsrtp_reject_t;
+
+/* State of a session: its libsrtp context, its MKI settings (whether to use
+ * an MKI, and the index of the master key to protect with) and its counters
+ * of packets, bytes, errors, late and duplicate packets per operation. The
+ * SSRC and sequence number of the last packet processed are kept for the
+ * per-SSRC counters kept in Python. trailers caches the length of the
+ * trailer added when protecting RTP and RTCP packets, 0 when unknown.
+ *
+ * ssrcs is an open-addressing set of the SSRCs which have a stream, of
+ * 2^ssrc_bits slots holding -1 when empty. Streams added explicitly are
+ * inserted by the Python side. If the session has a wildcard policy, the
+ * streams libsrtp clones from it are inserted when their first packet is
+ * processed successfully, and counted in clones.
+ *
+ * If SSRCs which keep failing are rejected, rejects is a table of
+ * 2^PYLIBSRTP_REJECT_BITS entries indexed by the hash of the SSRC, and
+ * rejected counts the packets dropped because their SSRC was rejected. */
+typedef struct {
+    srtp_t ctx;
+    unsigned int mki[2];
+    uint64_t counters[4][5];
+    uint64_t errors[PYLIBSRTP_ERROR_CODES];
+    int trailers[2];
+    int64_t ssrc;
+    int seq;
+    int cloning;
+    uint64_t clones;
+    int64_t *ssrcs;
+    int ssrc_bits;
+    unsigned int ssrc_count;
+    pylibsrtp_reject_t *rejects;
+    int reject_threshold;
+    double reject_window;
+    uint64_t rejected;
+} pylibsrtp_session_t;
+
+/* Returns the CPU instructions used by OpenSSL to accelerate AES and GHASH
+ * (the GCM authenticator): AES-NI and PCLMULQDQ on x86, the ARMv8 AES and
+ * PMULL instructions on ARM. */
+static int pylibsrtp_cpu_features(void)
+{
+    int features = 0;
+#if defined(PYLIBSRTP_X86)
+    unsigned int regs[4] = {0, 0, 0, 0};
+#ifdef _MSC_VER
+    __cpuid((int *)regs, 1);
+#else
+    if (!__get_cpuid(1, &regs[0], &regs[1], &regs[2], &regs[3]))
+        return 0;
+#endif
+    if (regs[2] & (1 << 25))
+        features |= PYLIBSRTP_CPU_AES;
+    if (regs[2] & (1 << 1))
+        features |= PYLIBSRTP_CPU_CLMUL;
+#elif defined(__aarch64__) && defined(__linux__)
+    unsigned long hwcap = getauxval(AT_HWCAP);
+    if (hwcap & HWCAP_AES)
+        features |= PYLIBSRTP_CPU_AES;
+    if (hwcap & HWCAP_PMULL)
+        features |= PYLIBSRTP_CPU_CLMUL;
+#elif defined(__aarch64__) && defined(__APPLE__)
+    /* All Apple silicon implements the ARMv8 cryptography extensions. */
+    features = PYLIBSRTP_CPU_AES | PYLIBSRTP_CPU_CLMUL;
+#endif
+    return features;
+}
+
+/* Protects or unprotects a packet in place. mki points to the session's
+ * MKI settings: whether to use an MKI, and the index of the master key to
+ * protect with. */
+static srtp_err_status_t pylibsrtp_process(srtp_t ctx, int op, char *packet,
+                                           int *len_p,
+                                           const unsigned int *mki)
+{
+    switch (op) {
+    case PYLIBSRTP_PROTECT:
+        return srtp_protect_mki(ctx, packet, len_p, mki[0], mki[1]);
+    case PYLIBSRTP_PROTECT_RTCP:
+        return srtp_protect_rtcp_mki(ctx, packet, len_p, mki[0], mki[1]);
+    case PYLIBSRTP_UNPROTECT:
+        return srtp_unprotect_mki(ctx, packet, len_p, mki[0]);
+    case PYLIBSRTP_UNPROTECT_RTCP:
+        return srtp_unprotect_rtcp_mki(ctx, packet, len_p, mki[0]);
+    default:
+        return srtp_err_status_bad_param;
+    }
+}
+
+/* Returns the SSRC found in the (S)RTP or (S)RTCP header of the packet,
+ * or -1 if the packet is too short to contain one. The sequence number of
+ * (S)RTP packets is stored in seq, which is set to -1 otherwise. */
+static int64_t pylibsrtp_packet_ssrc(const char *packet, int length, int rtcp,
+                                     int *seq)
+{
+    const unsigned char *p = (const unsigned char *)packet;
+
+    *seq = -1;
+    if (length < (rtcp ? 8 : 12))
+        return -1;
+    if (!rtcp)
+        *seq = (p[2] << 8) | p[3];
+    p += rtcp ? 4 : 8;
+    return ((int64_t)p[0] << 24) | (p[1] << 16) | (p[2] << 8) | p[3];
+}
+
+static uint32_t pylibsrtp_ssrc_hash(uint32_t ssrc, int bits)
+{
+    return (uint32_t)(ssrc * 2654435769u) >> (32 - bits);
+}
+
+/* Returns the slot of an SSRC in the session's set, or the empty slot where
+ * it belongs. The set must have been allocated. */
+static uint32_t pylibsrtp_ssrc_slot(const pylibsrtp_session_t *s,
+                                    uint32_t ssrc)
+{
+    uint32_t mask = ((uint32_t)1 << s->ssrc_bits) - 1;
+    uint32_t slot = pylibsrtp_ssrc_hash(ssrc, s->ssrc_bits);
+
+    while (s->ssrcs[slot] >= 0 && s->ssrcs[slot] != ssrc)
+        slot = (slot + 1) & mask;
+    return slot;
+}
+
+/* Adds an SSRC to the session's set. Returns 1 if it was added, 0 if it was
+ * already there and -1 if memory ran out. */
+static int pylibsrtp_session_add_ssrc(pylibsrtp_session_t *s, uint32_t ssrc)
+{
+    int64_t *old = s->ssrcs;
+    int old_bits = s->ssrc_bits;
+    pylibsrtp_reject_t *entry;
+    uint32_t i;
+
+    if (old != NULL && s->ssrcs[pylibsrtp_ssrc_slot(s, ssrc)] >= 0)
+        return 0;
+    if (2 * (s->ssrc_count + 1) > ((uint32_t)1 << old_bits)) {
+        int bits = old != NULL ? old_bits + 1 : 4;
+        int64_t *ssrcs = malloc(sizeof(int64_t) << bits);
+
+        if (ssrcs == NULL)
+            return -1;
+        memset(ssrcs, 0xff, sizeof(int64_t) << bits);
+        s->ssrcs = ssrcs;
+        s->ssrc_bits = bits;
+        if (old != NULL) {
+            for (i = 0; i < ((uint32_t)1 << old_bits); i++) {
+                if (old[i] >= 0)
+                    s->ssrcs[pylibsrtp_ssrc_slot(s, (uint32_t)old[i])] = old[i];
+            }
+            free(old);
+        }
+    }
+    s->ssrcs[pylibsrtp_ssrc_slot(s, ssrc)] = ssrc;
+    s->ssrc_count++;
+    /* An SSRC with a stream is never rejected. */
+    if (s->rejects != NULL) {
+        entry = &s->rejects[pylibsrtp_ssrc_hash(ssrc, PYLIBSRTP_REJECT_BITS)];
+        if (entry->ssrc == ssrc)
+            entry->ssrc = -1;
+    }
+    return 1;
+}
+
+/* Removes an SSRC from the session's set, moving back the entries which
+ * follow it so that linear probing still finds them. */
+static void pylibsrtp_session_discard_ssrc(pylibsrtp_session_t *s,
+                                           uint32_t ssrc)
+{
+    uint32_t mask = ((uint32_t)1 << s->ssrc_bits) - 1;
+    uint32_t slot, next, home;
+
+    if (s->ssrcs == NULL)
+        return;
+    slot = pylibsrtp_ssrc_slot(s, ssrc);
+    if (s->ssrcs[slot] < 0)
+        return;
+    s->ssrcs[slot] = -1;
+    s->ssrc_count--;
+    for (next = (slot + 1) & mask; s->ssrcs[next] >= 0;
+         next = (next + 1) & mask) {
+        home = pylibsrtp_ssrc_hash((uint32_t)s->ssrcs[next], s->ssrc_bits);
+        if (((next - home) & mask) >= ((next - slot) & mask)) {
+            s->ssrcs[slot] = s->ssrcs[next];
+            s->ssrcs[next] = -1;
+            slot = next;
+        }
+    }
+}
+
+static int pylibsrtp_session_has_ssrc(const pylibsrtp_session_t *s,
+                                      uint32_t ssrc)
+{
+    return s->ssrcs != NULL && s->ssrcs[pylibsrtp_ssrc_slot(s, ssrc)] >= 0;
+}
+
+/* Returns a monotonic time in seconds. */
+static double pylibsrtp_now(void)
+{
+#ifdef _WIN32
+    return GetTickCount64() / 1000.0;
+#else
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+#endif
+}
+
+/* Makes the session reject the SSRCs without a stream whose packets fail
+ * to be unprotected threshold times within window seconds. Returns -1 if
+ * memory ran out. */
+static int pylibsrtp_session_enable_rejects(pylibsrtp_session_t *s,
+                                            int threshold, double window)
+{
+    int i;
+
+    s->rejects = malloc(sizeof(pylibsrtp_reject_t) << PYLIBSRTP_REJECT_BITS);
+    if (s->rejects == NULL)
+        return -1;
+    for (i = 0; i < (1 << PYLIBSRTP_REJECT_BITS); i++)
+        s->rejects[i].ssrc = -1;
+    s->reject_threshold = threshold;
+    s->reject_window = window;
+    return 0;
+}
+
+/* Returns the status the packets of an SSRC get while it is rejected, or
+ * ok if it is not rejected. */
+static srtp_err_status_t
+pylibsrtp_session_check_rejected(pylibsrtp_session_t *s, int64_t ssrc)
+{
+    pylibsrtp_reject_t *entry;
+
+    if (ssrc < 0)
+        return srtp_err_status_ok;
+    entry = &s->rejects[pylibsrtp_ssrc_hash((uint32_t)ssrc,
+                                            PYLIBSRTP_REJECT_BITS)];
+    if (entry->ssrc != ssrc || entry->status == srtp_err_status_ok)
+        return srtp_err_status_ok;
+    if (entry->time <= pylibsrtp_now()) {
+        entry->ssrc = -1;
+        return srtp_err_status_ok;
+    }
+    s->rejected++;
+    return entry->status;
+}
+
+/* Counts a failure to unprotect a packet of an SSRC without a stream, and
+ * rejects the SSRC once it failed too often. An entry taken by another SSRC
+ * is reused unless that SSRC is currently rejected. */
+static void pylibsrtp_session_count_failure(pylibsrtp_session_t *s,
+                                            uint32_t ssrc,
+                                            srtp_err_status_t status)
+{
+    pylibsrtp_reject_t *entry =
+        &s->rejects[pylibsrtp_ssrc_hash(ssrc, PYLIBSRTP_REJECT_BITS)];
+    double now = pylibsrtp_now();
+
+    if (entry->ssrc == ssrc && entry->status == srtp_err_status_ok &&
+        entry->time > now - s->reject_window) {
+        entry->failures++;
+    } else if (entry->ssrc < 0 || entry->status == srtp_err_status_ok ||
+               entry->time <= now) {
+        entry->ssrc = ssrc;
+        entry->failures = 1;
+        entry->status = srtp_err_status_ok;
+        entry->time = now;
+    } else {
+        return;
+    }
+    if (entry->failures >= s->reject_threshold) {
+        entry->status = status;
+        entry->time = now + s->reject_window;
+    }
+}
+
+/* Returns the number of SSRCs currently rejected. */
+static unsigned int
+pylibsrtp_session_rejected_ssrcs(const pylibsrtp_session_t *s)
+{
+    unsigned int count = 0;
+    double now;
+    int i;
+
+    if (s->rejects == NULL)
+        return 0;
+    now = pylibsrtp_now();
+    for (i = 0; i < (1 << PYLIBSRTP_REJECT_BITS); i++) {
+        if (s->rejects[i].ssrc >= 0 &&
+            s->rejects[i].status != srtp_err_status_ok &&
+            s->rejects[i].time > now)
+            count++;
+    }
+    return count;
+}
+
+static void pylibsrtp_session_dealloc(pylibsrtp_session_t *s)
+{
+    if (s->ctx != NULL)
+        srtp_dealloc(s->ctx);
+    free(s->ssrcs);
+    free(s->rejects);
+}
+
+/* Returns the length of the trailer added when protecting an RTP or RTCP
+ * packet, or the worst case if the session has no streams yet. */
+static int pylibsrtp_session_trailer(pylibsrtp_session_t *s, int rtcp)
+{
+    uint32_t length;
+    srtp_err_status_t status;
+
+    if (s->trailers[rtcp] == 0) {
+        if (rtcp)
+            status = srtp_get_protect_rtcp_trailer_length(s->ctx, s->mki[0],
+                                                          s->mki[1], &length);
+        else
+            status = srtp_get_protect_trailer_length(s->ctx, s->mki[0],
+                                                     s->mki[1], &length);
+        if (status != srtp_err_status_ok && rtcp)
+            length = PYLIBSRTP_MAX_SRTCP_TRAILER_LEN;
+        else if (status != srtp_err_status_ok)
+            length = SRTP_MAX_TRAILER_LEN;
+        s->trailers[rtcp] = (int)length;
+    }
+    return s->trailers[rtcp];
+}
+
+/* Stores the SSRC and sequence number of a packet in the session. Returns
+ * bad_param if the packet is protected and its trailer would not fit in
+ * size bytes, the status its packets get if it is unprotected and its SSRC
+ * is rejected, or ok. */
+static srtp_err_status_t pylibsrtp_session_start(pylibsrtp_session_t *s,
+                                                 int op, const char *packet,
+                                                 int length, int size)
+{
+    int rtcp = (op == PYLIBSRTP_PROTECT_RTCP || op == PYLIBSRTP_UNPROTECT_RTCP);
+
+    s->ssrc = pylibsrtp_packet_ssrc(packet, length, rtcp, &s->seq);
+    if (op < PYLIBSRTP_UNPROTECT) {
+        if (length + pylibsrtp_session_trailer(s, rtcp) > size)
+            return srtp_err_status_bad_param;
+    } else if (s->rejects != NULL)
+        return pylibsrtp_session_check_rejected(s, s->ssrc);
+    return srtp_err_status_ok;
+}
+
+/* Protects or unprotects a packet in place once pylibsrtp_session_start()
+ * accepted it, and updates the session's counters. */
+static srtp_err_status_t pylibsrtp_session_run(pylibsrtp_session_t *s, int op,
+                                               char *packet, int *len_p)
+{
+    uint64_t *counters = s->counters[op];
+    int length = *len_p;
+    srtp_err_status_t status;
+
+    status = pylibsrtp_process(s->ctx, op, packet, len_p, s->mki);
+    if (status == srtp_err_status_ok) {
+        counters[0]++;
+        counters[1] += length;
+        if (s->cloning && s->ssrc >= 0 &&
+            pylibsrtp_session_add_ssrc(s, (uint32_t)s->ssrc) == 1)
+            s->clones++;
+    } else {
+        counters[2]++;
+        if (status == srtp_err_status_replay_old)
+            counters[3]++;
+        else if (status == srtp_err_status_replay_fail)
+            counters[4]++;
+        if ((unsigned int)status < PYLIBSRTP_ERROR_CODES)
+            s->errors[status]++;
+        if (s->rejects != NULL && op >= PYLIBSRTP_UNPROTECT && s->ssrc >= 0 &&
+            (status == srtp_err_status_auth_fail ||
+             status == srtp_err_status_no_ctx) &&
+            !pylibsrtp_session_has_ssrc(s, (uint32_t)s->ssrc))
+            pylibsrtp_session_count_failure(s, (uint32_t)s->ssrc, status);
+    }
+    return status;
+}
+
+/* Protects or unprotects a packet in place, given the size of the room it
+ * is in, unless pylibsrtp_session_start() refuses it. */
+static srtp_err_status_t pylibsrtp_session_process(pylibsrtp_session_t *s,
+                                                   int op, char *packet,
+                                                   int *len_p, int size)
+{
+    srtp_err_status_t status =
+        pylibsrtp_session_start(s, op, packet, *len_p, size);
+
+    if (status != srtp_err_status_ok)
+        return status;
+    return pylibsrtp_session_run(s, op, packet, len_p);
+}
+
+/* Processes a packet of *len_p bytes like pylibsrtp_session_process(),
+ * copying it from src to dst first unless they are the same. dst holds size
+ * bytes. Packets which are refused are not copied. */
+static srtp_err_status_t pylibsrtp_session_call(pylibsrtp_session_t *s, int op,
+                                                const char *src, char *dst,
+                                                int *len_p, int size)
+{
+    srtp_err_status_t status = pylibsrtp_session_start(s, op, src, *len_p, size);
+
+    if (status != srtp_err_status_ok)
+        return status;
+    if (src != dst)
+        memcpy(dst, src, *len_p);
+    return pylibsrtp_session_run(s, op, dst, len_p);
+}
+
+/* Classifies a packet received on a socket shared by several protocols by
+ * its first byte, see RFC 7983, and tells RTCP from RTP by its packet type,
+ * see RFC 5761. For RTP and RTCP, PYLIBSRTP_KIND_VALID is set if the packet
+ * is long enough for its header, including the CSRCs and header extension
+ * of RTP packets and the length of the first RTCP packet. */
+static int pylibsrtp_classify(const char *packet, int length)
+{
+    const unsigned char *p = (const unsigned char *)packet;
+    int header;
+
+    if (length < 1)
+        return PYLIBSRTP_KIND_UNKNOWN;
+    if (p[0] <= 3)
+        return PYLIBSRTP_KIND_STUN;
+    if (p[0] >= 16 && p[0] <= 19)
+        return PYLIBSRTP_KIND_ZRTP;
+    if (p[0] >= 20 && p[0] <= 63)
+        return PYLIBSRTP_KIND_DTLS;
+    if (p[0] >= 64 && p[0] <= 79)
+        return PYLIBSRTP_KIND_TURN;
+    if (p[0] < 128 || p[0] > 191)
+        return PYLIBSRTP_KIND_UNKNOWN;
+
+    if (length >= 2 && (p[1] & 0x7f) >= 64 && (p[1] & 0x7f) <= 95) {
+        if (length >= 8 && 4 * (((p[2] << 8) | p[3]) + 1) <= length)
+            return PYLIBSRTP_KIND_RTCP | PYLIBSRTP_KIND_VALID;
+        return PYLIBSRTP_KIND_RTCP;
+    }
+
+    header = 12 + 4 * (p[0] & 0x0f);
+    if (length >= header && (p[0] & 0x10)) {
+        if (length < header + 4)
+            return PYLIBSRTP_KIND_RTP;
+        header += 4 + 4 * ((p[header + 2] << 8) | p[header + 3]);
+    }
+    if (length >= header)
+        return PYLIBSRTP_KIND_RTP | PYLIBSRTP_KIND_VALID;
+    return PYLIBSRTP_KIND_RTP;
+}
+
+static void pylibsrtp_classify_many(const char *buffer, const int *offsets,
+                                    const int *lengths, int *kinds, int count)
+{
+    int i;
+
+    for (i = 0; i < count; i++)
+        kinds[i] = pylibsrtp_classify(buffer + offsets[i], lengths[i]);
+}
+
+/* Returns the operation which unprotects a packet, PYLIBSRTP_UNPROTECT or
+ * PYLIBSRTP_UNPROTECT_RTCP, or -1 if it is neither SRTP nor SRTCP. */
+static int pylibsrtp_unprotect_op(const char *packet, int length)
+{
+    switch (pylibsrtp_classify(packet, length) & ~PYLIBSRTP_KIND_VALID) {
+    case PYLIBSRTP_KIND_RTP:
+        return PYLIBSRTP_UNPROTECT;
+    case PYLIBSRTP_KIND_RTCP:
+        return PYLIBSRTP_UNPROTECT_RTCP;
+    default:
+        return -1;
+    }
+}
+
+/* Processes the packets of a batch, each followed by trailer bytes of room,
+ * or only those whose index is listed in indices if it is not NULL, in
+ * which case count is the number of indices. */
+static void pylibsrtp_process_many(pylibsrtp_session_t *s, int op,
+                                   char *buffer, const int *offsets,
+                                   int *lengths, int trailer, int *statuses,
+                                   int64_t *ssrcs, int *seqs,
+                                   const int *indices, int count)
+{
+    int i, j;
+
+    for (j = 0; j < count; j++) {
+        i = indices != NULL ? indices[j] : j;
+        statuses[i] = pylibsrtp_session_process(
+            s, op, buffer + offsets[i], &lengths[i], lengths[i] + trailer);
+        ssrcs[i] = s->ssrc;
+        seqs[i] = s->seq;
+    }
+}
+
+/* Unprotects each packet as SRTP or SRTCP depending on its packet type, and
+ * stores the operation used in ops. Packets which are neither get -1 and a
+ * bad_param status. */
+static void pylibsrtp_unprotect_auto_many(pylibsrtp_session_t *s,
+                                          char *buffer, const int *offsets,
+                                          int *lengths, int *statuses,
+                                          int64_t *ssrcs, int *seqs, int *ops,
+                                          int count)
+{
+    int i;
+    char *packet;
+
+    for (i = 0; i < count; i++) {
+        packet = buffer + offsets[i];
+        ops[i] = pylibsrtp_unprotect_op(packet, lengths[i]);
+        if (ops[i] < 0) {
+            ssrcs[i] = -1;
+            seqs[i] = -1;
+            statuses[i] = srtp_err_status_bad_param;
+            continue;
+        }
+        statuses[i] =
+            pylibsrtp_session_process(s, ops[i], packet, &lengths[i], lengths[i]);
+        ssrcs[i] = s->ssrc;
+        seqs[i] = s->seq;
+    }
+}
+
+/* Looks up the session for an SSRC in an open-addressing hash table of
+ * 2^bits slots, using Fibonacci hashing and linear probing. Returns the
+ * slot index, or -1 if the SSRC is not in the table. */
+static int pylibsrtp_table_lookup(const uint32_t *keys,
+                                  pylibsrtp_session_t **sessions, int bits,
+                                  uint32_t ssrc)
+{
+    uint32_t mask = ((uint32_t)1 << bits) - 1;
+    uint32_t slot = pylibsrtp_ssrc_hash(ssrc, bits);
+
+    while (sessions[slot] != NULL) {
+        if (keys[slot] == ssrc)
+            return (int)slot;
+        slot = (slot + 1) & mask;
+    }
+    return -1;
+}
+
+/* Stores the table slot of the session for each packet of a batch in
+ * slots. Packets too short to hold an SSRC get a bad_param status and those
+ * whose SSRC is not in the table a no_ctx status, with a slot of -1. */
+static void pylibsrtp_table_lookup_many(const uint32_t *keys,
+                                        pylibsrtp_session_t **sessions,
+                                        int bits, int op, const char *buffer,
+                                        const int *offsets, const int *lengths,
+                                        int *statuses, int *slots, int count)
+{
+    int i, seq;
+    int rtcp = (op == PYLIBSRTP_PROTECT_RTCP || op == PYLIBSRTP_UNPROTECT_RTCP);
+    int64_t ssrc;
+
+    for (i = 0; i < count; i++) {
+        ssrc = pylibsrtp_packet_ssrc(buffer + offsets[i], lengths[i], rtcp,
+                                     &seq);
+        if (ssrc < 0) {
+            slots[i] = -1;
+            statuses[i] = srtp_err_status_bad_param;
+            continue;
+        }
+        slots[i] = pylibsrtp_table_lookup(keys, sessions, bits, (uint32_t)ssrc);
+        statuses[i] = slots[i] < 0 ? srtp_err_status_no_ctx : srtp_err_status_ok;
+    }
+}
+""",
+    libraries=libraries,
 )
 
 ffibuilder.cdef(
     """
 typedef enum {
   srtp_err_status_ok = 0,
+  srtp_err_status_bad_param = 2,
+  srtp_err_status_replay_fail = 9,
+  srtp_err_status_replay_old = 10,
   ...
 } srtp_err_status_t;
 
@@ -47,18 +687,30 @@ typedef struct {
 typedef struct srtp_ctx_t_ srtp_ctx_t;
 typedef srtp_ctx_t *srtp_t;
 
+typedef struct srtp_master_key_t {
+  unsigned char *key;
+  unsigned char *mki_id;
+  unsigned int mki_size;
+} srtp_master_key_t;
+
 typedef struct srtp_policy_t {
   srtp_ssrc_t ssrc;
   srtp_crypto_policy_t rtp;
   srtp_crypto_policy_t rtcp;
   unsigned char *key;
+  srtp_master_key_t **keys;
+  unsigned long num_master_keys;
   unsigned long window_size;
   int allow_repeat_tx;
+  int *enc_xtn_hdr;
+  int enc_xtn_hdr_count;
   ...;
 } srtp_policy_t;
 
 srtp_err_status_t srtp_init(void);
 
+const char *srtp_get_version_string(void);
+
 srtp_err_status_t srtp_create(srtp_t *session, const srtp_policy_t *policy);
 srtp_err_status_t srtp_dealloc(srtp_t s);
 
@@ -75,12 +727,102 @@ unsigned int srtp_profile_get_master_salt_length(srtp_profile_t profile);
 
 srtp_err_status_t srtp_add_stream(srtp_t session, const srtp_policy_t *policy);
 srtp_err_status_t srtp_remove_stream(srtp_t session, unsigned int ssrc);
+srtp_err_status_t srtp_update(srtp_t session, const srtp_policy_t *policy);
+srtp_err_status_t srtp_update_stream(srtp_t session, const srtp_policy_t *policy);
 
 srtp_err_status_t srtp_protect(srtp_t ctx, void *rtp_hdr, int *len_ptr);
 srtp_err_status_t srtp_protect_rtcp(srtp_t ctx, void *rtcp_hdr, int *pkt_octet_len);
 
 srtp_err_status_t srtp_unprotect(srtp_t ctx, void *srtp_hdr, int *len_ptr);
 srtp_err_status_t srtp_unprotect_rtcp(srtp_t ctx, void *srtcp_hdr, int *pkt_octet_len);
+
+srtp_err_status_t srtp_get_protect_trailer_length(
+    srtp_t session, uint32_t use_mki, uint32_t mki_index, uint32_t *length);
+srtp_err_status_t srtp_get_protect_rtcp_trailer_length(
+    srtp_t session, uint32_t use_mki, uint32_t mki_index, uint32_t *length);
+
+srtp_err_status_t srtp_set_stream_roc(srtp_t session, uint32_t ssrc, uint32_t roc);
+srtp_err_status_t srtp_get_stream_roc(srtp_t session, uint32_t ssrc, uint32_t *roc);
+
+#define PYLIBSRTP_PROTECT ...
+#define PYLIBSRTP_PROTECT_RTCP ...
+#define PYLIBSRTP_UNPROTECT ...
+#define PYLIBSRTP_UNPROTECT_RTCP ...
+#define PYLIBSRTP_UNPROTECT_AUTO ...
+
+#define PYLIBSRTP_KIND_UNKNOWN ...
+#define PYLIBSRTP_KIND_STUN ...
+#define PYLIBSRTP_KIND_ZRTP ...
+#define PYLIBSRTP_KIND_DTLS ...
+#define PYLIBSRTP_KIND_TURN ...
+#define PYLIBSRTP_KIND_RTP ...
+#define PYLIBSRTP_KIND_RTCP ...
+#define PYLIBSRTP_KIND_VALID ...
+
+#define PYLIBSRTP_CPU_AES ...
+#define PYLIBSRTP_CPU_CLMUL ...
+
+#define PYLIBSRTP_HASHED_STREAM_LIST ...
+
+typedef struct {
+    int64_t ssrc;
+    int failures;
+    srtp_err_status_t status;
+    double time;
+} pylibsrtp_reject_t;
+
+typedef struct {
+    srtp_t ctx;
+    unsigned int mki[2];
+    uint64_t counters[4][5];
+    uint64_t errors[32];
+    int trailers[2];
+    int64_t ssrc;
+    int seq;
+    int cloning;
+    uint64_t clones;
+    int64_t *ssrcs;
+    int ssrc_bits;
+    unsigned int ssrc_count;
+    pylibsrtp_reject_t *rejects;
+    int reject_threshold;
+    double reject_window;
+    uint64_t rejected;
+} pylibsrtp_session_t;
+
+int pylibsrtp_cpu_features(void);
+
+int pylibsrtp_session_add_ssrc(pylibsrtp_session_t *s, uint32_t ssrc);
+int pylibsrtp_session_enable_rejects(pylibsrtp_session_t *s, int threshold,
+                                     double window);
+unsigned int pylibsrtp_session_rejected_ssrcs(const pylibsrtp_session_t *s);
+void pylibsrtp_session_discard_ssrc(pylibsrtp_session_t *s, uint32_t ssrc);
+void pylibsrtp_session_dealloc(pylibsrtp_session_t *s);
+int pylibsrtp_session_trailer(pylibsrtp_session_t *s, int rtcp);
+srtp_err_status_t pylibsrtp_session_call(pylibsrtp_session_t *s, int op,
+                                         const char *src, char *dst,
+                                         int *len_p, int size);
+
+int64_t pylibsrtp_packet_ssrc(const char *packet, int length, int rtcp,
+                              int *seq);
+int pylibsrtp_classify(const char *packet, int length);
+void pylibsrtp_classify_many(const char *buffer, const int *offsets,
+                             const int *lengths, int *kinds, int count);
+int pylibsrtp_unprotect_op(const char *packet, int length);
+void pylibsrtp_process_many(pylibsrtp_session_t *s, int op, char *buffer,
+                            const int *offsets, int *lengths, int trailer,
+                            int *statuses, int64_t *ssrcs, int *seqs,
+                            const int *indices, int count);
+void pylibsrtp_unprotect_auto_many(pylibsrtp_session_t *s,
+                                   char *buffer, const int *offsets,
+                                   int *lengths, int *statuses,
+                                   int64_t *ssrcs, int *seqs, int *ops,
+                                   int count);
+void pylibsrtp_table_lookup_many(const uint32_t *keys,
+                                 pylibsrtp_session_t **sessions,
+                                 int bits, int op, const char *buffer,
+                                 const int *offsets, const int *lengths,
+                                 int *statuses, int *slots, int count);
 """
 )
 
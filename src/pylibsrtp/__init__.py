@@ -1,9 +1,39 @@
-from socket import htonl
-from typing import Optional
+import enum
+import itertools
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 from ._binding import ffi, lib
 
-__all__ = ["Error", "Policy", "Session", "__version__"]
+__all__ = [
+    "BufferPool",
+    "Error",
+    "ErrorCode",
+    "PacketKind",
+    "Policy",
+    "Session",
+    "SessionGroup",
+    "__version__",
+    "capabilities",
+    "classify",
+    "classify_many",
+    "init",
+]
 __version__ = "0.12.0"
 
 
@@ -45,23 +75,442 @@ SRTP_MAX_TRAILER_LEN = 16 + 128
 # SRTP_SRCTP_INDEX_LEN + SRTP_MAX_TAG_LEN + SRTP_MAX_MKI_LEN
 SRTP_MAX_SRTCP_TRAILER_LEN = 4 + 16 + 128
 
+# SRTP_MAX_MKI_LEN
+SRTP_MAX_MKI_LEN = 128
+
+# SRTP_MAX_NUM_MASTER_KEYS
+SRTP_MAX_NUM_MASTER_KEYS = 16
+
+
+class ErrorCode(enum.IntEnum):
+    """
+    Status codes returned by `libsrtp`, whose descriptions are in
+    :data:`ERRORS`.
+    """
+
+    OK = 0
+    FAIL = 1
+    BAD_PARAM = 2
+    ALLOC_FAIL = 3
+    DEALLOC_FAIL = 4
+    INIT_FAIL = 5
+    TERMINUS = 6
+    AUTH_FAIL = 7
+    CIPHER_FAIL = 8
+    REPLAY_FAIL = 9
+    REPLAY_OLD = 10
+    ALGO_FAIL = 11
+    NO_SUCH_OP = 12
+    NO_CTX = 13
+    CANT_CHECK = 14
+    KEY_EXPIRED = 15
+    SOCKET_ERR = 16
+    SIGNAL_ERR = 17
+    NONCE_BAD = 18
+    READ_FAIL = 19
+    WRITE_FAIL = 20
+    PARSE_ERR = 21
+    ENCODE_ERR = 22
+    SEMAPHORE_ERR = 23
+    PFKEY_ERR = 24
+    BAD_MKI = 25
+    PKT_IDX_OLD = 26
+    PKT_IDX_ADV = 27
+
+
+class PacketKind(enum.IntEnum):
+    """
+    Kinds of packets told apart by :func:`classify`.
+    """
+
+    UNKNOWN = lib.PYLIBSRTP_KIND_UNKNOWN
+    STUN = lib.PYLIBSRTP_KIND_STUN
+    ZRTP = lib.PYLIBSRTP_KIND_ZRTP
+    DTLS = lib.PYLIBSRTP_KIND_DTLS
+    TURN = lib.PYLIBSRTP_KIND_TURN
+    RTP = lib.PYLIBSRTP_KIND_RTP
+    RTCP = lib.PYLIBSRTP_KIND_RTCP
+
+
+# Results of classify(), indexed by the value pylibsrtp_classify() returns.
+_CLASSIFY_RESULTS: Dict[int, Tuple[PacketKind, bool]] = {
+    kind | (lib.PYLIBSRTP_KIND_VALID if valid else 0): (kind, valid)
+    for kind in PacketKind
+    for valid in (False, True)
+}
+
 
 class Error(Exception):
     """
     Error that occurred making a `libsrtp` API call.
+
+    The message is the description of the error, and :attr:`code` the
+    :class:`ErrorCode` returned by `libsrtp`.
     """
 
-    pass
+    def __init__(self, message: str, code: int = ErrorCode.FAIL) -> None:
+        super().__init__(message)
+        #: The :class:`ErrorCode` returned by `libsrtp`.
+        self.code = ErrorCode(code)
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (Error, (str(self), self.code))
+
+
+# Names of the operations, indexed by PYLIBSRTP_* operation code.
+_OPERATIONS = ("protect", "protect_rtcp", "unprotect", "unprotect_rtcp")
+
+
+class _Scratch(threading.local):
+    """
+    Per-thread scratch buffer used to stage packets passed to `libsrtp`.
+    """
+
+    def __init__(self) -> None:
+        self.len_p = ffi.new("int *")
+        self.resize(1500)
+
+    def resize(self, size: int) -> None:
+        self.size = size
+        self.cdata = ffi.new("char[]", size)
+        self.buffer = ffi.buffer(self.cdata)
+
+
+_scratch = _Scratch()
 
 
 def _srtp_assert(rc):
     if rc != lib.srtp_err_status_ok:
-        raise Error(ERRORS[rc])
+        raise Error(ERRORS[rc], rc)
+
+
+def _copy_bytes(data: bytes) -> Any:
+    # Policies own a copy of their keys, which the key getter exposes.
+    cdata = ffi.new("unsigned char[]", len(data))
+    cdata[0 : len(data)] = data
+    return cdata
+
+
+def _htonl(value: int) -> int:
+    # Avoids importing socket, which noticeably slows down importing.
+    return int.from_bytes(value.to_bytes(4, "big"), sys.byteorder)
+
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init() -> None:
+    """
+    Initialize `libsrtp`, which sets up its crypto kernel and runs the
+    cipher self-tests.
+
+    This is done automatically when the first :class:`Session` is created,
+    so importing :mod:`pylibsrtp` stays cheap. Call this function to pay the
+    cost up front instead. It is thread-safe and only initializes `libsrtp`
+    once.
+    """
+    global _initialized
+
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                _srtp_assert(lib.srtp_init())
+                _initialized = True
+
+
+# Policy templates with the RTP and RTCP crypto policies filled in, and the
+# expected key length, indexed by SRTP profile.
+_profile_templates: Dict[int, Tuple[Any, int]] = {}
+
+
+def _profile_template(srtp_profile: int) -> Tuple[Any, int]:
+    try:
+        return _profile_templates[srtp_profile]
+    except KeyError:
+        pass
+
+    template = ffi.new("srtp_policy_t *")
+    _srtp_assert(
+        lib.srtp_crypto_policy_set_from_profile_for_rtp(
+            ffi.addressof(template.rtp), srtp_profile
+        )
+    )
+    _srtp_assert(
+        lib.srtp_crypto_policy_set_from_profile_for_rtcp(
+            ffi.addressof(template.rtcp), srtp_profile
+        )
+    )
+    key_length = lib.srtp_profile_get_master_key_length(
+        srtp_profile
+    ) + lib.srtp_profile_get_master_salt_length(srtp_profile)
+    _profile_templates[srtp_profile] = (template, key_length)
+    return template, key_length
+
+
+_capabilities: Optional[Dict[str, Any]] = None
+
+
+def capabilities() -> Dict[str, Any]:
+    """
+    Report which SRTP profiles are available and whether they are
+    hardware-accelerated.
+
+    The returned dictionary has the following keys:
+
+    - ``cpu``: whether the CPU provides the ``aes`` and ``clmul``
+      instructions (AES-NI and PCLMULQDQ on x86, the AES and PMULL
+      cryptography extensions on ARM).
+    - ``profiles``: a dictionary indexed by SRTP profile, such as
+      :attr:`Policy.SRTP_PROFILE_AEAD_AES_128_GCM`, whose values are
+      dictionaries with ``available`` and ``accelerated`` flags.
+    - ``hashed_stream_list``: whether `libsrtp` finds the stream of each
+      packet using a hash table rather than by searching its streams
+      linearly, which matters for sessions with many streams. This is only
+      the case when `libsrtp` was built by ``scripts/build-libsrtp.py`` with
+      ``PYLIBSRTP_HASHED_STREAM_LIST=1``, which is experimental.
+
+    AES-GCM is only available when libsrtp2 was built against a crypto
+    library such as OpenSSL, which is the case for the published wheels. That
+    library then also provides AES-CM, and uses the CPU's instructions when
+    present, so a profile is reported as accelerated if it is available, an
+    AES-GCM profile is available and the CPU provides the instructions the
+    profile needs.
+    """
+    global _capabilities
+
+    if _capabilities is None:
+        features = lib.pylibsrtp_cpu_features()
+        cpu = {
+            "aes": bool(features & lib.PYLIBSRTP_CPU_AES),
+            "clmul": bool(features & lib.PYLIBSRTP_CPU_CLMUL),
+        }
+
+        available = {}
+        for srtp_profile in (
+            lib.srtp_profile_aes128_cm_sha1_80,
+            lib.srtp_profile_aes128_cm_sha1_32,
+            lib.srtp_profile_aead_aes_128_gcm,
+            lib.srtp_profile_aead_aes_256_gcm,
+        ):
+            try:
+                _profile_template(srtp_profile)
+            except Error:
+                available[srtp_profile] = False
+            else:
+                available[srtp_profile] = True
+        external_crypto = available[lib.srtp_profile_aead_aes_128_gcm]
+
+        profiles = {}
+        for srtp_profile, is_available in available.items():
+            is_gcm = srtp_profile in (
+                lib.srtp_profile_aead_aes_128_gcm,
+                lib.srtp_profile_aead_aes_256_gcm,
+            )
+            profiles[srtp_profile] = {
+                "available": is_available,
+                "accelerated": is_available
+                and external_crypto
+                and cpu["aes"]
+                and (cpu["clmul"] or not is_gcm),
+            }
+        _capabilities = {
+            "cpu": cpu,
+            "profiles": profiles,
+            "hashed_stream_list": bool(lib.PYLIBSRTP_HASHED_STREAM_LIST),
+        }
+
+    return {
+        "cpu": dict(_capabilities["cpu"]),
+        "hashed_stream_list": _capabilities["hashed_stream_list"],
+        "profiles": {
+            srtp_profile: dict(flags)
+            for srtp_profile, flags in _capabilities["profiles"].items()
+        },
+    }
+
+
+class BufferPool:
+    """
+    Pool of reusable packet buffers.
+
+    Buffers are handed out as writable :class:`memoryview` objects of
+    `buffer_size` bytes, which can be filled with a packet and passed to
+    methods such as :meth:`Session.protect_into` or
+    :meth:`Session.unprotect_into`. Once the caller is done with a buffer it
+    should be returned with :meth:`release`, or the :meth:`borrow` context
+    manager should be used. At most `capacity` idle buffers are kept.
+    """
+
+    def __init__(self, buffer_size: int = 1500, capacity: int = 64) -> None:
+        self._buffer_size = buffer_size
+        self._capacity = capacity
+        self._free: List[bytearray] = []
+        # The views handed out, indexed by identity, and their buffers.
+        self._in_use: Dict[int, Tuple[memoryview, bytearray]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._discards = 0
+
+    @property
+    def buffer_size(self) -> int:
+        """
+        The size of each buffer in bytes.
+        """
+        return self._buffer_size
+
+    def acquire(self) -> memoryview:
+        """
+        Take a buffer from the pool, allocating a new one if none is idle.
+
+        :rtype: :class:`memoryview`
+        """
+        with self._lock:
+            if self._free:
+                self._hits += 1
+                buffer = self._free.pop()
+            else:
+                self._misses += 1
+                buffer = bytearray(self._buffer_size)
+            view = memoryview(buffer)
+            self._in_use[id(view)] = (view, buffer)
+        return view
+
+    def release(self, view: memoryview) -> None:
+        """
+        Return a buffer obtained from :meth:`acquire` to the pool.
+
+        The `view` must be the one returned by :meth:`acquire`, not a slice of
+        it. It is released and must not be used afterwards.
+
+        :param view: :class:`memoryview`
+        """
+        with self._lock:
+            entry = self._in_use.get(id(view))
+            if entry is None or entry[0] is not view:
+                raise ValueError("buffer does not belong to this pool")
+            del self._in_use[id(view)]
+            buffer = entry[1]
+            view.release()
+            if len(self._free) < self._capacity:
+                self._free.append(buffer)
+            else:
+                self._discards += 1
+
+    @contextmanager
+    def borrow(self) -> Iterator[memoryview]:
+        """
+        Context manager which acquires a buffer and releases it on exit.
+        """
+        view = self.acquire()
+        try:
+            yield view
+        finally:
+            self.release(view)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return a snapshot of the pool's counters.
+
+        `hits` and `misses` count the acquisitions which did or did not find
+        an idle buffer, `discards` counts the buffers dropped on release
+        because the pool was full. `idle` and `in_use` give the current number
+        of buffers in each state.
+
+        :rtype: :class:`dict`
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "discards": self._discards,
+                "idle": len(self._free),
+                "in_use": len(self._in_use),
+            }
+
+
+class _Batch:
+    """
+    Batch of packets laid out back to back in a single buffer, each one
+    followed by room for its trailer.
+    """
+
+    def __init__(self, packets: Sequence[bytes], trailer: int) -> None:
+        self.trailer = trailer
+        self.offsets: List[int] = []
+        self.lengths: List[int] = []
+        size = 0
+        for data in packets:
+            if not isinstance(data, bytes):
+                raise TypeError("packet must be bytes")
+            self.offsets.append(size)
+            self.lengths.append(len(data))
+            size += len(data) + trailer
+        self.count = len(self.offsets)
+
+        padding = bytes(trailer)
+        self.cdata = ffi.new("char[]", padding.join(packets) + padding)
+        self.offsets_p = ffi.new("int[]", self.offsets)
+        self.lengths_p = ffi.new("int[]", self.lengths)
+        self.statuses_p = ffi.new("int[]", self.count)
+        self.ssrcs_p = ffi.new("int64_t[]", self.count)
+        self.seqs_p = ffi.new("int[]", self.count)
+
+    def results(self, statuses: List[int]) -> List[Tuple[int, Optional[bytes]]]:
+        buffer = ffi.buffer(self.cdata)
+        results: List[Tuple[int, Optional[bytes]]] = []
+        for offset, length, status in zip(
+            self.offsets, ffi.unpack(self.lengths_p, self.count), statuses
+        ):
+            if status == lib.srtp_err_status_ok:
+                results.append((status, buffer[offset : offset + length]))
+            else:
+                results.append((status, None))
+        return results
+
+
+def classify(packet: bytes) -> Tuple[PacketKind, bool]:
+    """
+    Classify a packet received on a socket shared by several protocols.
+
+    The kind of the packet is determined by its first byte as described in
+    :rfc:`7983`, and RTCP is told apart from RTP by its packet type as
+    described in :rfc:`5761`. The second item of the result tells whether an
+    RTP or RTCP packet is long enough for its header, including the CSRCs and
+    header extension of RTP packets, and the length of the first packet of an
+    RTCP compound packet. It is always false for other kinds of packets.
+
+    :param packet: :class:`bytes`
+    :rtype: :class:`tuple`
+    """
+    if not isinstance(packet, bytes):
+        raise TypeError("packet must be bytes")
+    return _CLASSIFY_RESULTS[lib.pylibsrtp_classify(packet, len(packet))]
+
+
+def classify_many(packets: Sequence[bytes]) -> List[Tuple[PacketKind, bool]]:
+    """
+    Classify a batch of `packets`, as :func:`classify` does.
+
+    :param packets: sequence of :class:`bytes`
+    :rtype: :class:`list` of :class:`tuple`
+    """
+    batch = _Batch(packets, 0)
+    kinds_p = ffi.new("int[]", batch.count)
+    lib.pylibsrtp_classify_many(
+        batch.cdata, batch.offsets_p, batch.lengths_p, kinds_p, batch.count
+    )
+    return [_CLASSIFY_RESULTS[kind] for kind in ffi.unpack(kinds_p, batch.count)]
 
 
 class Policy:
     """
     Policy for single SRTP stream.
+
+    The crypto policies for each SRTP profile are only computed once, so
+    creating a policy is cheap. To derive several policies which only differ
+    by their key or SSRC, use :meth:`copy`.
     """
 
     #: AES-128 CM mode with 80-bit authentication tag (default)
@@ -89,24 +538,76 @@ class Policy:
         ssrc_value: int = 0,
         srtp_profile: int = SRTP_PROFILE_AES128_CM_SHA1_80,
     ) -> None:
-        self._policy = ffi.new("srtp_policy_t *")
+        template, self._key_length = _profile_template(srtp_profile)
+        self._policy = ffi.new("srtp_policy_t *", template[0])
         self._srtp_profile = srtp_profile
-
-        _srtp_assert(
-            lib.srtp_crypto_policy_set_from_profile_for_rtp(
-                ffi.addressof(self._policy.rtp), srtp_profile
-            )
-        )
-        _srtp_assert(
-            lib.srtp_crypto_policy_set_from_profile_for_rtcp(
-                ffi.addressof(self._policy.rtcp), srtp_profile
-            )
-        )
+        self.__master_keys: List[Tuple[bytes, bytes]] = []
+        self.__master_keys_cdata: Any = None
+        self.__enc_xtn_hdr: List[int] = []
+        self.__enc_xtn_hdr_cdata: Any = None
 
         self.key = key
         self.ssrc_type = ssrc_type
         self.ssrc_value = ssrc_value
 
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "allow_repeat_tx": self.allow_repeat_tx,
+            "enc_xtn_hdr": self.enc_xtn_hdr,
+            "key": None if self.__cdata is None else bytes(self.key),
+            "master_keys": self.master_keys,
+            "srtp_profile": self.srtp_profile,
+            "ssrc_type": self.ssrc_type,
+            "ssrc_value": self.ssrc_value,
+            "window_size": self.window_size,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(
+            key=state["key"],
+            ssrc_type=state["ssrc_type"],
+            ssrc_value=state["ssrc_value"],
+            srtp_profile=state["srtp_profile"],
+        )
+        if state["master_keys"]:
+            self.master_keys = state["master_keys"]
+        self.allow_repeat_tx = state["allow_repeat_tx"]
+        self.enc_xtn_hdr = state["enc_xtn_hdr"]
+        self.window_size = state["window_size"]
+
+    def copy(
+        self,
+        key: Optional[bytes] = None,
+        ssrc_type: Optional[int] = None,
+        ssrc_value: Optional[int] = None,
+    ) -> "Policy":
+        """
+        Return a copy of this policy, with the given `key`, `ssrc_type` and
+        `ssrc_value` if they are not `None`.
+
+        The copy gets its own copy of the key, since :attr:`key` can be
+        modified in place, while the master keys are shared.
+        """
+        policy = Policy.__new__(Policy)
+        policy._key_length = self._key_length
+        policy._policy = ffi.new("srtp_policy_t *", self._policy[0])
+        policy._srtp_profile = self._srtp_profile
+        policy.__cdata = None
+        if key is None and self.__cdata is not None:
+            policy.__cdata = _copy_bytes(ffi.buffer(self.__cdata)[:])
+            policy._policy.key = policy.__cdata
+        policy.__master_keys = self.__master_keys
+        policy.__master_keys_cdata = self.__master_keys_cdata
+        policy.__enc_xtn_hdr = self.__enc_xtn_hdr
+        policy.__enc_xtn_hdr_cdata = self.__enc_xtn_hdr_cdata
+        if key is not None:
+            policy.key = key
+        if ssrc_type is not None:
+            policy.ssrc_type = ssrc_type
+        if ssrc_value is not None:
+            policy.ssrc_value = ssrc_value
+        return policy
+
     @property
     def allow_repeat_tx(self) -> bool:
         """
@@ -118,10 +619,44 @@ class Policy:
     def allow_repeat_tx(self, allow_repeat_tx: bool) -> None:
         self._policy.allow_repeat_tx = 1 if allow_repeat_tx else 0
 
+    @property
+    def enc_xtn_hdr(self) -> List[int]:
+        """
+        The IDs of the RTP header extensions to encrypt, as described in
+        :rfc:`6904`.
+
+        The extensions are encrypted and decrypted by `libsrtp` as part of
+        protecting and unprotecting packets.
+        """
+        return list(self.__enc_xtn_hdr)
+
+    @enc_xtn_hdr.setter
+    def enc_xtn_hdr(self, enc_xtn_hdr: Sequence[int]) -> None:
+        # Check the IDs are acceptable then assign them.
+        for ext_id in enc_xtn_hdr:
+            if not isinstance(ext_id, int):
+                raise TypeError("header extension IDs must be integers")
+            if not 1 <= ext_id <= 255:
+                raise ValueError("header extension IDs must be between 1 and 255")
+
+        if not enc_xtn_hdr:
+            self.__enc_xtn_hdr = []
+            self.__enc_xtn_hdr_cdata = None
+            self._policy.enc_xtn_hdr = ffi.NULL
+            self._policy.enc_xtn_hdr_count = 0
+            return
+
+        self.__enc_xtn_hdr = list(enc_xtn_hdr)
+        self.__enc_xtn_hdr_cdata = ffi.new("int[]", self.__enc_xtn_hdr)
+        self._policy.enc_xtn_hdr = self.__enc_xtn_hdr_cdata
+        self._policy.enc_xtn_hdr_count = len(self.__enc_xtn_hdr)
+
     @property
     def key(self) -> Optional[bytes]:
         """
         The SRTP master key + master salt.
+
+        Setting a key clears the :attr:`master_keys`.
         """
         if self.__cdata is None:
             return None
@@ -136,16 +671,70 @@ class Policy:
             return
 
         # Check the key is acceptable then assign it.
-        expected_length = lib.srtp_profile_get_master_key_length(
-            self._srtp_profile
-        ) + lib.srtp_profile_get_master_salt_length(self._srtp_profile)
         if not isinstance(key, bytes):
             raise TypeError("key must be bytes")
-        if len(key) < expected_length:
-            raise ValueError("key must contain at least %d bytes" % expected_length)
-        self.__cdata = ffi.new("unsigned char[]", len(key))
-        self.__cdata[0 : len(key)] = key
+        if len(key) < self._key_length:
+            raise ValueError("key must contain at least %d bytes" % self._key_length)
+        self.__cdata = _copy_bytes(key)
         self._policy.key = self.__cdata
+        self.master_keys = []
+
+    @property
+    def master_keys(self) -> List[Tuple[bytes, bytes]]:
+        """
+        The SRTP master keys, as a list of `(key, mki_id)` tuples where `key`
+        is the master key + master salt and `mki_id` is the Master Key
+        Identifier which designates it in packets.
+
+        Sessions select the key used to protect packets with
+        :attr:`Session.mki_index`. Setting master keys clears the :attr:`key`.
+        """
+        return list(self.__master_keys)
+
+    @master_keys.setter
+    def master_keys(self, master_keys: Sequence[Tuple[bytes, bytes]]) -> None:
+        # Check the keys are acceptable then assign them.
+        if len(master_keys) > SRTP_MAX_NUM_MASTER_KEYS:
+            raise ValueError(
+                "at most %d master keys are supported" % SRTP_MAX_NUM_MASTER_KEYS
+            )
+        for key, mki_id in master_keys:
+            if not isinstance(key, bytes) or not isinstance(mki_id, bytes):
+                raise TypeError("key and MKI must be bytes")
+            if len(key) < self._key_length:
+                raise ValueError(
+                    "key must contain at least %d bytes" % self._key_length
+                )
+            if not 0 < len(mki_id) <= SRTP_MAX_MKI_LEN:
+                raise ValueError(
+                    "MKI must contain between 1 and %d bytes" % SRTP_MAX_MKI_LEN
+                )
+
+        if not master_keys:
+            self.__master_keys = []
+            self.__master_keys_cdata = None
+            self._policy.keys = ffi.NULL
+            self._policy.num_master_keys = 0
+            return
+
+        array = ffi.new("srtp_master_key_t *[]", len(master_keys))
+        cdata = [array]
+        for i, (key, mki_id) in enumerate(master_keys):
+            key_cdata = _copy_bytes(key)
+            mki_cdata = _copy_bytes(mki_id)
+            master_key = ffi.new(
+                "srtp_master_key_t *",
+                {"key": key_cdata, "mki_id": mki_cdata, "mki_size": len(mki_id)},
+            )
+            array[i] = master_key
+            cdata += [master_key, key_cdata, mki_cdata]
+
+        self.__cdata = None
+        self._policy.key = ffi.NULL
+        self.__master_keys = list(master_keys)
+        self.__master_keys_cdata = cdata
+        self._policy.keys = array
+        self._policy.num_master_keys = len(master_keys)
 
     @property
     def srtp_profile(self) -> int:
@@ -188,26 +777,580 @@ class Policy:
         self._policy.window_size = window_size
 
 
+# Approximate size of a libsrtp stream context, excluding its replay window,
+# and of the session keys derived for each master key, measured with libsrtp
+# 2.7 and OpenSSL 3. Streams cloned from a wildcard policy share its session
+# keys, and only hold their salts and MKIs.
+_STREAM_BASE_BYTES = 160
+_STREAM_KEY_BYTES = 3620
+_STREAM_GCM_KEY_BYTES = 2740
+_STREAM_CLONED_KEY_BYTES = 100
+
+
+def _stream_bytes(policy: Policy, cloned: bool = False) -> int:
+    if cloned:
+        key_bytes = _STREAM_CLONED_KEY_BYTES
+    elif policy.srtp_profile in (
+        Policy.SRTP_PROFILE_AEAD_AES_128_GCM,
+        Policy.SRTP_PROFILE_AEAD_AES_256_GCM,
+    ):
+        key_bytes = _STREAM_GCM_KEY_BYTES
+    else:
+        key_bytes = _STREAM_KEY_BYTES
+    return (
+        _STREAM_BASE_BYTES
+        + max(policy.window_size, 128) // 8
+        + max(len(policy.master_keys), 1) * key_bytes
+    )
+
+
+def _policy_bytes(policy: Policy) -> int:
+    size = ffi.sizeof("srtp_policy_t") + len(policy.enc_xtn_hdr) * ffi.sizeof("int")
+    if policy.key is not None:
+        size += len(policy.key)
+    for key, mki_id in policy.master_keys:
+        size += (
+            ffi.sizeof("srtp_master_key_t")
+            + ffi.sizeof("void *")
+            + len(key)
+            + len(mki_id)
+        )
+    return size
+
+
+# Layout of the blobs produced by Session.export_state().
+_STATE_MAGIC = b"SRTP"
+_STATE_VERSION = 1
+# magic, version, use_mki, mki_index, max_packet_size, number of policies
+_STATE_HEADER = struct.Struct("!4sBBBIH")
+# srtp_profile, ssrc_type, ssrc_value, window_size, allow_repeat_tx,
+# number of master keys, number of encrypted header extensions
+_STATE_POLICY = struct.Struct("!BBIIBBB")
+_STATE_COUNT = struct.Struct("!I")
+# ssrc, roc
+_STATE_ROC = struct.Struct("!II")
+
+
+def _pack_policy(policy: Policy) -> bytes:
+    master_keys = policy.master_keys
+    chunks = [
+        _STATE_POLICY.pack(
+            policy.srtp_profile,
+            policy.ssrc_type,
+            policy.ssrc_value,
+            policy.window_size,
+            policy.allow_repeat_tx,
+            len(master_keys),
+            len(policy.enc_xtn_hdr),
+        )
+    ]
+    if master_keys:
+        for key, mki_id in master_keys:
+            chunks += [bytes([len(key)]), key, bytes([len(mki_id)]), mki_id]
+    else:
+        key = b"" if policy.key is None else bytes(policy.key)
+        chunks += [bytes([len(key)]), key]
+    chunks.append(bytes(policy.enc_xtn_hdr))
+    return b"".join(chunks)
+
+
+def _unpack_bytes(data: bytes, offset: int) -> Tuple[bytes, int]:
+    if offset >= len(data) or offset + 1 + data[offset] > len(data):
+        raise struct.error("truncated data")
+    length = data[offset]
+    offset += 1
+    return data[offset : offset + length], offset + length
+
+
+def _unpack_policy(data: bytes, offset: int) -> Tuple[Policy, int]:
+    (
+        srtp_profile,
+        ssrc_type,
+        ssrc_value,
+        window_size,
+        allow_repeat_tx,
+        master_key_count,
+        enc_xtn_hdr_count,
+    ) = _STATE_POLICY.unpack_from(data, offset)
+    offset += _STATE_POLICY.size
+
+    try:
+        policy = Policy(
+            ssrc_type=ssrc_type, ssrc_value=ssrc_value, srtp_profile=srtp_profile
+        )
+    except Error as exc:
+        raise ValueError("invalid session state") from exc
+    if master_key_count:
+        master_keys = []
+        for i in range(master_key_count):
+            key, offset = _unpack_bytes(data, offset)
+            mki_id, offset = _unpack_bytes(data, offset)
+            master_keys.append((key, mki_id))
+        policy.master_keys = master_keys
+    else:
+        key, offset = _unpack_bytes(data, offset)
+        if key:
+            policy.key = key
+    if offset + enc_xtn_hdr_count > len(data):
+        raise struct.error("truncated data")
+    policy.enc_xtn_hdr = list(data[offset : offset + enc_xtn_hdr_count])
+    offset += enc_xtn_hdr_count
+    policy.allow_repeat_tx = bool(allow_repeat_tx)
+    policy.window_size = window_size
+    return policy, offset
+
+
 class Session:
     """
     SRTP session, which may comprise several streams.
 
     If `policy` is not specified, streams should be added later using the
-    :func:`add_stream` method.
+    :func:`add_stream` method. If `retain_policies` is true, the session keeps
+    copies of the policies of its streams, including their keys, which
+    :meth:`export_state` needs.
+
+    Streams which `libsrtp` creates from the wildcard policy when it processes
+    the first packet of an SSRC are normally kept until they are removed. If
+    `max_streams` is given, the least recently used of them is evicted
+    whenever there are more. If `idle_timeout` is given, those which have not
+    successfully processed a packet for that many seconds are evicted. An
+    evicted stream is created anew if its SSRC shows up again, with a fresh
+    rollover counter and replay window.
+
+    If `reject_threshold` is given, an SSRC without a stream whose packets
+    fail to be unprotected that many times within `reject_window` seconds,
+    because they fail authentication or no stream matches them, is rejected
+    for the next `reject_window` seconds: its packets fail with the same
+    status without being copied or reaching `libsrtp`, which makes floods of
+    bogus packets cheap to drop. The failures of SSRCs which have a stream,
+    added explicitly or created from the wildcard policy, are not counted, so
+    forged packets cannot get an established stream rejected. Beware that a
+    new stream whose first packets keep failing, for instance because of
+    mismatched keys, can get rejected.
+
+    The session counts the packets it processes, see :meth:`stats`. Counters
+    for each SSRC are only kept if `ssrc_stats` is true, as they make every
+    packet slower to process, as do stream limits.
+
+    Packets are copied into a per-thread scratch buffer which starts at 1500
+    bytes and grows on demand, up to `max_packet_size` bytes. When protecting
+    a packet, the room reserved after it is the trailer length actually used
+    by the session's streams (for instance 10 bytes for
+    :attr:`Policy.SRTP_PROFILE_AES128_CM_SHA1_80`), not the worst case
+    :data:`SRTP_MAX_TRAILER_LEN`. A packet can therefore be protected as long
+    as the protected packet fits in `max_packet_size` bytes.
+
+    A session can be shared between threads. The GIL is released while
+    `libsrtp` processes packets, but the underlying `libsrtp` context is not
+    thread-safe, so every call into it holds a lock owned by the session.
+    Calls on the same session are serialized, while calls on different
+    sessions run in parallel.
     """
 
-    def __init__(self, policy: Optional[Policy] = None) -> None:
-        srtp = ffi.new("srtp_t *")
+    def __init__(
+        self,
+        policy: Optional[Policy] = None,
+        max_packet_size: int = 1500,
+        retain_policies: bool = False,
+        max_streams: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        reject_threshold: Optional[int] = None,
+        reject_window: float = 10.0,
+        ssrc_stats: bool = False,
+    ) -> None:
+        if max_streams is not None and max_streams < 1:
+            raise ValueError("max_streams must be at least 1")
+        if idle_timeout is not None and idle_timeout <= 0:
+            raise ValueError("idle_timeout must be positive")
+        if reject_threshold is not None and reject_threshold < 1:
+            raise ValueError("reject_threshold must be at least 1")
+        if reject_window <= 0:
+            raise ValueError("reject_window must be positive")
+
+        init()
+        state = ffi.new("pylibsrtp_session_t *")
 
         if policy is None:
             _policy = ffi.NULL
         else:
             _policy = policy._policy
-        _srtp_assert(lib.srtp_create(srtp, _policy))
+        _srtp_assert(lib.srtp_create(ffi.addressof(state, "ctx"), _policy))
+
+        # The libsrtp context, the MKI settings and the counters, see
+        # pylibsrtp_session_t.
+        self._state = ffi.gc(state, lib.pylibsrtp_session_dealloc)
+        self._group: Optional["SessionGroup"] = None
+        # Copies of the policies the streams were created with, if they are
+        # retained so that the session's state can be exported, and the
+        # estimated size of the streams. A session has a wildcard policy if
+        # the size of its stream is known.
+        self.__retain_policies = retain_policies
+        self.__template: Optional[Policy] = None
+        self.__template_bytes = 0
+        self.__clone_bytes = 0
+        self.__stream_policies: Dict[int, Policy] = {}
+        self.__stream_bytes: Dict[int, int] = {}
+        # Streams created from the wildcard policy by from_state().
+        self.__restored_clones: Set[int] = set()
+        # When the number of streams created from the wildcard policy is
+        # bounded or they expire, the time they were last used, least
+        # recently used first, and the number of streams evicted because
+        # there were too many or they were idle.
+        self.__max_streams = max_streams
+        self.__idle_timeout = idle_timeout
+        self.__last_used: Optional["OrderedDict[int, float]"] = None
+        if max_streams is not None or idle_timeout is not None:
+            self.__last_used = OrderedDict()
+        self.__evictions = [0, 0]
+        # SSRCs which keep failing are rejected by pylibsrtp_session_call()
+        # and the batch functions, before the packets are copied.
+        if reject_threshold is not None:
+            rc = lib.pylibsrtp_session_enable_rejects(
+                state, reject_threshold, reject_window
+            )
+            if rc < 0:
+                raise MemoryError
+        if policy is not None:
+            self.__retain_policy(policy)
+        self._lock = threading.Lock()
+        self._max_packet_size = max_packet_size
+
+        # If enabled, counters of [packets, bytes, errors, late, duplicate,
+        # highest sequence number] for each SSRC, indexed by operation code.
+        self.__ssrc_counters: Optional[Dict[int, List[List[int]]]] = None
+        if ssrc_stats:
+            self.__ssrc_counters = {}
+        # Whether each packet needs to be recorded by _record().
+        self._recording = ssrc_stats or self.__last_used is not None
+        self.__latency_hook: Optional[Callable[[str, float], None]] = None
+        self.__latency_interval = 1
+        self.__latency_countdown = 1
+
+    @property
+    def max_packet_size(self) -> int:
+        """
+        The maximum size of a packet, before unprotection or after protection.
+        """
+        return self._max_packet_size
+
+    @property
+    def mki_index(self) -> int:
+        """
+        The index in :attr:`Policy.master_keys` of the master key used to
+        protect packets, if :attr:`use_mki` is set.
+        """
+        return self._state.mki[1]
+
+    @mki_index.setter
+    def mki_index(self, mki_index: int) -> None:
+        if mki_index < 0 or mki_index >= SRTP_MAX_NUM_MASTER_KEYS:
+            raise ValueError(
+                "mki_index must be less than %d" % SRTP_MAX_NUM_MASTER_KEYS
+            )
+        with self._lock:
+            self._state.mki[1] = mki_index
+            self._state.trailers = [0, 0]
+
+    @property
+    def use_mki(self) -> bool:
+        """
+        Whether packets carry a Master Key Identifier, which is required when
+        the streams' policies use :attr:`Policy.master_keys`.
+        """
+        return self._state.mki[0] == 1
+
+    @use_mki.setter
+    def use_mki(self, use_mki: bool) -> None:
+        with self._lock:
+            self._state.mki[0] = 1 if use_mki else 0
+            self._state.trailers = [0, 0]
+
+    def set_latency_hook(
+        self, hook: Optional[Callable[[str, float], None]], interval: int = 1
+    ) -> None:
+        """
+        Install a `hook` which is called with the name of the operation (for
+        instance `"unprotect"` or `"unprotect_many"`) and the time in seconds
+        spent in `libsrtp`, for one call out of every `interval`.
+
+        Passing `None` removes the hook.
+
+        :param hook: callable, or `None`
+        :param interval: :class:`int`
+        """
+        if interval < 1:
+            raise ValueError("interval must be at least 1")
+        with self._lock:
+            self.__latency_hook = hook
+            self.__latency_interval = interval
+            self.__latency_countdown = interval
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the session's counters.
+
+        For each operation (`"protect"`, `"protect_rtcp"`, `"unprotect"` and
+        `"unprotect_rtcp"`) the snapshot holds the number of packets which
+        were processed successfully, their size in bytes before processing and
+        the number of failures. Among the failures, `"late"` counts the
+        packets rejected by replay protection because they are older than the
+        replay window, and `"duplicate"` those which were already seen.
+        `"errors"` maps each `libsrtp` error code which occurred (an index
+        into :data:`ERRORS`) to its number of occurrences.
+
+        If the session was created with `ssrc_stats=True`, `"ssrcs"` holds
+        the same per-operation counters for each SSRC, along with the
+        `"highest_sequence"` number successfully processed for RTP operations.
+        Otherwise it is empty, which spares the cost of keeping them for every
+        packet. To avoid unbounded growth when receiving garbage, an SSRC only
+        gets an entry once a packet was successfully processed for it.
+
+        Comparing `"late"` and `"duplicate"` to `"packets"` helps choosing
+        :attr:`Policy.window_size` on links with heavy reordering.
 
-        self._cdata = ffi.new("char[]", 1500)
-        self._buffer = ffi.buffer(self._cdata)
-        self._srtp = ffi.gc(srtp, lambda x: lib.srtp_dealloc(x[0]))
+        `"template_clones"` counts the streams which `libsrtp` created from
+        the session's wildcard policy while processing a packet. `"evictions"`
+        counts the streams evicted because of `"max_streams"` or because they
+        were `"idle"`. `"rejected"` holds the number of `"packets"` dropped
+        without reaching `libsrtp` because their SSRC was rejected, which are
+        not counted elsewhere, and the number of `"ssrcs"` currently rejected.
+
+        :rtype: :class:`dict`
+        """
+
+        def snapshot(counters):
+            return {
+                name: {
+                    "packets": c[0],
+                    "bytes": c[1],
+                    "errors": c[2],
+                    "late": c[3],
+                    "duplicate": c[4],
+                }
+                for name, c in zip(_OPERATIONS, counters)
+            }
+
+        with self._lock:
+            state = self._state
+            stats = snapshot(state.counters)
+            stats["errors"] = {
+                code: state.errors[code]
+                for code in range(len(ERRORS))
+                if state.errors[code]
+            }
+            stats["template_clones"] = state.clones
+            stats["evictions"] = {
+                "max_streams": self.__evictions[0],
+                "idle": self.__evictions[1],
+            }
+            stats["rejected"] = {
+                "packets": state.rejected,
+                "ssrcs": lib.pylibsrtp_session_rejected_ssrcs(state),
+            }
+            stats["ssrcs"] = {}
+            for ssrc, counters in (self.__ssrc_counters or {}).items():
+                ssrc_stats = stats["ssrcs"][ssrc] = snapshot(counters)
+                for name, c in zip(_OPERATIONS, counters):
+                    ssrc_stats[name]["highest_sequence"] = None if c[5] < 0 else c[5]
+        return stats
+
+    def estimate_memory_usage(self) -> Dict[str, int]:
+        """
+        Return a rough estimate of the memory held by the session, in bytes.
+
+        `libsrtp` does not report the size of its allocations, so apart from
+        the number of streams these figures are derived from the streams'
+        policies, using sizes measured with `libsrtp` 2.7 and OpenSSL 3 on
+        x86-64. They are meant to compare configurations, for instance streams
+        added with their own keys against streams cloned from a wildcard
+        policy, and can be off with other versions or platforms.
+
+        - `"streams"`: the number of `libsrtp` streams, including the one
+          created for a wildcard policy.
+        - `"libsrtp_bytes"`: the stream contexts allocated by `libsrtp`,
+          which mostly consist of the session keys derived for each master
+          key and the replay windows.
+        - `"policy_bytes"`: the policies and keys retained by the session,
+          which is zero unless it was created with `retain_policies=True`.
+        - `"scratch_bytes"`: the calling thread's scratch buffer, which is
+          shared by all the sessions used from that thread.
+
+        `libsrtp` derives the session keys when a stream is added, so a
+        :class:`Policy` does not need to keep its key afterwards: setting
+        :attr:`Policy.key` to `None` drops the policy's reference to it.
+
+        :rtype: :class:`dict`
+        """
+        with self._lock:
+            streams = 0
+            libsrtp_bytes = 0
+            if self.__template_bytes:
+                streams += 1
+                libsrtp_bytes += self.__template_bytes
+
+            for ssrc in self.__stream_ssrcs():
+                streams += 1
+                libsrtp_bytes += self.__stream_bytes.get(ssrc, self.__clone_bytes)
+
+            policy_bytes = sum(
+                _policy_bytes(policy) for policy in self.__stream_policies.values()
+            )
+            if self.__template is not None:
+                policy_bytes += _policy_bytes(self.__template)
+
+        return {
+            "streams": streams,
+            "libsrtp_bytes": libsrtp_bytes,
+            "policy_bytes": policy_bytes,
+            "scratch_bytes": len(_scratch.buffer),
+        }
+
+    def get_stream_roc(self, ssrc: int) -> int:
+        """
+        Return the rollover counter of the stream with the given `ssrc`.
+
+        Together with the highest sequence number reported by :meth:`stats`,
+        this allows moving a stream to another session without resyncing,
+        using :meth:`set_stream_roc`.
+
+        :param ssrc: :class:`int`
+        :rtype: :class:`int`
+        """
+        roc_p = ffi.new("uint32_t *")
+        with self._lock:
+            _srtp_assert(lib.srtp_get_stream_roc(self._state.ctx, ssrc, roc_p))
+        return roc_p[0]
+
+    def set_stream_roc(self, ssrc: int, roc: int) -> None:
+        """
+        Set the rollover counter of the stream with the given `ssrc`. It
+        takes effect when the next packet of the stream is processed.
+
+        :param ssrc: :class:`int`
+        :param roc: :class:`int`
+        """
+        with self._lock:
+            _srtp_assert(lib.srtp_set_stream_roc(self._state.ctx, ssrc, roc))
+
+    def export_state(self) -> bytes:
+        """
+        Export the state of the session as a compact binary blob, which can be
+        passed to :meth:`from_state` to resume the session in another thread
+        or process.
+
+        The state comprises the session's policies, including their keys, its
+        MKI settings and the rollover counter of each stream. The blob
+        therefore contains key material and must be handled accordingly.
+
+        Streams created from a wildcard policy are created from it again by
+        the restored session when it processes their next packet. Those whose
+        rollover counter is not zero are the exception: `libsrtp` can only set
+        it on an existing stream, so they are restored as streams for their
+        SSRC, with session keys of their own, which are still updated along
+        with the wildcard policy.
+
+        Replay windows cannot be exported from `libsrtp`: they start afresh
+        with the first packet of each stream processed by the restored
+        session, which should therefore be the one following the last packet
+        processed by this session. For the same reason, the SRTCP index of
+        outbound streams restarts from zero.
+
+        This requires the session to retain its policies.
+
+        :rtype: :class:`bytes`
+        """
+        if not self.__retain_policies:
+            raise RuntimeError("session does not retain its policies")
+
+        with self._lock:
+            policies = list(self.__stream_policies.values())
+            if self.__template is not None:
+                policies.insert(0, self.__template)
+            chunks = [
+                _STATE_HEADER.pack(
+                    _STATE_MAGIC,
+                    _STATE_VERSION,
+                    self._state.mki[0],
+                    self._state.mki[1],
+                    self._max_packet_size,
+                    len(policies),
+                )
+            ]
+            chunks += [_pack_policy(policy) for policy in policies]
+
+            rocs = []
+            roc_p = ffi.new("uint32_t *")
+            for ssrc in self.__stream_ssrcs():
+                if (
+                    lib.srtp_get_stream_roc(self._state.ctx, ssrc, roc_p)
+                    == lib.srtp_err_status_ok
+                ):
+                    rocs.append((ssrc, roc_p[0]))
+        chunks.append(_STATE_COUNT.pack(len(rocs)))
+        chunks += [_STATE_ROC.pack(ssrc, roc) for ssrc, roc in rocs]
+        return b"".join(chunks)
+
+    @classmethod
+    def from_state(cls, state: bytes) -> "Session":
+        """
+        Create a session from a blob returned by :meth:`export_state`.
+
+        :param state: :class:`bytes`
+        :rtype: :class:`Session`
+        """
+        try:
+            magic, version, use_mki, mki_index, max_packet_size, count = (
+                _STATE_HEADER.unpack_from(state, 0)
+            )
+            if magic != _STATE_MAGIC or version != _STATE_VERSION:
+                raise ValueError("unsupported session state")
+            offset = _STATE_HEADER.size
+            policies = []
+            for i in range(count):
+                policy, offset = _unpack_policy(state, offset)
+                policies.append(policy)
+            (count,) = _STATE_COUNT.unpack_from(state, offset)
+            offset += _STATE_COUNT.size
+            rocs = []
+            for i in range(count):
+                rocs.append(_STATE_ROC.unpack_from(state, offset))
+                offset += _STATE_ROC.size
+        except struct.error:
+            raise ValueError("truncated session state")
+        if offset != len(state):
+            raise ValueError("trailing data in session state")
+
+        session = cls(max_packet_size=max_packet_size, retain_policies=True)
+        session.use_mki = bool(use_mki)
+        session.mki_index = mki_index
+        for policy in policies:
+            session.add_stream(policy)
+        for ssrc, roc in rocs:
+            if ssrc in session.__stream_bytes:
+                if roc:
+                    session.set_stream_roc(ssrc, roc)
+            elif not session.__template_bytes:
+                raise ValueError("invalid session state")
+            elif roc:
+                session.__restore_clone(ssrc, roc)
+        return session
+
+    def __restore_clone(self, ssrc: int, roc: int) -> None:
+        # libsrtp clones the wildcard policy with a zero rollover counter when
+        # processing the first packet of an SSRC, and a stream's rollover
+        # counter can only be set once it exists, so the stream gets its own
+        # session keys. It is otherwise handled like a clone.
+        assert self.__template is not None
+        policy = self.__template.copy(ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=ssrc)
+        with self._lock:
+            _srtp_assert(lib.srtp_add_stream(self._state.ctx, policy._policy))
+            _srtp_assert(lib.srtp_set_stream_roc(self._state.ctx, ssrc, roc))
+            self.__add_ssrc(ssrc)
+            self.__restored_clones.add(ssrc)
+            self.__stream_bytes[ssrc] = self.__template_bytes
+            if self.__last_used is not None:
+                self.__touch(ssrc)
+            self._state.trailers = [0, 0]
 
     def add_stream(self, policy: Policy) -> None:
         """
@@ -216,7 +1359,10 @@ class Session:
 
         :param policy: :class:`Policy`
         """
-        _srtp_assert(lib.srtp_add_stream(self._srtp[0], policy._policy))
+        with self._lock:
+            _srtp_assert(lib.srtp_add_stream(self._state.ctx, policy._policy))
+            self.__retain_policy(policy)
+            self._state.trailers = [0, 0]
 
     def remove_stream(self, ssrc: int) -> None:
         """
@@ -224,7 +1370,87 @@ class Session:
 
         :param ssrc: :class:`int`
         """
-        _srtp_assert(lib.srtp_remove_stream(self._srtp[0], htonl(ssrc)))
+        with self._lock:
+            _srtp_assert(lib.srtp_remove_stream(self._state.ctx, _htonl(ssrc)))
+            lib.pylibsrtp_session_discard_ssrc(self._state, ssrc)
+            self.__stream_policies.pop(ssrc, None)
+            self.__stream_bytes.pop(ssrc, None)
+            if self.__ssrc_counters is not None:
+                self.__ssrc_counters.pop(ssrc, None)
+            self.__restored_clones.discard(ssrc)
+            if self.__last_used is not None:
+                self.__last_used.pop(ssrc, None)
+            self._state.trailers = [0, 0]
+
+    def update(self, policy: Policy) -> None:
+        """
+        Update the keys of the session's streams in place, using the given
+        `policy`.
+
+        If the policy is for a specific SSRC only that stream is updated,
+        otherwise all the streams created from the session's wildcard policy
+        are. Rollover counters and replay windows are preserved, so packets in
+        flight are not dropped because of the rekey.
+
+        :param policy: :class:`Policy`
+        """
+        with self._lock:
+            _srtp_assert(lib.srtp_update(self._state.ctx, policy._policy))
+            self.__update_restored_clones(policy)
+            self.__retain_policy(policy)
+            self._state.trailers = [0, 0]
+
+    def update_stream(self, policy: Policy) -> None:
+        """
+        Update the keys of the stream matching the given `policy` in place.
+
+        See :meth:`update` for details.
+
+        :param policy: :class:`Policy`
+        """
+        with self._lock:
+            _srtp_assert(lib.srtp_update_stream(self._state.ctx, policy._policy))
+            self.__update_restored_clones(policy)
+            self.__retain_policy(policy)
+            self._state.trailers = [0, 0]
+
+    def __update_restored_clones(self, policy: Policy) -> None:
+        # Restored clones were not cloned by libsrtp, so it does not update
+        # them along with the wildcard policy.
+        if policy.ssrc_type != Policy.SSRC_SPECIFIC and self.__restored_clones:
+            stream_policy = policy.copy(ssrc_type=Policy.SSRC_SPECIFIC)
+            for ssrc in self.__restored_clones:
+                stream_policy.ssrc_value = ssrc
+                _srtp_assert(
+                    lib.srtp_update_stream(self._state.ctx, stream_policy._policy)
+                )
+
+    def __retain_policy(self, policy: Policy) -> None:
+        if policy.ssrc_type == Policy.SSRC_SPECIFIC:
+            if self.__retain_policies:
+                self.__stream_policies[policy.ssrc_value] = policy.copy()
+            self.__stream_bytes[policy.ssrc_value] = _stream_bytes(policy)
+            self.__restored_clones.discard(policy.ssrc_value)
+            self.__add_ssrc(policy.ssrc_value)
+        else:
+            if self.__retain_policies:
+                self.__template = policy.copy()
+            self._state.cloning = 1
+            self.__template_bytes = _stream_bytes(policy)
+            self.__clone_bytes = _stream_bytes(policy, cloned=True)
+
+    def __add_ssrc(self, ssrc: int) -> None:
+        if lib.pylibsrtp_session_add_ssrc(self._state, ssrc) < 0:
+            raise MemoryError
+
+    def __stream_ssrcs(self) -> List[int]:
+        # The SSRCs of the streams added explicitly or cloned by libsrtp.
+        state = self._state
+        if state.ssrcs == ffi.NULL:
+            return []
+        return [
+            ssrc for ssrc in ffi.unpack(state.ssrcs, 1 << state.ssrc_bits) if ssrc >= 0
+        ]
 
     def protect(self, packet: bytes) -> bytes:
         """
@@ -233,7 +1459,9 @@ class Session:
         :param packet: :class:`bytes`
         :rtype: :class:`bytes`
         """
-        return self.__process(packet, lib.srtp_protect, SRTP_MAX_TRAILER_LEN)
+        return self.__process(
+            packet, lib.PYLIBSRTP_PROTECT, self.__trailer_length(False)
+        )
 
     def protect_rtcp(self, packet: bytes) -> bytes:
         """
@@ -242,7 +1470,9 @@ class Session:
         :param packet: :class:`bytes`
         :rtype: :class:`bytes`
         """
-        return self.__process(packet, lib.srtp_protect_rtcp, SRTP_MAX_SRTCP_TRAILER_LEN)
+        return self.__process(
+            packet, lib.PYLIBSRTP_PROTECT_RTCP, self.__trailer_length(True)
+        )
 
     def unprotect(self, packet: bytes) -> bytes:
         """
@@ -251,7 +1481,7 @@ class Session:
         :param packet: :class:`bytes`
         :rtype: :class:`bytes`
         """
-        return self.__process(packet, lib.srtp_unprotect)
+        return self.__process(packet, lib.PYLIBSRTP_UNPROTECT)
 
     def unprotect_rtcp(self, packet: bytes) -> bytes:
         """
@@ -260,19 +1490,684 @@ class Session:
         :param packet: :class:`bytes`
         :rtype: :class:`bytes`
         """
-        return self.__process(packet, lib.srtp_unprotect_rtcp)
+        return self.__process(packet, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def try_protect(self, packet: bytes) -> Tuple[int, Optional[bytes]]:
+        """
+        Apply SRTP protection to the RTP `packet`, without raising
+        :class:`Error` on failure.
+
+        A `(status, data)` tuple is returned: `status` is
+        :attr:`ErrorCode.OK` on success, otherwise it is the `libsrtp` error
+        code, which can be compared to :class:`ErrorCode` members, and `data`
+        is `None`. This avoids the cost of raising and catching exceptions
+        when failures are expected, for instance when under attack.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`tuple`
+        """
+        return self.__try_process(
+            packet, lib.PYLIBSRTP_PROTECT, self.__trailer_length(False)
+        )
+
+    def try_protect_rtcp(self, packet: bytes) -> Tuple[int, Optional[bytes]]:
+        """
+        Apply SRTCP protection to the RTCP `packet`, without raising
+        :class:`Error` on failure.
+
+        See :meth:`try_protect` for the format of the result.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`tuple`
+        """
+        return self.__try_process(
+            packet, lib.PYLIBSRTP_PROTECT_RTCP, self.__trailer_length(True)
+        )
+
+    def try_unprotect(self, packet: bytes) -> Tuple[int, Optional[bytes]]:
+        """
+        Verify SRTP protection of the SRTP packet, without raising
+        :class:`Error` on failure.
+
+        See :meth:`try_protect` for the format of the result.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`tuple`
+        """
+        return self.__try_process(packet, lib.PYLIBSRTP_UNPROTECT)
+
+    def try_unprotect_rtcp(self, packet: bytes) -> Tuple[int, Optional[bytes]]:
+        """
+        Verify SRTCP protection of the SRTCP packet, without raising
+        :class:`Error` on failure.
+
+        See :meth:`try_protect` for the format of the result.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`tuple`
+        """
+        return self.__try_process(packet, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def protect_into(self, buffer, length: int) -> int:
+        """
+        Apply SRTP protection in place to the RTP packet held in the first
+        `length` bytes of `buffer`.
+
+        `buffer` can be any writable object supporting the buffer protocol,
+        such as a :class:`bytearray` or a :class:`memoryview`. It must have
+        room for the SRTP trailer after the packet.
+
+        :param buffer: writable buffer
+        :param length: :class:`int`
+        :rtype: the length of the protected packet
+        """
+        return self.__process_into(
+            buffer, length, lib.PYLIBSRTP_PROTECT, self.__trailer_length(False)
+        )
+
+    def protect_rtcp_into(self, buffer, length: int) -> int:
+        """
+        Apply SRTCP protection in place to the RTCP packet held in the first
+        `length` bytes of `buffer`.
+
+        See :func:`protect_into` for the requirements on `buffer`.
+
+        :param buffer: writable buffer
+        :param length: :class:`int`
+        :rtype: the length of the protected packet
+        """
+        return self.__process_into(
+            buffer, length, lib.PYLIBSRTP_PROTECT_RTCP, self.__trailer_length(True)
+        )
+
+    def unprotect_into(self, buffer, length: int) -> int:
+        """
+        Verify SRTP protection in place of the SRTP packet held in the first
+        `length` bytes of `buffer`.
+
+        :param buffer: writable buffer
+        :param length: :class:`int`
+        :rtype: the length of the unprotected packet
+        """
+        return self.__process_into(buffer, length, lib.PYLIBSRTP_UNPROTECT)
+
+    def unprotect_rtcp_into(self, buffer, length: int) -> int:
+        """
+        Verify SRTCP protection in place of the SRTCP packet held in the first
+        `length` bytes of `buffer`.
+
+        :param buffer: writable buffer
+        :param length: :class:`int`
+        :rtype: the length of the unprotected packet
+        """
+        return self.__process_into(buffer, length, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def protect_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Apply SRTP protection to a batch of RTP `packets`.
+
+        All the packets are processed in a single call into the binding. For
+        each packet a `(status, data)` tuple is returned: `status` is `0` on
+        success, otherwise it is the `libsrtp` error code (an index into
+        :data:`ERRORS`) and `data` is `None`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(
+            packets, lib.PYLIBSRTP_PROTECT, self.__trailer_length(False)
+        )
+
+    def protect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Apply SRTCP protection to a batch of RTCP `packets`.
+
+        See :func:`protect_many` for the format of the result.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(
+            packets, lib.PYLIBSRTP_PROTECT_RTCP, self.__trailer_length(True)
+        )
+
+    def unprotect_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Verify SRTP protection of a batch of SRTP `packets`.
+
+        See :func:`protect_many` for the format of the result.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT)
+
+    def unprotect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Verify SRTCP protection of a batch of SRTCP `packets`.
+
+        See :func:`protect_many` for the format of the result.
 
-    def __process(self, data, func, trailer=0):
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def unprotect_auto(self, packet: bytes) -> Tuple[bool, bytes]:
+        """
+        Verify the protection of an SRTP or SRTCP packet, telling them apart by
+        their packet type as :func:`classify` does.
+
+        The result is a tuple of whether the packet is RTCP and the
+        unprotected packet. :class:`ValueError` is raised if the packet is
+        neither SRTP nor SRTCP.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`tuple`
+        """
+        if not isinstance(packet, bytes):
+            raise TypeError("packet must be bytes")
+        op = lib.pylibsrtp_unprotect_op(packet, len(packet))
+        if op < 0:
+            raise ValueError("packet is neither RTP nor RTCP")
+        return op == lib.PYLIBSRTP_UNPROTECT_RTCP, self.__process(packet, op)
+
+    def unprotect_auto_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes], bool]]:
+        """
+        Verify the protection of a batch of SRTP and SRTCP `packets`, telling
+        them apart by their packet type as :func:`classify` does.
+
+        The result has the format described in :func:`protect_many`, with a
+        third item telling whether each packet is RTCP. Packets which are
+        neither SRTP nor SRTCP get the :attr:`ErrorCode.BAD_PARAM` status and
+        are not counted in :meth:`stats`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT_AUTO)
+
+    def __process(self, data, op, trailer=0):
+        rc, result = self.__try_process(data, op, trailer)
+        _srtp_assert(rc)
+        return result
+
+    def __try_process(self, data, op, trailer=0):
         if not isinstance(data, bytes):
             raise TypeError("packet must be bytes")
-        if len(data) > len(self._cdata) - trailer:
+        length = len(data)
+        size = length + trailer
+        if size > self._max_packet_size:
             raise ValueError("packet is too long")
 
-        len_p = ffi.new("int *")
-        len_p[0] = len(data)
-        self._buffer[0 : len(data)] = data
-        _srtp_assert(func(self._srtp[0], self._cdata, len_p))
-        return self._buffer[0 : len_p[0]]
+        scratch = _scratch
+        if size > scratch.size:
+            scratch.resize(max(size, 2 * scratch.size))
+        len_p = scratch.len_p
+        len_p[0] = length
+        rc = self.__call(op, data, scratch.cdata, len_p, scratch.size)
+        if rc != lib.srtp_err_status_ok:
+            return rc, None
+        return rc, scratch.buffer[0 : len_p[0]]
+
+    def __process_into(self, buffer, length, op, trailer=0):
+        try:
+            cdata = ffi.from_buffer("char[]", buffer, require_writable=True)
+        except (BufferError, TypeError):
+            raise TypeError("buffer must be writable") from None
+        if length < 0 or length + trailer > len(cdata):
+            raise ValueError("buffer is too small")
+
+        len_p = _scratch.len_p
+        len_p[0] = length
+        _srtp_assert(self.__call(op, cdata, cdata, len_p, len(cdata)))
+        return len_p[0]
+
+    def __process_many(self, packets, op, trailer=0):
+        batch = _Batch(packets, trailer)
+        if not batch.count:
+            return []
+
+        auto = op == lib.PYLIBSRTP_UNPROTECT_AUTO
+        timed = self.__latency_hook is not None and self.__sample_latency()
+        with self._lock:
+            if timed:
+                start = time.perf_counter()
+            if auto:
+                ops_p = ffi.new("int[]", batch.count)
+                lib.pylibsrtp_unprotect_auto_many(
+                    self._state,
+                    batch.cdata,
+                    batch.offsets_p,
+                    batch.lengths_p,
+                    batch.statuses_p,
+                    batch.ssrcs_p,
+                    batch.seqs_p,
+                    ops_p,
+                    batch.count,
+                )
+                ops = ffi.unpack(ops_p, batch.count)
+            else:
+                lib.pylibsrtp_process_many(
+                    self._state,
+                    op,
+                    batch.cdata,
+                    batch.offsets_p,
+                    batch.lengths_p,
+                    batch.trailer,
+                    batch.statuses_p,
+                    batch.ssrcs_p,
+                    batch.seqs_p,
+                    ffi.NULL,
+                    batch.count,
+                )
+                ops = itertools.repeat(op, batch.count)
+            if timed:
+                elapsed = time.perf_counter() - start
+            statuses = ffi.unpack(batch.statuses_p, batch.count)
+            if self._recording:
+                for packet_op, ssrc, seq, length, status in zip(
+                    ops,
+                    ffi.unpack(batch.ssrcs_p, batch.count),
+                    ffi.unpack(batch.seqs_p, batch.count),
+                    batch.lengths,
+                    statuses,
+                ):
+                    # Packets which are neither RTP nor RTCP are not counted.
+                    if packet_op >= 0:
+                        self._record(packet_op, ssrc, seq, length, status)
+        if timed:
+            name = "unprotect_auto" if auto else _OPERATIONS[op]
+            self.__latency_hook(name + "_many", elapsed)
+
+        results = batch.results(statuses)
+        if auto:
+            rtcp_op = lib.PYLIBSRTP_UNPROTECT_RTCP
+            return [
+                (status, data, packet_op == rtcp_op)
+                for (status, data), packet_op in zip(results, ops)
+            ]
+        return results
+
+    def _process_indices(self, batch, op, indices):
+        # Processes the packets of a SessionGroup batch routed to the session.
+        indices_p = ffi.new("int[]", indices)
+        timed = self.__latency_hook is not None and self.__sample_latency()
+        with self._lock:
+            if timed:
+                start = time.perf_counter()
+            lib.pylibsrtp_process_many(
+                self._state,
+                op,
+                batch.cdata,
+                batch.offsets_p,
+                batch.lengths_p,
+                batch.trailer,
+                batch.statuses_p,
+                batch.ssrcs_p,
+                batch.seqs_p,
+                indices_p,
+                len(indices),
+            )
+            if timed:
+                elapsed = time.perf_counter() - start
+            if self._recording:
+                for index in indices:
+                    self._record(
+                        op,
+                        batch.ssrcs_p[index],
+                        batch.seqs_p[index],
+                        batch.lengths[index],
+                        batch.statuses_p[index],
+                    )
+        if timed:
+            self.__latency_hook(_OPERATIONS[op] + "_many", elapsed)
+
+    def __call(self, op, src, dst, len_p, size):
+        # The packet is copied from src to dst, unless it is processed in place.
+        # dst holds size bytes, which C checks against the trailer length
+        # under the lock, as the streams may have changed since it was read.
+        if self._recording or self.__latency_hook is not None:
+            return self.__call_recorded(op, src, dst, len_p, size)
+        with self._lock:
+            return lib.pylibsrtp_session_call(self._state, op, src, dst, len_p, size)
+
+    def __call_recorded(self, op, src, dst, len_p, size):
+        length = len_p[0]
+        timed = self.__latency_hook is not None and self.__sample_latency()
+        with self._lock:
+            if timed:
+                start = time.perf_counter()
+            rc = lib.pylibsrtp_session_call(self._state, op, src, dst, len_p, size)
+            if timed:
+                elapsed = time.perf_counter() - start
+            if self._recording:
+                self._record(op, self._state.ssrc, self._state.seq, length, rc)
+        if timed:
+            self.__latency_hook(_OPERATIONS[op], elapsed)
+        return rc
+
+    def _record(self, op, ssrc, seq, length, rc):
+        # Must be called with the lock held. The packet was already counted
+        # by pylibsrtp_session_process(), this keeps the per-SSRC counters and
+        # the state of the stream limits.
+        if ssrc < 0:
+            return
+        ssrc_counters = self.__ssrc_counters
+        counters = None if ssrc_counters is None else ssrc_counters.get(ssrc)
+        if rc == lib.srtp_err_status_ok:
+            if ssrc_counters is not None:
+                if counters is None:
+                    counters = ssrc_counters[ssrc] = [
+                        [0, 0, 0, 0, 0, -1] for _ in _OPERATIONS
+                    ]
+                c = counters[op]
+                c[0] += 1
+                c[1] += length
+                # Sequence numbers wrap around, see RFC 3550 appendix A.1.
+                if seq >= 0 and (c[5] < 0 or (seq - c[5]) & 0xFFFF < 0x8000):
+                    c[5] = seq
+            if self.__last_used is not None:
+                self.__touch(ssrc)
+        else:
+            if counters is not None:
+                c = counters[op]
+                c[2] += 1
+                if rc == lib.srtp_err_status_replay_old:
+                    c[3] += 1
+                elif rc == lib.srtp_err_status_replay_fail:
+                    c[4] += 1
+
+    def expire_streams(self) -> None:
+        """
+        Evict the streams which have been idle for longer than the session's
+        `idle_timeout`.
+
+        This is done whenever a packet is processed successfully, so this
+        method only needs to be called periodically for sessions which may
+        stop receiving packets altogether.
+        """
+        with self._lock:
+            if self.__last_used is not None:
+                self.__evict(time.monotonic())
+
+    def __touch(self, ssrc: int) -> None:
+        # Must be called with the lock held.
+        last_used = self.__last_used
+        assert last_used is not None
+        now = time.monotonic()
+        if ssrc in last_used:
+            last_used.move_to_end(ssrc)
+            last_used[ssrc] = now
+        elif ssrc not in self.__stream_bytes or ssrc in self.__restored_clones:
+            last_used[ssrc] = now
+        self.__evict(now)
+
+    def __evict(self, now: float) -> None:
+        # Must be called with the lock held.
+        last_used = self.__last_used
+        assert last_used is not None
+        if self.__max_streams is not None:
+            while len(last_used) > self.__max_streams:
+                self.__evict_stream(next(iter(last_used)), 0)
+        if self.__idle_timeout is not None:
+            deadline = now - self.__idle_timeout
+            while last_used:
+                ssrc, when = next(iter(last_used.items()))
+                if when > deadline:
+                    break
+                self.__evict_stream(ssrc, 1)
+
+    def __evict_stream(self, ssrc: int, reason: int) -> None:
+        # Must be called with the lock held.
+        assert self.__last_used is not None
+        del self.__last_used[ssrc]
+        lib.srtp_remove_stream(self._state.ctx, _htonl(ssrc))
+        lib.pylibsrtp_session_discard_ssrc(self._state, ssrc)
+        if self.__ssrc_counters is not None:
+            self.__ssrc_counters.pop(ssrc, None)
+        self.__stream_bytes.pop(ssrc, None)
+        self.__restored_clones.discard(ssrc)
+        self.__evictions[reason] += 1
+
+    def __sample_latency(self) -> bool:
+        self.__latency_countdown -= 1
+        if self.__latency_countdown > 0:
+            return False
+        self.__latency_countdown = self.__latency_interval
+        return True
+
+    def __trailer_length(self, rtcp: bool) -> int:
+        # Only used to check the packet fits and reserve room for the trailer,
+        # see __call().
+        trailer = self._state.trailers[rtcp]
+        if not trailer:
+            with self._lock:
+                trailer = lib.pylibsrtp_session_trailer(self._state, rtcp)
+        return trailer
+
+
+class SessionGroup:
+    """
+    Group of sessions sharing a transport, indexed by SSRC.
+
+    The group dispatches each packet of a batch to the session which handles
+    its SSRC. The SSRC is read from the packet header and looked up in a hash
+    table in C, then each session processes its packets in a single call,
+    holding its own lock. Sessions in a group can therefore still be used
+    directly, and their stream limits, rejected SSRCs and latency hooks apply
+    to the packets the group routes to them.
+
+    Streams should be added and removed through the group using
+    :meth:`add_stream` and :meth:`remove_stream`, which keep the index in step
+    with the sessions.
+    """
 
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._members: Dict[Session, int] = {}
+        self._sessions: Dict[int, Session] = {}
+        self.__build_table(0)
+
+    def __contains__(self, ssrc: int) -> bool:
+        return ssrc in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, ssrc: int, session: Session) -> None:
+        """
+        Route packets with the given `ssrc` to `session`.
+
+        This is for sessions whose streams were added directly, for instance
+        using a wildcard policy.
+
+        :param ssrc: :class:`int`
+        :param session: :class:`Session`
+        """
+        if session._group not in (None, self):
+            raise ValueError("session belongs to another group")
+        with self._lock:
+            if ssrc in self._sessions:
+                raise ValueError("SSRC %d is already in the group" % ssrc)
+            if session not in self._members:
+                session._group = self
+                self._members[session] = 0
+            self._members[session] += 1
+            self._sessions[ssrc] = session
+
+            if 2 * len(self._sessions) > len(self.__table_sessions):
+                self.__build_table(2 * len(self._sessions))
+            else:
+                self.__insert(ssrc, session)
+
+    def remove(self, ssrc: int) -> None:
+        """
+        Stop routing packets with the given `ssrc`.
+
+        :param ssrc: :class:`int`
+        """
+        with self._lock:
+            try:
+                session = self._sessions.pop(ssrc)
+            except KeyError:
+                raise ValueError("SSRC %d is not in the group" % ssrc) from None
+            self._members[session] -= 1
+            if not self._members[session]:
+                del self._members[session]
+                session._group = None
+            self.__build_table(2 * len(self._sessions))
+
+    def add_stream(self, session: Session, policy: Policy) -> None:
+        """
+        Add a stream to `session` using the given `policy`, and route packets
+        for the stream's SSRC to `session`.
+
+        :param session: :class:`Session`
+        :param policy: :class:`Policy`, which must be for a specific SSRC
+        """
+        if policy.ssrc_type != Policy.SSRC_SPECIFIC:
+            raise ValueError("policy must be for a specific SSRC")
+        self.add(policy.ssrc_value, session)
+        try:
+            session.add_stream(policy)
+        except Error:
+            self.remove(policy.ssrc_value)
+            raise
+
+    def remove_stream(self, ssrc: int) -> None:
+        """
+        Remove the stream with the given `ssrc` from its session, and stop
+        routing packets for it.
+
+        :param ssrc: :class:`int`
+        """
+        session = self.get(ssrc)
+        if session is None:
+            raise ValueError("SSRC %d is not in the group" % ssrc)
+        session.remove_stream(ssrc)
+        self.remove(ssrc)
+
+    def get(self, ssrc: int) -> Optional[Session]:
+        """
+        Return the session handling the given `ssrc`, if any.
+
+        :param ssrc: :class:`int`
+        :rtype: :class:`Session` or `None`
+        """
+        return self._sessions.get(ssrc)
+
+    def protect_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Apply SRTP protection to a batch of RTP `packets`, using the session
+        for each packet's SSRC.
+
+        See :meth:`Session.protect_many` for the format of the result.
+        Packets whose SSRC is not in the group fail with the "no appropriate
+        context found" error.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_PROTECT, SRTP_MAX_TRAILER_LEN)
+
+    def protect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Apply SRTCP protection to a batch of RTCP `packets`, using the
+        session for each packet's sender SSRC.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(
+            packets, lib.PYLIBSRTP_PROTECT_RTCP, SRTP_MAX_SRTCP_TRAILER_LEN
+        )
+
+    def unprotect_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Verify SRTP protection of a batch of SRTP `packets`, using the
+        session for each packet's SSRC.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT)
+
+    def unprotect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> List[Tuple[int, Optional[bytes]]]:
+        """
+        Verify SRTCP protection of a batch of SRTCP `packets`, using the
+        session for each packet's sender SSRC.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`list` of :class:`tuple`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def __build_table(self, capacity: int) -> None:
+        # Must be called with the lock held, or from the constructor.
+        bits = max(capacity - 1, 1).bit_length()
+        self.__table_bits = bits
+        self.__table_keys = ffi.new("uint32_t[]", 1 << bits)
+        self.__table_states = ffi.new("pylibsrtp_session_t *[]", 1 << bits)
+        self.__table_sessions: List[Optional[Session]] = [None] * (1 << bits)
+        for ssrc, session in self._sessions.items():
+            self.__insert(ssrc, session)
+
+    def __insert(self, ssrc: int, session: Session) -> None:
+        # Must match pylibsrtp_table_lookup().
+        mask = (1 << self.__table_bits) - 1
+        slot = ((ssrc * 2654435769) & 0xFFFFFFFF) >> (32 - self.__table_bits)
+        while self.__table_sessions[slot] is not None:
+            slot = (slot + 1) & mask
+        self.__table_keys[slot] = ssrc
+        self.__table_states[slot] = session._state
+        self.__table_sessions[slot] = session
+
+    def __process_many(self, packets, op, trailer=0):
+        batch = _Batch(packets, trailer)
+        if not batch.count:
+            return []
+
+        # Group the packets by session under the group's lock, then let each
+        # session process its packets under its own lock.
+        slots_p = ffi.new("int[]", batch.count)
+        members: Dict[Session, List[int]] = {}
+        with self._lock:
+            lib.pylibsrtp_table_lookup_many(
+                self.__table_keys,
+                self.__table_states,
+                self.__table_bits,
+                op,
+                batch.cdata,
+                batch.offsets_p,
+                batch.lengths_p,
+                batch.statuses_p,
+                slots_p,
+                batch.count,
+            )
+            table_sessions = self.__table_sessions
+            for index, slot in enumerate(ffi.unpack(slots_p, batch.count)):
+                if slot >= 0:
+                    members.setdefault(table_sessions[slot], []).append(index)
+        for session, indices in members.items():
+            session._process_indices(batch, op, indices)
 
-lib.srtp_init()
+        return batch.results(ffi.unpack(batch.statuses_p, batch.count))
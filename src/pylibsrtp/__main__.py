@@ -0,0 +1,4 @@
+from ._capture import main
+
+if __name__ == "__main__":
+    main()
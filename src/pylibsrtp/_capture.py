@@ -0,0 +1,645 @@
+"""
+Decrypt or encrypt the SRTP and SRTCP packets of a capture file.
+
+Captures are memory-mapped and processed in batches, which are partitioned by
+SSRC across worker processes, each of which owns its own :class:`Session`.
+All the packets for a given SSRC are handled by the same worker in capture
+order, which keeps replay protection and rollover counters consistent. The
+output is written in the same format as the input, one batch at a time.
+"""
+
+import argparse
+import base64
+import binascii
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import (
+    Any,
+    BinaryIO,
+    Deque,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from . import Error, PacketKind, Policy, Session, classify
+
+_LINKTYPE_NULL = 0
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = 101
+_LINKTYPE_LINUX_SLL = 113
+_LINKTYPE_IPV4 = 228
+_LINKTYPE_IPV6 = 229
+_LINKTYPE_LINUX_SLL2 = 276
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86DD
+_ETHERTYPE_VLANS = (0x8100, 0x88A8, 0x9100)
+
+_PCAPNG_INTERFACE_DESCRIPTION = 1
+_PCAPNG_SIMPLE_PACKET = 3
+_PCAPNG_ENHANCED_PACKET = 6
+
+PROFILES = {
+    name[len("SRTP_PROFILE_") :]: getattr(Policy, name)
+    for name in dir(Policy)
+    if name.startswith("SRTP_PROFILE_")
+}
+
+# A packet read from a capture: an opaque record which the format uses to
+# write it back, the (S)RTP or (S)RTCP packet or `None` if the record should
+# be copied as-is, and whether the packet is RTCP.
+Record = Tuple[Any, Optional[bytes], bool]
+
+
+class _Udp(NamedTuple):
+    # Offset of the IP header in the frame.
+    ip: int
+    # Offset and length of the UDP payload in the frame.
+    payload: int
+    length: int
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def _find_udp(frame: bytes, linktype: int) -> Optional[_Udp]:
+    """
+    Locate the payload of an unfragmented UDP datagram in a link-layer frame.
+    """
+    if linktype == _LINKTYPE_NULL:
+        ip = 4
+    elif linktype == _LINKTYPE_ETHERNET:
+        ip = 14
+        if len(frame) < ip:
+            return None
+        ethertype = struct.unpack_from("!H", frame, 12)[0]
+        while ethertype in _ETHERTYPE_VLANS and len(frame) >= ip + 4:
+            ethertype = struct.unpack_from("!H", frame, ip + 2)[0]
+            ip += 4
+        if ethertype not in (_ETHERTYPE_IPV4, _ETHERTYPE_IPV6):
+            return None
+    elif linktype in (_LINKTYPE_RAW, _LINKTYPE_IPV4, _LINKTYPE_IPV6):
+        ip = 0
+    elif linktype == _LINKTYPE_LINUX_SLL:
+        ip = 16
+    elif linktype == _LINKTYPE_LINUX_SLL2:
+        ip = 20
+    else:
+        return None
+
+    if len(frame) <= ip:
+        return None
+    version = frame[ip] >> 4
+    if version == 4:
+        if len(frame) < ip + 20:
+            return None
+        total_length, flags_offset = struct.unpack_from("!H2xH", frame, ip + 2)
+        if frame[ip + 9] != 17 or flags_offset & 0x3FFF:
+            return None
+        udp = ip + (frame[ip] & 0x0F) * 4
+        end = ip + total_length
+    elif version == 6:
+        if len(frame) < ip + 40 or frame[ip + 6] != 17:
+            return None
+        udp = ip + 40
+        end = udp + struct.unpack_from("!H", frame, ip + 4)[0]
+    else:
+        return None
+
+    if udp + 8 > end or end > len(frame):
+        return None
+    return _Udp(ip=ip, payload=udp + 8, length=end - udp - 8)
+
+
+def _replace_udp(frame: bytes, udp: _Udp, payload: bytes) -> bytes:
+    """
+    Replace the UDP payload in a frame, updating the lengths and checksums.
+    """
+    header = bytearray(frame[0 : udp.payload])
+    ip = udp.ip
+    offset = udp.payload - 8
+    length = len(payload) + 8
+
+    struct.pack_into("!H", header, offset + 4, length)
+    if header[ip] >> 4 == 4:
+        struct.pack_into("!H", header, ip + 2, offset + length - ip)
+        struct.pack_into("!H", header, ip + 10, 0)
+        struct.pack_into("!H", header, ip + 10, _checksum(bytes(header[ip:offset])))
+        pseudo_header = header[ip + 12 : ip + 20] + struct.pack("!xBH", 17, length)
+        # A zero UDP checksum means there is none, which IPv4 allows.
+        compute_checksum = header[offset + 6 : offset + 8] != b"\x00\x00"
+    else:
+        struct.pack_into("!H", header, ip + 4, length)
+        pseudo_header = header[ip + 8 : ip + 40] + struct.pack("!I3xB", length, 17)
+        compute_checksum = True
+
+    if compute_checksum:
+        struct.pack_into("!H", header, offset + 6, 0)
+        checksum = _checksum(bytes(pseudo_header + header[offset:]) + payload)
+        struct.pack_into("!H", header, offset + 6, checksum or 0xFFFF)
+    return bytes(header) + payload
+
+
+def _extract(frame: bytes, linktype: int) -> Tuple[Optional[_Udp], Optional[bytes]]:
+    udp = _find_udp(frame, linktype)
+    if udp is None:
+        return None, None
+    payload = frame[udp.payload : udp.payload + udp.length]
+    if len(payload) < 8 or payload[0] >> 6 != 2:
+        # Not RTP or RTCP, for instance STUN or DTLS.
+        return None, None
+    return udp, payload
+
+
+class _PcapFormat:
+    """
+    The classic libpcap format.
+    """
+
+    def __init__(self, data: mmap.mmap) -> None:
+        magic = data[0:4]
+        if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+            self.endian = "<"
+        else:
+            self.endian = ">"
+        if len(data) < 24:
+            raise ValueError("capture is truncated")
+        self.data = data
+        self.linktype = struct.unpack_from(self.endian + "I", data, 20)[0] & 0xFFFF
+
+    def records(self) -> Iterator[Record]:
+        data = self.data
+        header = struct.Struct(self.endian + "IIII")
+        offset = 24
+        while offset < len(data):
+            if offset + 16 > len(data):
+                raise ValueError("capture is truncated")
+            ts_sec, ts_frac, captured, original = header.unpack_from(data, offset)
+            frame = data[offset + 16 : offset + 16 + captured]
+            if len(frame) < captured:
+                raise ValueError("capture is truncated")
+            offset += 16 + captured
+
+            udp, payload = (
+                _extract(frame, self.linktype) if captured == original else (None, None)
+            )
+            yield (
+                (ts_sec, ts_frac, original, frame, udp),
+                payload,
+                payload is not None and classify(payload)[0] == PacketKind.RTCP,
+            )
+
+    def write_header(self, fp: BinaryIO) -> None:
+        fp.write(self.data[0:24])
+
+    def write(self, fp: BinaryIO, record: Any, payload: Optional[bytes]) -> None:
+        ts_sec, ts_frac, original, frame, udp = record
+        if payload is not None:
+            frame = _replace_udp(frame, udp, payload)
+            original = len(frame)
+        fp.write(
+            struct.pack(self.endian + "IIII", ts_sec, ts_frac, len(frame), original)
+        )
+        fp.write(frame)
+
+
+class _PcapngFormat:
+    """
+    The pcapng format. Enhanced and simple packet blocks are rewritten, any
+    other block is copied as-is.
+    """
+
+    def __init__(self, data: mmap.mmap) -> None:
+        self.data = data
+
+    def records(self) -> Iterator[Record]:
+        data = self.data
+        endian = "<"
+        linktypes: List[int] = []
+        offset = 0
+        while offset < len(data):
+            if offset + 12 > len(data):
+                raise ValueError("capture is truncated")
+            if data[offset : offset + 4] == b"\x0a\x0d\x0d\x0a":
+                # A section header block, whose magic gives the byte order.
+                magic = data[offset + 8 : offset + 12]
+                endian = "<" if magic == b"\x4d\x3c\x2b\x1a" else ">"
+                linktypes = []
+            block_type, block_length = struct.unpack_from(endian + "II", data, offset)
+            if block_length < 12 or offset + block_length > len(data):
+                raise ValueError("capture is truncated")
+            block = data[offset : offset + block_length]
+            offset += block_length
+
+            frame = b""
+            interface = 0
+            original = -1
+            if block_type == _PCAPNG_INTERFACE_DESCRIPTION:
+                linktypes.append(struct.unpack_from(endian + "H", block, 8)[0])
+            elif block_type == _PCAPNG_ENHANCED_PACKET:
+                interface, captured, original = struct.unpack_from(
+                    endian + "I8xII", block, 8
+                )
+                frame = block[28 : 28 + captured]
+            elif block_type == _PCAPNG_SIMPLE_PACKET:
+                original = struct.unpack_from(endian + "I", block, 8)[0]
+                frame = block[12 : min(12 + original, block_length - 4)]
+
+            if len(frame) == original and interface < len(linktypes):
+                udp, payload = _extract(frame, linktypes[interface])
+            else:
+                udp, payload = None, None
+            yield (
+                (endian, block_type, block, frame, udp),
+                payload,
+                payload is not None and classify(payload)[0] == PacketKind.RTCP,
+            )
+
+    def write_header(self, fp: BinaryIO) -> None:
+        pass
+
+    def write(self, fp: BinaryIO, record: Any, payload: Optional[bytes]) -> None:
+        endian, block_type, block, frame, udp = record
+        if payload is None:
+            fp.write(block)
+            return
+
+        old_padded = len(frame) + (-len(frame) % 4)
+        frame = _replace_udp(frame, udp, payload)
+        padding = b"\x00" * (-len(frame) % 4)
+        if block_type == _PCAPNG_ENHANCED_PACKET:
+            options = block[28 + old_padded : -4]
+            body = (
+                block[8:20]
+                + struct.pack(endian + "II", len(frame), len(frame))
+                + frame
+                + padding
+                + options
+            )
+        else:
+            body = struct.pack(endian + "I", len(frame)) + frame + padding
+        block_length = len(body) + 12
+        fp.write(struct.pack(endian + "II", block_type, block_length))
+        fp.write(body)
+        fp.write(struct.pack(endian + "I", block_length))
+
+
+class _RtpdumpFormat:
+    """
+    The rtpdump format used by the RTP tools, in its binary variant.
+    """
+
+    def __init__(self, data: mmap.mmap) -> None:
+        end = data.find(b"\n")
+        if end < 0 or end + 17 > len(data):
+            raise ValueError("capture is truncated")
+        self.data = data
+        self.header_length = end + 17
+
+    def records(self) -> Iterator[Record]:
+        data = self.data
+        offset = self.header_length
+        while offset < len(data):
+            if offset + 8 > len(data):
+                raise ValueError("capture is truncated")
+            length, packet_length, ts = struct.unpack_from("!HHI", data, offset)
+            if length < 8 or offset + length > len(data):
+                raise ValueError("capture is truncated")
+            packet = data[offset + 8 : offset + length]
+            offset += length
+
+            # Records for RTCP packets have a zero packet length. Records for
+            # RTP packets are sometimes truncated to the header.
+            rtcp = packet_length == 0
+            if rtcp or packet_length == len(packet):
+                payload: Optional[bytes] = packet
+            else:
+                payload = None
+            yield (packet_length, ts, packet), payload, rtcp
+
+    def write_header(self, fp: BinaryIO) -> None:
+        fp.write(self.data[0 : self.header_length])
+
+    def write(self, fp: BinaryIO, record: Any, payload: Optional[bytes]) -> None:
+        packet_length, ts, packet = record
+        if payload is not None:
+            packet = payload
+            if packet_length:
+                packet_length = len(payload)
+        fp.write(struct.pack("!HHI", len(packet) + 8, packet_length, ts))
+        fp.write(packet)
+
+
+def _open_format(data: mmap.mmap):
+    magic = data[0:4]
+    if magic in (
+        b"\xa1\xb2\xc3\xd4",
+        b"\xd4\xc3\xb2\xa1",
+        b"\xa1\xb2\x3c\x4d",
+        b"\x4d\x3c\xb2\xa1",
+    ):
+        return _PcapFormat(data)
+    elif magic == b"\x0a\x0d\x0d\x0a":
+        return _PcapngFormat(data)
+    elif data[0:12] == b"#!rtpplay1.0":
+        return _RtpdumpFormat(data)
+    raise ValueError("unknown capture format")
+
+
+# The session of a worker process.
+_session: Optional[Session] = None
+_protect = False
+
+
+def _init_worker(
+    key: bytes, srtp_profile: int, protect: bool, window_size: Optional[int]
+) -> None:
+    global _protect, _session
+
+    if protect:
+        policy = Policy(
+            key=key, srtp_profile=srtp_profile, ssrc_type=Policy.SSRC_ANY_OUTBOUND
+        )
+        # Captures may contain retransmissions.
+        policy.allow_repeat_tx = True
+    else:
+        policy = Policy(
+            key=key, srtp_profile=srtp_profile, ssrc_type=Policy.SSRC_ANY_INBOUND
+        )
+    if window_size is not None:
+        policy.window_size = window_size
+    _protect = protect
+    _session = Session(policy=policy, max_packet_size=65535)
+
+
+def _process(packets: Sequence[Tuple[bytes, bool]]) -> List[Optional[bytes]]:
+    """
+    Process a batch of packets, returning `None` for those which failed.
+    """
+    assert _session is not None, "worker is not initialized"
+    if _protect:
+        rtp_func, rtcp_func = _session.protect_many, _session.protect_rtcp_many
+    else:
+        rtp_func, rtcp_func = _session.unprotect_many, _session.unprotect_rtcp_many
+
+    results: List[Optional[bytes]] = [None] * len(packets)
+    for rtcp, func in ((False, rtp_func), (True, rtcp_func)):
+        indices = [i for i, packet in enumerate(packets) if packet[1] == rtcp]
+        if indices:
+            for i, (status, data) in zip(
+                indices, func([packets[i][0] for i in indices])
+            ):
+                results[i] = data
+    return results
+
+
+class CaptureStats(NamedTuple):
+    """
+    Counters of the records of a capture processed by :func:`process_capture`.
+    """
+
+    #: The number of records read from the capture.
+    records: int
+    #: The number of packets successfully processed.
+    processed: int
+    #: The number of packets which could not be processed.
+    failed: int
+    #: The size of the packets successfully processed, before processing.
+    bytes: int
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.records = 0
+        self.processed = 0
+        self.failed = 0
+        self.bytes = 0
+
+
+def _write_batch(
+    fp: BinaryIO,
+    fmt: Any,
+    batch: List[Record],
+    shards: List[List[int]],
+    results: List[Any],
+    keep_failed: bool,
+    stats: _Stats,
+) -> None:
+    outputs: List[Optional[bytes]] = [None] * len(batch)
+    for indices, result in zip(shards, results):
+        if isinstance(result, Future):
+            result = result.result()
+        for i, data in zip(indices, result):
+            outputs[i] = data
+
+    for (record, payload, rtcp), output in zip(batch, outputs):
+        stats.records += 1
+        if payload is None:
+            fmt.write(fp, record, None)
+        elif output is None:
+            stats.failed += 1
+            if keep_failed:
+                fmt.write(fp, record, None)
+        else:
+            stats.processed += 1
+            stats.bytes += len(payload)
+            fmt.write(fp, record, output)
+
+
+def process_capture(
+    input_path: str,
+    output_path: str,
+    *,
+    key: bytes,
+    srtp_profile: int = Policy.SRTP_PROFILE_AES128_CM_SHA1_80,
+    protect: bool = False,
+    workers: int = 0,
+    batch_size: int = 1024,
+    window_size: Optional[int] = None,
+    keep_failed: bool = False,
+) -> CaptureStats:
+    """
+    Unprotect, or protect if `protect` is set, the packets of the capture at
+    `input_path` and write the result to `output_path`.
+
+    If `workers` is zero the packets are processed in the current process.
+    """
+    # Set up a session in this process before starting any worker, so that
+    # invalid parameters raise here. It processes the packets if there are
+    # no workers.
+    initargs = (key, srtp_profile, protect, window_size)
+    _init_worker(*initargs)
+    executors = [
+        ProcessPoolExecutor(1, initializer=_init_worker, initargs=initargs)
+        for _ in range(workers)
+    ]
+
+    stats = _Stats()
+    try:
+        with open(input_path, "rb") as input_fp:
+            if not os.fstat(input_fp.fileno()).st_size:
+                raise ValueError("unknown capture format")
+            with mmap.mmap(input_fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                fmt = _open_format(data)
+                with open(output_path, "wb") as output_fp:
+                    fmt.write_header(output_fp)
+                    _process_records(
+                        output_fp, fmt, executors, batch_size, keep_failed, stats
+                    )
+    finally:
+        for executor in executors:
+            executor.shutdown()
+    return CaptureStats(stats.records, stats.processed, stats.failed, stats.bytes)
+
+
+def _process_records(
+    fp: BinaryIO,
+    fmt: Any,
+    executors: List[ProcessPoolExecutor],
+    batch_size: int,
+    keep_failed: bool,
+    stats: _Stats,
+) -> None:
+    shard_count = max(len(executors), 1)
+    # Batches being processed, which are written out in order.
+    pending: Deque[Tuple[List[Record], List[List[int]], List[Any]]] = deque()
+
+    def submit(batch: List[Record]) -> None:
+        shards: List[List[int]] = [[] for _ in range(shard_count)]
+        for i, (record, payload, rtcp) in enumerate(batch):
+            if payload is not None:
+                offset = 4 if rtcp else 8
+                ssrc = int.from_bytes(payload[offset : offset + 4], "big")
+                shards[ssrc % shard_count].append(i)
+
+        results: List[Any] = []
+        for shard, indices in enumerate(shards):
+            packets = [(batch[i][1], batch[i][2]) for i in indices]
+            if executors:
+                results.append(executors[shard].submit(_process, packets))
+            else:
+                results.append(_process(packets))
+        pending.append((batch, shards, results))
+
+        while len(pending) > 2 * len(executors):
+            _write_batch(fp, fmt, *pending.popleft(), keep_failed, stats)
+
+    batch: List[Record] = []
+    for record in fmt.records():
+        batch.append(record)
+        if len(batch) >= batch_size:
+            submit(batch)
+            batch = []
+    if batch:
+        submit(batch)
+    while pending:
+        _write_batch(fp, fmt, *pending.popleft(), keep_failed, stats)
+
+
+def _parse_key(args: argparse.Namespace) -> bytes:
+    try:
+        if args.key_hex is not None:
+            return bytes.fromhex(args.key_hex)
+        return base64.b64decode(args.key, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid key") from None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m pylibsrtp",
+        description="Decrypt or encrypt the SRTP packets of a pcap, pcapng "
+        "or rtpdump capture.",
+    )
+    parser.add_argument(
+        "action", choices=["decrypt", "encrypt"], help="the operation to perform"
+    )
+    parser.add_argument("input", help="the capture to read")
+    parser.add_argument("output", help="the capture to write")
+    key_group = parser.add_mutually_exclusive_group(required=True)
+    key_group.add_argument(
+        "--key", help="the master key + master salt, base64-encoded as in SDP"
+    )
+    key_group.add_argument(
+        "--key-hex", help="the master key + master salt, hex-encoded"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES.keys()),
+        default="AES128_CM_SHA1_80",
+        help="the SRTP profile (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="the number of worker processes, 0 to process packets in the main "
+        "process (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1024,
+        help="the number of packets per batch (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--window-size", type=int, help="the replay window size when decrypting"
+    )
+    parser.add_argument(
+        "--keep-failed",
+        action="store_true",
+        help="copy packets which could not be processed instead of dropping them",
+    )
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("the number of workers cannot be negative")
+    if args.batch_size < 1:
+        parser.error("the batch size must be at least 1")
+
+    start = time.perf_counter()
+    try:
+        stats = process_capture(
+            args.input,
+            args.output,
+            key=_parse_key(args),
+            srtp_profile=PROFILES[args.profile],
+            protect=args.action == "encrypt",
+            workers=args.workers,
+            batch_size=args.batch_size,
+            window_size=args.window_size,
+            keep_failed=args.keep_failed,
+        )
+    except (Error, OSError, ValueError) as exc:
+        parser.exit(1, "%s: error: %s\n" % (parser.prog, exc))
+    elapsed = time.perf_counter() - start
+
+    print(
+        "%d records in %.3f s: %d packets %sed (%.0f packets/s, %.1f MB/s), "
+        "%d failed, %d copied"
+        % (
+            stats.records,
+            elapsed,
+            stats.processed,
+            args.action,
+            stats.processed / elapsed,
+            stats.bytes / elapsed / 1e6,
+            stats.failed,
+            stats.records - stats.processed - stats.failed,
+        ),
+        file=sys.stderr,
+    )
@@ -0,0 +1,161 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, List, Optional, Tuple
+
+from . import Session
+
+__all__ = ["SrtpDatagramProtocol"]
+
+Address = Any
+
+
+class SrtpDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol for SRTP and SRTCP packets.
+
+    Incoming packets are unprotected using `rx_session` and passed to
+    :meth:`rtp_received` or :meth:`rtcp_received`, which subclasses should
+    override. Outgoing packets are protected using `tx_session` by
+    :meth:`send_rtp` and :meth:`send_rtcp`.
+
+    Packets received during the same event loop iteration are unprotected
+    together, at most `max_batch` at a time. At most `max_pending` packets
+    are queued, further packets are dropped. If `executor_threshold` is set,
+    batches of at least that many packets are unprotected in `executor`.
+
+    Exceptions raised by :meth:`rtp_received` or :meth:`rtcp_received` are
+    passed to the event loop's exception handler, and the following packets
+    are still delivered. When the connection is lost, queued packets and the
+    batch being unprotected in `executor`, if any, are dropped.
+    """
+
+    def __init__(
+        self,
+        rx_session: Session,
+        tx_session: Session,
+        *,
+        max_batch: int = 256,
+        max_pending: int = 4096,
+        executor_threshold: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self.rx_session = rx_session
+        self.tx_session = tx_session
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+        #: Number of packets dropped because the queue was full.
+        self.dropped_packets = 0
+        #: Number of packets which failed to be unprotected.
+        self.rejected_packets = 0
+
+        self._executor = executor
+        self._executor_threshold = executor_threshold
+        self._max_batch = max_batch
+        self._max_pending = max_pending
+        self._future: Optional[asyncio.Future] = None
+        self._handle: Optional[asyncio.Handle] = None
+        self._pending: List[Tuple[bytes, Address]] = []
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.transport = None
+        self._pending.clear()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    def datagram_received(self, data: bytes, addr: Address) -> None:
+        if len(self._pending) >= self._max_pending:
+            self.dropped_packets += 1
+            return
+        self._pending.append((data, addr))
+        self._schedule()
+
+    def rtcp_received(self, data: bytes, addr: Address) -> None:
+        """
+        Called when an RTCP packet was received and unprotected.
+        """
+
+    def rtp_received(self, data: bytes, addr: Address) -> None:
+        """
+        Called when an RTP packet was received and unprotected.
+        """
+
+    def send_rtcp(self, data: bytes, addr: Address = None) -> None:
+        """
+        Protect the RTCP packet `data` and send it.
+        """
+        assert self.transport is not None, "transport is not connected"
+        self.transport.sendto(self.tx_session.protect_rtcp(data), addr)
+
+    def send_rtp(self, data: bytes, addr: Address = None) -> None:
+        """
+        Protect the RTP packet `data` and send it.
+        """
+        assert self.transport is not None, "transport is not connected"
+        self.transport.sendto(self.tx_session.protect(data), addr)
+
+    def _dispatch(self, batch, results) -> None:
+        for (data, addr), (status, result, rtcp) in zip(batch, results):
+            if result is None:
+                self.rejected_packets += 1
+                continue
+            try:
+                if rtcp:
+                    self.rtcp_received(result, addr)
+                else:
+                    self.rtp_received(result, addr)
+            except Exception as exc:
+                # Report the error like asyncio does for protocol callbacks.
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": "Exception in packet callback",
+                        "exception": exc,
+                        "protocol": self,
+                    }
+                )
+
+    def _flush(self) -> None:
+        self._handle = None
+        batch = self._pending[0 : self._max_batch]
+        del self._pending[0 : self._max_batch]
+
+        if (
+            self._executor_threshold is not None
+            and len(batch) >= self._executor_threshold
+        ):
+            self._future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._unprotect, batch
+            )
+            self._future.add_done_callback(self._flush_done)
+        else:
+            try:
+                self._dispatch(*self._unprotect(batch))
+            finally:
+                self._schedule()
+
+    def _flush_done(self, future: asyncio.Future) -> None:
+        # The batch is dropped if the connection was lost meanwhile.
+        if future is not self._future:
+            return
+        self._future = None
+        try:
+            self._dispatch(*future.result())
+        finally:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        # Batches are processed one at a time to preserve ordering.
+        if self._pending and self._future is None and self._handle is None:
+            self._handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _unprotect(self, batch):
+        return (
+            batch,
+            self.rx_session.unprotect_auto_many([data for data, addr in batch]),
+        )
@@ -0,0 +1,508 @@
+"""
+Offload SRTP processing to worker processes.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import connection, shared_memory
+from typing import Any, Callable, Deque, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import ERRORS, Error, Policy, Session, lib
+
+__all__ = ["ParallelSession"]
+
+# Control operations, after the PYLIBSRTP_* packet operations.
+_ADD_STREAM = 4
+_REMOVE_STREAM = 5
+_UPDATE = 6
+
+
+def _run_worker(
+    conn: connection.Connection,
+    name: str,
+    slot_size: int,
+    policies: List[Policy],
+) -> None:
+    shm = shared_memory.SharedMemory(name=name)
+    buffer = shm.buf
+    try:
+        session = Session(max_packet_size=slot_size)
+        for policy in policies:
+            session.add_stream(policy)
+        funcs = (
+            session.protect_into,
+            session.protect_rtcp_into,
+            session.unprotect_into,
+            session.unprotect_rtcp_into,
+        )
+        controls = {
+            _ADD_STREAM: session.add_stream,
+            _REMOVE_STREAM: session.remove_stream,
+            _UPDATE: session.update,
+        }
+
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            op, argument = message
+            if op in controls:
+                try:
+                    controls[op](argument)
+                except Error as exc:
+                    conn.send(int(exc.code))
+                else:
+                    conn.send(lib.srtp_err_status_ok)
+                continue
+
+            func = funcs[op]
+            results = []
+            for slot, length in argument:
+                offset = slot * slot_size
+                try:
+                    length = func(buffer[offset : offset + slot_size], length)
+                except Error as exc:
+                    results.append((int(exc.code), 0))
+                except ValueError:
+                    # There is no room for the trailer.
+                    results.append((lib.srtp_err_status_bad_param, 0))
+                else:
+                    results.append((lib.srtp_err_status_ok, length))
+            conn.send(results)
+    finally:
+        del buffer
+        shm.close()
+        conn.close()
+
+
+class _Request(NamedTuple):
+    # The slots used by the request.
+    slots: List[int]
+    # Called from the receiver thread with the response or an exception.
+    callback: Callable[[Any], None]
+
+
+class _Worker:
+    """
+    A worker process, with a ring of packet slots in shared memory.
+
+    Slots are allocated in order and the worker answers requests in order, so
+    the slots in use always form a contiguous run of the ring.
+    """
+
+    def __init__(
+        self,
+        context: Any,
+        slots: int,
+        slot_size: int,
+        policies: List[Policy],
+    ) -> None:
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_run_worker,
+            args=(child_conn, self.shm.name, slot_size, policies),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        self.alive = True
+        self.condition = threading.Condition()
+        self.head = 0
+        self.pending: Deque[_Request] = deque()
+        self.slot_size = slot_size
+        self.slots = slots
+        self.used = 0
+
+    def complete(self, response: Any) -> None:
+        with self.condition:
+            request = self.pending.popleft()
+            if isinstance(response, list):
+                # Copy the processed packets out of their slots.
+                buffer = self.shm.buf
+                results = []
+                for slot, (status, length) in zip(request.slots, response):
+                    if status == lib.srtp_err_status_ok:
+                        offset = slot * self.slot_size
+                        results.append(
+                            (status, bytes(buffer[offset : offset + length]))
+                        )
+                    else:
+                        results.append((status, None))
+                response = results
+            self.used -= len(request.slots)
+            self.condition.notify_all()
+        request.callback(response)
+
+    def fail(self, exc: Exception) -> None:
+        with self.condition:
+            self.alive = False
+            pending = list(self.pending)
+            self.pending.clear()
+            self.condition.notify_all()
+        for request in pending:
+            request.callback(exc)
+
+    def submit(self, op: int, argument: Any, callback: Callable[[Any], None]) -> None:
+        with self.condition:
+            slots: List[int] = []
+            if op < _ADD_STREAM:
+                packets = argument
+                while self.alive and self.used + len(packets) > self.slots:
+                    self.condition.wait()
+                if self.alive:
+                    argument = []
+                    buffer = self.shm.buf
+                    for packet in packets:
+                        offset = self.head * self.slot_size
+                        buffer[offset : offset + len(packet)] = packet
+                        argument.append((self.head, len(packet)))
+                        slots.append(self.head)
+                        self.head = (self.head + 1) % self.slots
+                    self.used += len(packets)
+
+            if self.alive:
+                self.pending.append(_Request(slots=slots, callback=callback))
+                self.conn.send((op, argument))
+                return
+        callback(RuntimeError("worker process exited"))
+
+    def close(self) -> None:
+        with self.condition:
+            if self.alive:
+                self.conn.send(None)
+
+
+class ParallelSession:
+    """
+    SRTP session whose packets are processed by a pool of worker processes.
+
+    Each worker owns its own :class:`Session`, to which the given `policies`
+    are added. Packets are dispatched to workers according to their SSRC, so
+    all the packets of a stream are processed by the same worker, in order.
+
+    Packets are exchanged with each worker through a ring of `slots` buffers
+    of `max_packet_size` bytes in shared memory, and only small control
+    messages go through pipes. When all the slots of a worker are in use,
+    submitting packets blocks until the worker catches up.
+
+    Methods return :class:`concurrent.futures.Future` objects, which can be
+    awaited from :mod:`asyncio` using :func:`asyncio.wrap_future`. Callbacks
+    added to these futures run in a background thread and must not block.
+    Batches submitted with the `*_many` methods amortize the cost of
+    communicating with the workers and should be preferred.
+
+    :param policies: the :class:`Policy` objects for the session's streams
+    :param workers: the number of worker processes, by default the number
+        of CPUs
+    :param slots: the number of packet slots per worker
+    :param max_packet_size: the maximum size of a packet, before
+        unprotection or after protection
+    :param mp_context: the :mod:`multiprocessing` context used to start
+        the workers
+    """
+
+    def __init__(
+        self,
+        policies: Sequence[Policy] = (),
+        *,
+        workers: Optional[int] = None,
+        slots: int = 256,
+        max_packet_size: int = 1500,
+        mp_context: Any = None,
+    ) -> None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+
+        # Check the policies before starting any worker.
+        session = Session()
+        for policy in policies:
+            session.add_stream(policy)
+
+        if mp_context is None:
+            mp_context = multiprocessing.get_context()
+        self._closed = False
+        self._max_packet_size = max_packet_size
+        self._workers: List[_Worker] = []
+        try:
+            for _ in range(workers):
+                self._workers.append(
+                    _Worker(mp_context, slots, max_packet_size, list(policies))
+                )
+        except BaseException:
+            self.__shutdown()
+            raise
+
+        self._receiver = threading.Thread(
+            target=self.__receive, name="pylibsrtp-parallel", daemon=True
+        )
+        self._receiver.start()
+
+    def __enter__(self) -> "ParallelSession":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Stop the workers, once they have processed the pending packets.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            worker.close()
+        self._receiver.join()
+        self.__shutdown()
+
+    def add_stream(self, policy: Policy) -> None:
+        """
+        Add a stream to the workers, applying the given `policy` to the
+        stream.
+
+        :param policy: :class:`Policy`
+        """
+        if policy.ssrc_type == Policy.SSRC_SPECIFIC:
+            workers = [self.__worker(policy.ssrc_value)]
+        else:
+            workers = self._workers
+        self.__control(workers, _ADD_STREAM, policy)
+
+    def remove_stream(self, ssrc: int) -> None:
+        """
+        Remove the stream with the given `ssrc`.
+
+        :param ssrc: :class:`int`
+        """
+        self.__control([self.__worker(ssrc)], _REMOVE_STREAM, ssrc)
+
+    def update(self, policy: Policy) -> None:
+        """
+        Update the keys of the streams in place, see :meth:`Session.update`.
+
+        :param policy: :class:`Policy`
+        """
+        if policy.ssrc_type == Policy.SSRC_SPECIFIC:
+            workers = [self.__worker(policy.ssrc_value)]
+        else:
+            workers = self._workers
+        self.__control(workers, _UPDATE, policy)
+
+    def protect(self, packet: bytes) -> "Future[bytes]":
+        """
+        Apply SRTP protection to the RTP `packet`.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`bytes`
+        """
+        return self.__process(packet, lib.PYLIBSRTP_PROTECT)
+
+    def protect_rtcp(self, packet: bytes) -> "Future[bytes]":
+        """
+        Apply SRTCP protection to the RTCP `packet`.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`bytes`
+        """
+        return self.__process(packet, lib.PYLIBSRTP_PROTECT_RTCP)
+
+    def unprotect(self, packet: bytes) -> "Future[bytes]":
+        """
+        Verify SRTP protection of the SRTP packet.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`bytes`
+        """
+        return self.__process(packet, lib.PYLIBSRTP_UNPROTECT)
+
+    def unprotect_rtcp(self, packet: bytes) -> "Future[bytes]":
+        """
+        Verify SRTCP protection of the SRTCP packet.
+
+        :param packet: :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`bytes`
+        """
+        return self.__process(packet, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def protect_many(
+        self, packets: Sequence[bytes]
+    ) -> "Future[List[Tuple[int, Optional[bytes]]]]":
+        """
+        Apply SRTP protection to a batch of RTP `packets`.
+
+        The result has the same format as :meth:`Session.protect_many`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`list`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_PROTECT)
+
+    def protect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> "Future[List[Tuple[int, Optional[bytes]]]]":
+        """
+        Apply SRTCP protection to a batch of RTCP `packets`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`list`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_PROTECT_RTCP)
+
+    def unprotect_many(
+        self, packets: Sequence[bytes]
+    ) -> "Future[List[Tuple[int, Optional[bytes]]]]":
+        """
+        Verify SRTP protection of a batch of SRTP `packets`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`list`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT)
+
+    def unprotect_rtcp_many(
+        self, packets: Sequence[bytes]
+    ) -> "Future[List[Tuple[int, Optional[bytes]]]]":
+        """
+        Verify SRTCP protection of a batch of SRTCP `packets`.
+
+        :param packets: sequence of :class:`bytes`
+        :rtype: :class:`concurrent.futures.Future` of :class:`list`
+        """
+        return self.__process_many(packets, lib.PYLIBSRTP_UNPROTECT_RTCP)
+
+    def __check(self, packet: bytes) -> None:
+        if self._closed:
+            raise RuntimeError("session is closed")
+        if not isinstance(packet, bytes):
+            raise TypeError("packet must be bytes")
+        if len(packet) > self._max_packet_size:
+            raise ValueError("packet is too long")
+
+    def __control(self, workers: List[_Worker], op: int, argument: Any) -> None:
+        if self._closed:
+            raise RuntimeError("session is closed")
+        futures: List[Future] = []
+        for worker in workers:
+            future: Future = Future()
+            worker.submit(op, argument, _resolve(future, lambda status: status))
+            futures.append(future)
+        for future in futures:
+            status = future.result()
+            if status != lib.srtp_err_status_ok:
+                raise Error(ERRORS[status], status)
+
+    def __process(self, packet: bytes, op: int) -> "Future[bytes]":
+        self.__check(packet)
+        future: Future = Future()
+
+        def unpack(results):
+            status, data = results[0]
+            if data is None:
+                raise Error(ERRORS[status], status)
+            return data
+
+        self.__worker(_packet_ssrc(packet, op)).submit(
+            op, [packet], _resolve(future, unpack)
+        )
+        return future
+
+    def __process_many(
+        self, packets: Sequence[bytes], op: int
+    ) -> "Future[List[Tuple[int, Optional[bytes]]]]":
+        shards: List[List[int]] = [[] for _ in self._workers]
+        for i, packet in enumerate(packets):
+            self.__check(packet)
+            shards[_packet_ssrc(packet, op) % len(shards)].append(i)
+
+        future: Future = Future()
+        results: List[Any] = [None] * len(packets)
+        chunks = []
+        for worker, indices in zip(self._workers, shards):
+            for start in range(0, len(indices), worker.slots):
+                chunks.append((worker, indices[start : start + worker.slots]))
+        if not chunks:
+            future.set_result([])
+            return future
+
+        lock = threading.Lock()
+        remaining = [len(chunks)]
+
+        def make_callback(indices):
+            def callback(response):
+                with lock:
+                    if future.done():
+                        return
+                    if isinstance(response, Exception):
+                        future.set_exception(response)
+                        return
+                    for i, result in zip(indices, response):
+                        results[i] = result
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        future.set_result(results)
+
+            return callback
+
+        for worker, indices in chunks:
+            worker.submit(op, [packets[i] for i in indices], make_callback(indices))
+        return future
+
+    def __receive(self) -> None:
+        workers = {worker.conn: worker for worker in self._workers}
+        while workers:
+            for conn in connection.wait(list(workers.keys())):
+                worker = workers[conn]
+                try:
+                    response = conn.recv()
+                except (EOFError, OSError):
+                    del workers[conn]
+                    worker.fail(RuntimeError("worker process exited"))
+                else:
+                    worker.complete(response)
+
+    def __shutdown(self) -> None:
+        for worker in self._workers:
+            worker.close()
+            worker.process.join()
+            worker.conn.close()
+            worker.shm.close()
+            worker.shm.unlink()
+
+    def __worker(self, ssrc: int) -> _Worker:
+        return self._workers[ssrc % len(self._workers)]
+
+
+def _packet_ssrc(packet: bytes, op: int) -> int:
+    offset = (
+        4 if op in (lib.PYLIBSRTP_PROTECT_RTCP, lib.PYLIBSRTP_UNPROTECT_RTCP) else 8
+    )
+    return int.from_bytes(packet[offset : offset + 4], "big")
+
+
+def _resolve(future: Future, func: Callable[[Any], Any]) -> Callable[[Any], None]:
+    """
+    Return a callback which resolves `future` with `func(response)`.
+    """
+
+    def callback(response: Any) -> None:
+        if isinstance(response, Exception):
+            future.set_exception(response)
+            return
+        try:
+            result = func(response)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    return callback
@@ -0,0 +1,342 @@
+"""
+Throughput benchmarks for pylibsrtp.
+
+Run them from the root of the repository with::
+
+    python -m tests.benchmark [--json results.json] [--quick] [name ...]
+
+Results are printed one per line and can also be written as JSON, which makes
+it possible to compare builds against different versions of libsrtp or
+OpenSSL.
+"""
+
+import argparse
+import json
+import platform
+import secrets
+import subprocess
+import sys
+import time
+
+import pylibsrtp
+from pylibsrtp import Policy, Session, ffi, lib
+
+from .test_session import SRTP_PROFILES
+
+PAYLOAD_SIZES = [20, 160, 500, 1000, 1300]
+STREAM_COUNTS = [1, 100]
+
+PROFILE_NAMES = {
+    getattr(Policy, name): name[len("SRTP_PROFILE_") :]
+    for name in dir(Policy)
+    if name.startswith("SRTP_PROFILE_")
+}
+
+
+def make_rtp(ssrc: int, seq: int, payload_size: int) -> bytes:
+    return (
+        b"\x80\x08"
+        + (seq & 0xFFFF).to_bytes(2, "big")
+        + b"\x00\x00\x00\x00"
+        + ssrc.to_bytes(4, "big")
+        + b"\xd4" * payload_size
+    )
+
+
+def make_rtcp(ssrc: int, payload_size: int) -> bytes:
+    # A sender report padded to the requested size.
+    length = (payload_size + 8 + 3) // 4 * 4
+    return (
+        b"\x80\xc8"
+        + (length // 4 - 1).to_bytes(2, "big")
+        + ssrc.to_bytes(4, "big")
+        + b"\x00" * (length - 8)
+    )
+
+
+def make_packets(kind: str, payload_size: int, streams: int, count: int):
+    packets = []
+    for i in range(count):
+        ssrc = 1000 + i % streams
+        if kind == "rtp":
+            packets.append(make_rtp(ssrc, i // streams, payload_size))
+        else:
+            packets.append(make_rtcp(ssrc, payload_size))
+    return packets
+
+
+def make_sessions(srtp_profile: int, key: bytes):
+    tx_session = Session(
+        policy=Policy(
+            key=key, srtp_profile=srtp_profile, ssrc_type=Policy.SSRC_ANY_OUTBOUND
+        )
+    )
+    rx_session = Session(
+        policy=Policy(
+            key=key, srtp_profile=srtp_profile, ssrc_type=Policy.SSRC_ANY_INBOUND
+        )
+    )
+    return tx_session, rx_session
+
+
+def run_packets(method: str, func, packets):
+    """
+    Process all the `packets`, returning the elapsed time and the results.
+    """
+    if method == "many":
+        start = time.perf_counter()
+        results = func(packets)
+        elapsed = time.perf_counter() - start
+        return elapsed, [data for status, data in results]
+    else:
+        start = time.perf_counter()
+        results = [func(packet) for packet in packets]
+        elapsed = time.perf_counter() - start
+        return elapsed, results
+
+
+def bench_packets(quick: bool):
+    """
+    Packets per second for every profile, packet kind, operation, payload size
+    and number of streams.
+    """
+    count = 500 if quick else 5000
+    for profile in SRTP_PROFILES:
+        key = secrets.token_bytes(profile.key_length)
+        for kind in ["rtp", "rtcp"]:
+            suffix = "" if kind == "rtp" else "_rtcp"
+            for streams in STREAM_COUNTS:
+                for payload_size in PAYLOAD_SIZES:
+                    packets = make_packets(kind, payload_size, streams, count)
+                    for method in ["single", "many"]:
+                        tx_session, rx_session = make_sessions(
+                            profile.srtp_profile, key
+                        )
+                        data = packets
+                        for session, operation in [
+                            (tx_session, "protect"),
+                            (rx_session, "unprotect"),
+                        ]:
+                            name = operation + suffix
+                            if method == "many":
+                                name += "_many"
+                            elapsed, data = run_packets(
+                                method, getattr(session, name), data
+                            )
+                            yield {
+                                "profile": PROFILE_NAMES[profile.srtp_profile],
+                                "kind": kind,
+                                "operation": operation,
+                                "method": method,
+                                "payload_size": payload_size,
+                                "streams": streams,
+                                "packets_per_second": round(count / elapsed),
+                            }
+
+
+def bench_setup(quick: bool):
+    """
+    Microseconds per call to create the policies and sessions for a call,
+    either from scratch or by copying a template policy.
+    """
+    count = 1000 if quick else 10000
+    for profile in SRTP_PROFILES:
+        keys = [secrets.token_bytes(profile.key_length) for i in range(count)]
+        template = Policy(srtp_profile=profile.srtp_profile)
+
+        def new_policy(key, ssrc_type):
+            return Policy(
+                key=key, ssrc_type=ssrc_type, srtp_profile=profile.srtp_profile
+            )
+
+        def copy_policy(key, ssrc_type):
+            return template.copy(key=key, ssrc_type=ssrc_type)
+
+        for method, create_policy in [("new", new_policy), ("copy", copy_policy)]:
+            start = time.perf_counter()
+            for key in keys:
+                create_policy(key, Policy.SSRC_ANY_OUTBOUND)
+                create_policy(key, Policy.SSRC_ANY_INBOUND)
+            policy_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for key in keys:
+                Session(policy=create_policy(key, Policy.SSRC_ANY_OUTBOUND))
+                Session(policy=create_policy(key, Policy.SSRC_ANY_INBOUND))
+            session_elapsed = time.perf_counter() - start
+
+            for what, elapsed in [
+                ("policy", policy_elapsed),
+                ("policy+session", session_elapsed),
+            ]:
+                yield {
+                    "profile": PROFILE_NAMES[profile.srtp_profile],
+                    "method": method,
+                    "setup": what,
+                    "us_per_call": round(elapsed / count * 1e6, 2),
+                }
+
+
+def make_rtp_with_extensions(ssrc: int, seq: int, payload_size: int) -> bytes:
+    # One-byte header extensions: an audio level (id 1) and a video
+    # orientation (id 2).
+    return (
+        b"\x90\x08"
+        + (seq & 0xFFFF).to_bytes(2, "big")
+        + b"\x00\x00\x00\x00"
+        + ssrc.to_bytes(4, "big")
+        + b"\xbe\xde\x00\x02"
+        + b"\x10\x7f\x20\x01"
+        + b"\x00\x00\x00\x00"
+        + b"\xd4" * payload_size
+    )
+
+
+def bench_header_extensions(quick: bool):
+    """
+    Packets per second when protecting and unprotecting RTP packets carrying
+    header extensions, with and without encrypting the extensions.
+    """
+    count = 500 if quick else 5000
+    for profile in SRTP_PROFILES:
+        key = secrets.token_bytes(profile.key_length)
+        for payload_size in [160, 1000]:
+            packets = [
+                make_rtp_with_extensions(1000, i, payload_size) for i in range(count)
+            ]
+            for enc_xtn_hdr in [[], [1, 2]]:
+                tx_policy = Policy(
+                    key=key,
+                    srtp_profile=profile.srtp_profile,
+                    ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                )
+                tx_policy.enc_xtn_hdr = enc_xtn_hdr
+                rx_policy = tx_policy.copy(ssrc_type=Policy.SSRC_ANY_INBOUND)
+                data = packets
+                for session, operation in [
+                    (Session(policy=tx_policy), "protect"),
+                    (Session(policy=rx_policy), "unprotect"),
+                ]:
+                    elapsed, data = run_packets(
+                        "single", getattr(session, operation), data
+                    )
+                    yield {
+                        "profile": PROFILE_NAMES[profile.srtp_profile],
+                        "operation": operation,
+                        "encrypted_extensions": len(enc_xtn_hdr),
+                        "payload_size": payload_size,
+                        "packets_per_second": round(count / elapsed),
+                    }
+
+
+def bench_streams(quick: bool):
+    """
+    Packets per second when protecting and unprotecting packets spread over a
+    growing number of streams in a single session, which shows the cost of
+    finding the stream of each packet.
+    """
+    count = 2000 if quick else 20000
+    key = secrets.token_bytes(30)
+    for streams in [1, 10, 100, 1000, 10000]:
+        tx_session, rx_session = make_sessions(
+            Policy.SRTP_PROFILE_AES128_CM_SHA1_80, key
+        )
+
+        # Create the streams, then process packets for random streams.
+        warmup = make_packets("rtp", 160, streams, streams)
+        for packet in warmup:
+            rx_session.unprotect(tx_session.protect(packet))
+        ssrcs = [1000 + (i * 7919) % streams for i in range(count)]
+        packets = [
+            make_rtp(ssrc, 1 + i // streams, 160) for i, ssrc in enumerate(ssrcs)
+        ]
+
+        data = packets
+        for session, operation in [
+            (tx_session, "protect"),
+            (rx_session, "unprotect"),
+        ]:
+            elapsed, data = run_packets("single", getattr(session, operation), data)
+            yield {
+                "operation": operation,
+                "streams": streams,
+                "packets_per_second": round(count / elapsed),
+            }
+
+
+def bench_import(quick: bool):
+    """
+    Milliseconds to start an interpreter which imports pylibsrtp, and to
+    initialize libsrtp, compared to starting an interpreter which does nothing.
+    The best of several runs is kept.
+    """
+    runs = 5 if quick else 20
+    for what, code in [
+        ("python", "pass"),
+        ("import", "import pylibsrtp"),
+        ("import+init", "import pylibsrtp; pylibsrtp.init()"),
+    ]:
+        best = None
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        yield {"startup": what, "ms": round(best * 1000, 2)}
+
+
+BENCHMARKS = {
+    "header_extensions": bench_header_extensions,
+    "import": bench_import,
+    "packets": bench_packets,
+    "setup": bench_setup,
+    "streams": bench_streams,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run pylibsrtp benchmarks.")
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="the benchmarks to run, among: %s (default: all)"
+        % ", ".join(sorted(BENCHMARKS.keys())),
+    )
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument(
+        "--quick", action="store_true", help="process fewer packets per run"
+    )
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %r" % name)
+
+    results = []
+    for name in args.names or sorted(BENCHMARKS.keys()):
+        for result in BENCHMARKS[name](args.quick):
+            result = {"benchmark": name, **result}
+            print(" ".join("%s=%s" % item for item in result.items()))
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(
+                {
+                    "environment": {
+                        "libsrtp": ffi.string(lib.srtp_get_version_string()).decode(),
+                        "machine": platform.machine(),
+                        "platform": platform.platform(),
+                        "pylibsrtp": pylibsrtp.__version__,
+                        "python": sys.version,
+                    },
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
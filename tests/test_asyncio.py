@@ -0,0 +1,199 @@
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from unittest import IsolatedAsyncioTestCase
+
+from pylibsrtp import Policy, Session
+from pylibsrtp.asyncio import SrtpDatagramProtocol
+
+RTP = (
+    b"\x80\x08\x00\x00"  # version, packet type, sequence number
+    b"\x00\x00\x00\x00"  # timestamp
+    b"\x00\x00\x30\x39"  # ssrc: 12345
+) + (b"\xd4" * 160)
+RTCP = (
+    b"\x80\xc8\x00\x06\xf3\xcb\x20\x01\x83\xab\x03\xa1\xeb\x02\x0b\x3a"
+    b"\x00\x00\x94\x20\x00\x00\x00\x9e\x00\x00\x9b\x88"
+)
+
+
+def make_packets(count):
+    return [RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(count)]
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr=None):
+        self.sent.append((data, addr))
+
+
+class RecordingProtocol(SrtpDatagramProtocol):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = []
+
+    def rtcp_received(self, data, addr):
+        self.received.append(("rtcp", data, addr))
+
+    def rtp_received(self, data, addr):
+        self.received.append(("rtp", data, addr))
+
+
+class FailingProtocol(RecordingProtocol):
+    def rtp_received(self, data, addr):
+        super().rtp_received(data, addr)
+        raise ValueError("bad packet")
+
+
+class SrtpDatagramProtocolTest(IsolatedAsyncioTestCase):
+    def setUp(self):
+        key = secrets.token_bytes(30)
+        self.tx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        self.rx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+
+    def create_protocol(self, **kwargs):
+        protocol = RecordingProtocol(
+            Session(policy=self.rx_policy), Session(policy=self.tx_policy), **kwargs
+        )
+        protocol.connection_made(FakeTransport())
+        return protocol
+
+    async def test_loopback(self):
+        loop = asyncio.get_running_loop()
+        receiver_transport, receiver = await loop.create_datagram_endpoint(
+            lambda: RecordingProtocol(
+                Session(policy=self.rx_policy), Session(policy=self.tx_policy)
+            ),
+            local_addr=("127.0.0.1", 0),
+        )
+        sender_transport, sender = await loop.create_datagram_endpoint(
+            lambda: RecordingProtocol(
+                Session(policy=self.rx_policy), Session(policy=self.tx_policy)
+            ),
+            remote_addr=receiver_transport.get_extra_info("sockname"),
+        )
+        try:
+            sender.send_rtp(RTP)
+            sender.send_rtcp(RTCP)
+            for _ in range(100):
+                if len(receiver.received) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(
+                sorted((kind, data) for kind, data, addr in receiver.received),
+                [("rtcp", RTCP), ("rtp", RTP)],
+            )
+        finally:
+            sender_transport.close()
+            receiver_transport.close()
+
+    async def test_batch(self):
+        sender = self.create_protocol()
+        receiver = self.create_protocol(max_batch=2)
+
+        packets = make_packets(5)
+        for packet in packets:
+            sender.send_rtp(packet, "addr")
+        sender.send_rtcp(RTCP, "addr")
+        for data, addr in sender.transport.sent:
+            receiver.datagram_received(data, addr)
+        receiver.datagram_received(b"garbage", "addr")
+
+        # nothing is processed until the loop runs
+        self.assertEqual(receiver.received, [])
+        await asyncio.sleep(0)
+        self.assertEqual(
+            receiver.received,
+            [("rtp", packets[0], "addr"), ("rtp", packets[1], "addr")],
+        )
+
+        for _ in range(3):
+            await asyncio.sleep(0)
+        self.assertEqual(
+            receiver.received,
+            [("rtp", packet, "addr") for packet in packets] + [("rtcp", RTCP, "addr")],
+        )
+        self.assertEqual(receiver.dropped_packets, 0)
+        self.assertEqual(receiver.rejected_packets, 1)
+
+    async def test_max_pending(self):
+        receiver = self.create_protocol(max_pending=2)
+        for packet in make_packets(3):
+            receiver.datagram_received(packet, "addr")
+        self.assertEqual(receiver.dropped_packets, 1)
+
+        await asyncio.sleep(0)
+        self.assertEqual(receiver.rejected_packets, 2)
+
+    async def test_executor(self):
+        sender = self.create_protocol()
+        packets = make_packets(4)
+        for packet in packets:
+            sender.send_rtp(packet)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            receiver = self.create_protocol(executor=executor, executor_threshold=3)
+            for data, addr in sender.transport.sent:
+                receiver.datagram_received(data, addr)
+            for _ in range(100):
+                if len(receiver.received) == 4:
+                    break
+                await asyncio.sleep(0.01)
+        self.assertEqual(
+            receiver.received, [("rtp", packet, None) for packet in packets]
+        )
+
+    async def test_callback_error(self):
+        sender = self.create_protocol()
+        receiver = FailingProtocol(
+            Session(policy=self.rx_policy), Session(policy=self.tx_policy), max_batch=2
+        )
+        receiver.connection_made(FakeTransport())
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+
+        # Every packet is delivered and every error reported, and the queued
+        # packets are still processed.
+        packets = make_packets(3)
+        for packet in packets:
+            sender.send_rtp(packet)
+        for data, addr in sender.transport.sent:
+            receiver.datagram_received(data, addr)
+        for _ in range(2):
+            await asyncio.sleep(0)
+        self.assertEqual(
+            receiver.received, [("rtp", packet, None) for packet in packets]
+        )
+        self.assertEqual(len(errors), 3)
+        self.assertIs(errors[0]["protocol"], receiver)
+        self.assertIsInstance(errors[0]["exception"], ValueError)
+
+    async def test_connection_lost(self):
+        sender = self.create_protocol()
+        packets = make_packets(4)
+        for packet in packets:
+            sender.send_rtp(packet)
+
+        # Queued packets are dropped.
+        receiver = self.create_protocol()
+        for data, addr in sender.transport.sent:
+            receiver.datagram_received(data, addr)
+        receiver.connection_lost(None)
+        self.assertIsNone(receiver.transport)
+        await asyncio.sleep(0)
+        self.assertEqual(receiver.received, [])
+
+        # The batch being unprotected in the executor is dropped.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            receiver = self.create_protocol(executor=executor, executor_threshold=1)
+            for data, addr in sender.transport.sent:
+                receiver.datagram_received(data, addr)
+            await asyncio.sleep(0)
+            receiver.connection_lost(None)
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        self.assertEqual(receiver.received, [])
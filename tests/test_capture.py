@@ -0,0 +1,245 @@
+import base64
+import contextlib
+import io
+import os
+import secrets
+import struct
+import tempfile
+from unittest import TestCase, mock
+
+from pylibsrtp import Error, Policy
+from pylibsrtp._capture import CaptureStats, main, process_capture
+
+RTCP = (
+    b"\x80\xc8\x00\x06\xf3\xcb\x20\x01\x83\xab\x03\xa1\xeb\x02\x0b\x3a"
+    b"\x00\x00\x94\x20\x00\x00\x00\x9e\x00\x00\x9b\x88"
+)
+STUN = b"\x00\x01\x00\x00\x21\x12\xa4\x42" + b"\x00" * 12
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def make_rtp(ssrc, seq):
+    return (
+        b"\x80\x08"
+        + seq.to_bytes(2, "big")
+        + b"\x00\x00\x00\x00"
+        + ssrc.to_bytes(4, "big")
+        + b"\xd4" * 160
+    )
+
+
+def make_ipv4_frame(payload):
+    udp = struct.pack("!HHHH", 5000, 6000, len(payload) + 8, 0) + payload
+    ip = bytearray(
+        struct.pack("!BBHHHBBH", 0x45, 0, len(udp) + 20, 0, 0, 64, 17, 0)
+        + bytes([10, 0, 0, 1, 10, 0, 0, 2])
+    )
+    struct.pack_into("!H", ip, 10, checksum(bytes(ip)))
+    return b"\x00" * 12 + b"\x08\x00" + bytes(ip) + udp
+
+
+def make_ipv6_frame(payload):
+    source = bytes(15) + b"\x01"
+    destination = bytes(15) + b"\x02"
+    length = len(payload) + 8
+    udp = struct.pack("!HHHH", 5000, 6000, length, 0) + payload
+    pseudo_header = source + destination + struct.pack("!I3xB", length, 17)
+    udp = udp[0:6] + struct.pack("!H", checksum(pseudo_header + udp)) + udp[8:]
+    ip = struct.pack("!IHBB", 0x60000000, length, 17, 64) + source + destination
+    return b"\x00" * 12 + b"\x86\xdd" + ip + udp
+
+
+def make_pcap(frames):
+    data = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1)
+    for i, frame in enumerate(frames):
+        data += struct.pack("<IIII", i, 0, len(frame), len(frame)) + frame
+    return data
+
+
+def make_pcapng(frames):
+    def block(block_type, body):
+        body += b"\x00" * (-len(body) % 4)
+        length = len(body) + 12
+        return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+    data = block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    data += block(1, struct.pack("<HHI", 1, 0, 65535))
+    for i, frame in enumerate(frames):
+        data += block(6, struct.pack("<IIIII", 0, 0, i, len(frame), len(frame)) + frame)
+    return data
+
+
+def make_rtpdump(packets):
+    data = b"#!rtpplay1.0 10.0.0.1/5000\n" + bytes(16)
+    for i, packet in enumerate(packets):
+        plen = 0 if packet == RTCP else len(packet)
+        data += struct.pack("!HHI", len(packet) + 8, plen, i) + packet
+    return data
+
+
+class CaptureTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.key = secrets.token_bytes(30)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def run_main(self, *args):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            main(list(args))
+        return stderr.getvalue()
+
+    def round_trip(self, data, workers):
+        with open(self.path("plain"), "wb") as fp:
+            fp.write(data)
+        key = base64.b64encode(self.key).decode()
+
+        output = self.run_main(
+            "encrypt",
+            self.path("plain"),
+            self.path("encrypted"),
+            "--key",
+            key,
+            "--workers",
+            str(workers),
+            "--batch-size",
+            "4",
+        )
+        self.assertIn("packets encrypted", output)
+        with open(self.path("encrypted"), "rb") as fp:
+            encrypted = fp.read()
+        self.assertNotEqual(encrypted, data)
+
+        output = self.run_main(
+            "decrypt",
+            self.path("encrypted"),
+            self.path("decrypted"),
+            "--key-hex",
+            self.key.hex(),
+            "--workers",
+            str(workers),
+            "--batch-size",
+            "4",
+        )
+        self.assertIn("packets decrypted", output)
+        self.assertIn(", 0 failed", output)
+        with open(self.path("decrypted"), "rb") as fp:
+            self.assertEqual(fp.read(), data)
+        return encrypted
+
+    def test_pcap(self):
+        frames = [
+            make_ipv4_frame(make_rtp(ssrc, seq))
+            for seq in range(5)
+            for ssrc in (1, 2, 3)
+        ]
+        frames += [
+            make_ipv4_frame(RTCP),
+            make_ipv4_frame(STUN),
+            make_ipv6_frame(make_rtp(1, 5)),
+            b"\x00" * 12 + b"\x08\x06" + bytes(28),
+        ]
+        for workers in [0, 2]:
+            with self.subTest(workers=workers):
+                encrypted = self.round_trip(make_pcap(frames), workers)
+                self.assertEqual(len(encrypted), len(make_pcap(frames)) + 16 * 10 + 14)
+
+    def test_pcapng(self):
+        frames = [make_ipv4_frame(make_rtp(1, seq)) for seq in range(3)]
+        frames += [make_ipv6_frame(make_rtp(2, 0)), make_ipv4_frame(RTCP)]
+        self.round_trip(make_pcapng(frames), workers=0)
+
+    def test_rtpdump(self):
+        packets = [make_rtp(ssrc, seq) for seq in range(3) for ssrc in (1, 2)]
+        self.round_trip(make_rtpdump(packets + [RTCP]), workers=0)
+
+    def test_drop_failed(self):
+        with open(self.path("plain"), "wb") as fp:
+            fp.write(make_pcap([make_ipv4_frame(make_rtp(1, 0))]))
+
+        # Decrypting plain RTP fails.
+        for extra, expected in [([], 24), (["--keep-failed"], None)]:
+            output = self.run_main(
+                "decrypt",
+                self.path("plain"),
+                self.path("decrypted"),
+                "--key-hex",
+                self.key.hex(),
+                "--workers",
+                "0",
+                *extra,
+            )
+            self.assertIn(", 1 failed", output)
+            with open(self.path("decrypted"), "rb") as fp:
+                decrypted = fp.read()
+            with open(self.path("plain"), "rb") as fp:
+                plain = fp.read()
+            self.assertEqual(len(decrypted), expected or len(plain))
+
+    def test_errors(self):
+        with open(self.path("bogus"), "wb") as fp:
+            fp.write(b"bogus data")
+        with self.assertRaises(SystemExit) as cm:
+            self.run_main(
+                "decrypt",
+                self.path("bogus"),
+                self.path("output"),
+                "--key-hex",
+                self.key.hex(),
+            )
+        self.assertEqual(cm.exception.code, 1)
+
+        with self.assertRaises(SystemExit) as cm:
+            self.run_main(
+                "decrypt",
+                self.path("bogus"),
+                self.path("output"),
+                "--key-hex",
+                "1234",
+            )
+        self.assertEqual(cm.exception.code, 1)
+
+        # Errors reported by libsrtp, for instance for an unsupported profile.
+        with open(self.path("plain"), "wb") as fp:
+            fp.write(make_pcap([make_ipv4_frame(make_rtp(1, 0))]))
+        with mock.patch(
+            "pylibsrtp._capture.Session", side_effect=Error("unsupported parameter")
+        ):
+            with self.assertRaises(SystemExit) as cm:
+                self.run_main(
+                    "decrypt",
+                    self.path("plain"),
+                    self.path("output"),
+                    "--key-hex",
+                    self.key.hex(),
+                )
+        self.assertEqual(cm.exception.code, 1)
+
+    def test_process_capture(self):
+        with open(self.path("plain"), "wb") as fp:
+            fp.write(
+                make_pcap([make_ipv4_frame(make_rtp(1, 0)), make_ipv4_frame(STUN)])
+            )
+        stats = process_capture(
+            self.path("plain"),
+            self.path("encrypted"),
+            key=self.key,
+            srtp_profile=Policy.SRTP_PROFILE_AES128_CM_SHA1_80,
+            protect=True,
+        )
+        self.assertEqual(
+            stats, CaptureStats(records=2, processed=1, failed=0, bytes=172)
+        )
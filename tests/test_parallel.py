@@ -0,0 +1,100 @@
+import secrets
+from unittest import TestCase
+
+from pylibsrtp import Error, Policy, Session
+from pylibsrtp.parallel import ParallelSession
+
+RTCP = (
+    b"\x80\xc8\x00\x06\xf3\xcb\x20\x01\x83\xab\x03\xa1\xeb\x02\x0b\x3a"
+    b"\x00\x00\x94\x20\x00\x00\x00\x9e\x00\x00\x9b\x88"
+)
+
+
+def make_rtp(ssrc, seq):
+    return (
+        b"\x80\x08"
+        + seq.to_bytes(2, "big")
+        + b"\x00\x00\x00\x00"
+        + ssrc.to_bytes(4, "big")
+        + b"\xd4" * 160
+    )
+
+
+class ParallelSessionTest(TestCase):
+    def setUp(self):
+        self.key = secrets.token_bytes(30)
+        self.tx_policy = Policy(key=self.key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        self.rx_policy = Policy(key=self.key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+
+    def test_many(self):
+        packets = [make_rtp(ssrc, seq) for seq in range(20) for ssrc in range(5)]
+        rx_session = Session(policy=self.rx_policy)
+
+        # Fewer slots than packets, so the rings wrap around.
+        with ParallelSession([self.tx_policy], workers=2, slots=8) as session:
+            results = session.protect_many(packets).result()
+            self.assertEqual(len(results), len(packets))
+            for packet, (status, data) in zip(packets, results):
+                self.assertEqual(status, 0)
+                self.assertEqual(rx_session.unprotect(data), packet)
+
+            status, data = session.protect_rtcp_many([RTCP]).result()[0]
+            self.assertEqual(rx_session.unprotect_rtcp(data), RTCP)
+
+            self.assertEqual(session.protect_many([]).result(), [])
+
+    def test_single(self):
+        tx_session = Session(policy=self.tx_policy)
+        with ParallelSession([self.rx_policy], workers=2) as session:
+            futures = [
+                session.unprotect(tx_session.protect(make_rtp(ssrc, 0)))
+                for ssrc in range(4)
+            ]
+            for ssrc, future in enumerate(futures):
+                self.assertEqual(future.result(), make_rtp(ssrc, 0))
+
+            future = session.unprotect_rtcp(tx_session.protect_rtcp(RTCP))
+            self.assertEqual(future.result(), RTCP)
+
+            # Bogus packet.
+            with self.assertRaises(Error) as cm:
+                session.unprotect(make_rtp(1, 1)).result()
+            self.assertEqual(str(cm.exception), "authentication failure")
+            self.assertEqual(
+                session.unprotect_many([make_rtp(1, 2)]).result(), [(7, None)]
+            )
+
+            # Packet too long.
+            with self.assertRaises(ValueError) as cm:
+                session.unprotect(bytes(1501))
+            self.assertEqual(str(cm.exception), "packet is too long")
+
+    def test_streams(self):
+        with ParallelSession(workers=2) as session:
+            # No streams.
+            with self.assertRaises(Error) as cm:
+                session.protect(make_rtp(12345, 0)).result()
+            self.assertEqual(str(cm.exception), "no appropriate context found")
+
+            session.add_stream(
+                Policy(key=self.key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=12345)
+            )
+            protected = session.protect(make_rtp(12345, 0)).result()
+
+            rx_session = Session(policy=self.rx_policy)
+            self.assertEqual(rx_session.unprotect(protected), make_rtp(12345, 0))
+
+            session.remove_stream(12345)
+            with self.assertRaises(Error) as cm:
+                session.remove_stream(12345)
+            self.assertEqual(str(cm.exception), "no appropriate context found")
+
+        # Closed session.
+        with self.assertRaises(RuntimeError) as cm:
+            session.protect(make_rtp(12345, 1))
+        self.assertEqual(str(cm.exception), "session is closed")
+
+    def test_invalid_policy(self):
+        with self.assertRaises(Error) as cm:
+            ParallelSession([Policy(ssrc_type=Policy.SSRC_ANY_OUTBOUND)], workers=1)
+        self.assertEqual(str(cm.exception), "unsupported parameter")
@@ -1,15 +1,41 @@
 import dataclasses
+import os
+import pickle
 import secrets
-from unittest import TestCase
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
 
-import pylibsrtp
-from pylibsrtp import Error, Policy, Session
+from pylibsrtp import (
+    ERRORS,
+    BufferPool,
+    Error,
+    ErrorCode,
+    PacketKind,
+    Policy,
+    Session,
+    SessionGroup,
+    capabilities,
+    classify,
+    classify_many,
+    init,
+)
 
 RTP = (
     b"\x80\x08\x00\x00"  # version, packet type, sequence number
     b"\x00\x00\x00\x00"  # timestamp
     b"\x00\x00\x30\x39"  # ssrc: 12345
 ) + (b"\xd4" * 160)
+RTP_WITH_EXTENSIONS = (
+    b"\x90\x08\x00\x00"  # version, extension, packet type, sequence number
+    b"\x00\x00\x00\x00"  # timestamp
+    b"\x00\x00\x30\x39"  # ssrc: 12345
+    b"\xbe\xde\x00\x02"  # one-byte header extensions, 2 words
+    b"\x12\x01\x02\x03"  # id 1 (3 bytes)
+    b"\x20\x04\x00\x00"  # id 2 (1 byte), padding
+) + (b"\xd4" * 160)
 RTCP = (
     b"\x80\xc8\x00\x06\xf3\xcb\x20\x01\x83\xab\x03\xa1\xeb\x02\x0b\x3a"
     b"\x00\x00\x94\x20\x00\x00\x00\x9e\x00\x00\x9b\x88"
@@ -24,7 +50,11 @@ class Profile:
     srtp_profile: int
 
 
-# AES-GCM may not be supported depending on how libsrtp2 was built.
+# AES-GCM may not be supported depending on how libsrtp2 was built, unless
+# PYLIBSRTP_REQUIRE_GCM is set, as is the case when testing wheels.
+GCM_AVAILABLE = capabilities()["profiles"][Policy.SRTP_PROFILE_AEAD_AES_128_GCM][
+    "available"
+]
 SRTP_PROFILES = [
     Profile(
         key_length=30,
@@ -39,11 +69,7 @@ SRTP_PROFILES = [
         srtp_profile=Policy.SRTP_PROFILE_AES128_CM_SHA1_32,
     ),
 ]
-try:
-    Policy(srtp_profile=Policy.SRTP_PROFILE_AEAD_AES_128_GCM)
-except Error:
-    pass
-else:
+if GCM_AVAILABLE:
     SRTP_PROFILES += [
         Profile(
             key_length=28,
@@ -60,6 +86,193 @@ else:
     ]
 
 
+class BufferPoolTest(TestCase):
+    def test_acquire_release(self):
+        pool = BufferPool(buffer_size=1200, capacity=1)
+        self.assertEqual(pool.buffer_size, 1200)
+
+        view1 = pool.acquire()
+        view2 = pool.acquire()
+        self.assertEqual(len(view1), 1200)
+        self.assertEqual(len(view2), 1200)
+        self.assertEqual(
+            pool.stats(),
+            {"hits": 0, "misses": 2, "discards": 0, "idle": 0, "in_use": 2},
+        )
+
+        buffer1 = view1.obj
+        pool.release(view1)
+        pool.release(view2)
+        self.assertEqual(
+            pool.stats(),
+            {"hits": 0, "misses": 2, "discards": 1, "idle": 1, "in_use": 0},
+        )
+
+        # released views cannot be used
+        with self.assertRaises(ValueError):
+            view1[0]
+
+        # idle buffers are reused
+        with pool.borrow() as view:
+            self.assertIs(view.obj, buffer1)
+        self.assertEqual(
+            pool.stats(),
+            {"hits": 1, "misses": 2, "discards": 1, "idle": 1, "in_use": 0},
+        )
+
+        # foreign buffer
+        with self.assertRaises(ValueError) as cm:
+            pool.release(memoryview(bytearray(1200)))
+        self.assertEqual(str(cm.exception), "buffer does not belong to this pool")
+
+        # slice of a pooled buffer, which stays in use
+        view = pool.acquire()
+        with self.assertRaises(ValueError) as cm:
+            pool.release(view[0:100])
+        self.assertEqual(str(cm.exception), "buffer does not belong to this pool")
+        self.assertEqual(pool.stats()["in_use"], 1)
+        pool.release(view)
+
+    def test_protect_unprotect(self):
+        key = secrets.token_bytes(30)
+        pool = BufferPool()
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+
+        with pool.borrow() as view:
+            view[0 : len(RTP)] = RTP
+            length = tx_session.protect_into(view, len(RTP))
+            length = rx_session.unprotect_into(view, length)
+            self.assertEqual(view[0:length], RTP)
+
+
+class CapabilitiesTest(TestCase):
+    def test_capabilities(self):
+        caps = capabilities()
+        self.assertEqual(sorted(caps["cpu"].keys()), ["aes", "clmul"])
+        self.assertIsInstance(caps["hashed_stream_list"], bool)
+        self.assertEqual(
+            list(caps["profiles"].keys()),
+            [
+                Policy.SRTP_PROFILE_AES128_CM_SHA1_80,
+                Policy.SRTP_PROFILE_AES128_CM_SHA1_32,
+                Policy.SRTP_PROFILE_AEAD_AES_128_GCM,
+                Policy.SRTP_PROFILE_AEAD_AES_256_GCM,
+            ],
+        )
+        for srtp_profile, flags in caps["profiles"].items():
+            if flags["available"]:
+                Policy(srtp_profile=srtp_profile)
+            else:
+                self.assertFalse(flags["accelerated"])
+                with self.assertRaises(Error):
+                    Policy(srtp_profile=srtp_profile)
+
+        # The result is a copy.
+        caps["cpu"]["aes"] = None
+        self.assertIsNotNone(capabilities()["cpu"]["aes"])
+
+    def test_require_gcm(self):
+        if not os.environ.get("PYLIBSRTP_REQUIRE_GCM"):
+            self.skipTest("PYLIBSRTP_REQUIRE_GCM is not set")
+
+        caps = capabilities()
+        for srtp_profile in [
+            Policy.SRTP_PROFILE_AEAD_AES_128_GCM,
+            Policy.SRTP_PROFILE_AEAD_AES_256_GCM,
+        ]:
+            self.assertTrue(caps["profiles"][srtp_profile]["available"])
+            if caps["cpu"]["aes"] and caps["cpu"]["clmul"]:
+                self.assertTrue(caps["profiles"][srtp_profile]["accelerated"])
+
+        # The bundled libsrtp may be built with a hash-indexed stream list.
+        if os.environ.get("PYLIBSRTP_HASHED_STREAM_LIST") == "1":
+            self.assertTrue(caps["hashed_stream_list"])
+
+
+class ClassifyTest(TestCase):
+    def test_classify(self):
+        for packet, result in [
+            (b"", (PacketKind.UNKNOWN, False)),
+            (b"\x00\x01\x00\x00", (PacketKind.STUN, False)),
+            (b"\x10", (PacketKind.ZRTP, False)),
+            (b"\x16\xfe\xfd", (PacketKind.DTLS, False)),
+            (b"\x40\x00", (PacketKind.TURN, False)),
+            (b"\x50", (PacketKind.UNKNOWN, False)),
+            (b"\xc0", (PacketKind.UNKNOWN, False)),
+            # RTP, with a truncated CSRC list or header extension.
+            (RTP, (PacketKind.RTP, True)),
+            (RTP[0:12], (PacketKind.RTP, True)),
+            (RTP[0:11], (PacketKind.RTP, False)),
+            (b"\x81" + RTP[1:14], (PacketKind.RTP, False)),
+            (RTP_WITH_EXTENSIONS[0:24], (PacketKind.RTP, True)),
+            (RTP_WITH_EXTENSIONS[0:23], (PacketKind.RTP, False)),
+            (RTP_WITH_EXTENSIONS[0:14], (PacketKind.RTP, False)),
+            # RTCP, with a truncated first packet.
+            (RTCP, (PacketKind.RTCP, True)),
+            (RTCP[0:27], (PacketKind.RTCP, False)),
+            (RTCP[0:2], (PacketKind.RTCP, False)),
+        ]:
+            with self.subTest(packet=packet):
+                self.assertEqual(classify(packet), result)
+
+        with self.assertRaises(TypeError) as cm:
+            classify("foo")
+        self.assertEqual(str(cm.exception), "packet must be bytes")
+
+    def test_classify_many(self):
+        self.assertEqual(
+            classify_many([RTP, b"\x00\x01", RTCP, b""]),
+            [
+                (PacketKind.RTP, True),
+                (PacketKind.STUN, False),
+                (PacketKind.RTCP, True),
+                (PacketKind.UNKNOWN, False),
+            ],
+        )
+        self.assertEqual(classify_many([]), [])
+
+
+class InitTest(TestCase):
+    def test_init(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(init) for i in range(8)]:
+                future.result()
+
+    def test_lazy(self):
+        # Importing does not initialize libsrtp, creating a session does.
+        code = (
+            "import pylibsrtp\n"
+            "assert not pylibsrtp._initialized\n"
+            "pylibsrtp.Policy()\n"
+            "assert not pylibsrtp._initialized\n"
+            "pylibsrtp.Session()\n"
+            "assert pylibsrtp._initialized\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+
+class ErrorTest(TestCase):
+    def test_codes(self):
+        self.assertEqual(len(ErrorCode), len(ERRORS))
+        self.assertEqual(ERRORS[ErrorCode.AUTH_FAIL], "authentication failure")
+        self.assertEqual(
+            ERRORS[ErrorCode.REPLAY_OLD], "replay check failed (index too old)"
+        )
+
+    def test_error(self):
+        with self.assertRaises(Error) as cm:
+            Policy(srtp_profile=0)
+        self.assertEqual(str(cm.exception), "unsupported parameter")
+        self.assertIs(cm.exception.code, ErrorCode.BAD_PARAM)
+
+        error = pickle.loads(pickle.dumps(cm.exception))
+        self.assertEqual(str(error), "unsupported parameter")
+        self.assertIs(error.code, ErrorCode.BAD_PARAM)
+
+        self.assertIs(Error("some failure").code, ErrorCode.FAIL)
+
+
 class PolicyTest(TestCase):
     def test_allow_repeat_tx(self):
         policy = Policy()
@@ -77,6 +290,95 @@ class PolicyTest(TestCase):
         policy.allow_repeat_tx = 0
         self.assertEqual(policy.allow_repeat_tx, False)
 
+    def test_copy(self):
+        key = secrets.token_bytes(30)
+        policy = Policy(
+            key=key,
+            ssrc_type=Policy.SSRC_SPECIFIC,
+            ssrc_value=1234,
+            srtp_profile=Policy.SRTP_PROFILE_AES128_CM_SHA1_32,
+        )
+        policy.enc_xtn_hdr = [1]
+        policy.window_size = 512
+
+        # Plain copy.
+        clone = policy.copy()
+        self.assertEqual(clone.enc_xtn_hdr, [1])
+        self.assertEqual(clone.key, key)
+        self.assertEqual(clone.srtp_profile, Policy.SRTP_PROFILE_AES128_CM_SHA1_32)
+        self.assertEqual(clone.ssrc_type, Policy.SSRC_SPECIFIC)
+        self.assertEqual(clone.ssrc_value, 1234)
+        self.assertEqual(clone.window_size, 512)
+
+        # The key is copied, so modifying it in place leaves the caller's
+        # key and the copy unchanged.
+        policy.key[0:1] = bytes([key[0] ^ 1])
+        self.assertNotEqual(policy.key, key)
+        self.assertEqual(key, clone.key)
+        policy.key = key
+        self.assertEqual(policy.key, key)
+
+        # Copy with another key and SSRC, the original is unchanged.
+        other_key = secrets.token_bytes(30)
+        clone = policy.copy(key=other_key, ssrc_value=5678)
+        self.assertEqual(clone.key, other_key)
+        self.assertEqual(clone.ssrc_value, 5678)
+        self.assertEqual(policy.key, key)
+        self.assertEqual(policy.ssrc_value, 1234)
+
+        clone.enc_xtn_hdr = [2]
+        clone.window_size = 1024
+        self.assertEqual(policy.enc_xtn_hdr, [1])
+        self.assertEqual(policy.window_size, 512)
+
+        # Key is too short.
+        with self.assertRaises(ValueError) as cm:
+            policy.copy(key=b"0")
+        self.assertEqual(str(cm.exception), "key must contain at least 30 bytes")
+
+        # The copy is usable.
+        tx_session = Session(policy=policy.copy(ssrc_value=12345))
+        rx_session = Session(policy=policy.copy(ssrc_value=12345))
+        self.assertEqual(rx_session.unprotect(tx_session.protect(RTP)), RTP)
+
+    def test_enc_xtn_hdr(self):
+        policy = Policy()
+        self.assertEqual(policy.enc_xtn_hdr, [])
+
+        policy.enc_xtn_hdr = [1, 3]
+        self.assertEqual(policy.enc_xtn_hdr, [1, 3])
+
+        policy.enc_xtn_hdr = []
+        self.assertEqual(policy.enc_xtn_hdr, [])
+
+        # Invalid IDs.
+        with self.assertRaises(TypeError) as cm:
+            policy.enc_xtn_hdr = ["1"]
+        self.assertEqual(str(cm.exception), "header extension IDs must be integers")
+        for ext_id in [0, 256]:
+            with self.assertRaises(ValueError) as cm:
+                policy.enc_xtn_hdr = [ext_id]
+            self.assertEqual(
+                str(cm.exception), "header extension IDs must be between 1 and 255"
+            )
+
+        # Only the listed extensions are encrypted.
+        key = secrets.token_bytes(30)
+        tx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        tx_policy.enc_xtn_hdr = [1]
+        rx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+        rx_policy.enc_xtn_hdr = [1]
+        tx_session = Session(policy=tx_policy)
+        rx_session = Session(policy=rx_policy)
+
+        packet = RTP_WITH_EXTENSIONS
+        protected = tx_session.protect(packet)
+        self.assertEqual(protected[0:12], packet[0:12])
+        self.assertEqual(protected[12:17], packet[12:17])
+        self.assertNotEqual(protected[17:20], packet[17:20])
+        self.assertEqual(protected[20:24], packet[20:24])
+        self.assertEqual(rx_session.unprotect(protected), packet)
+
     def test_key(self):
         key = secrets.token_bytes(30)
 
@@ -101,6 +403,70 @@ class PolicyTest(TestCase):
         self.assertEqual(policy.key, None)
         self.assertEqual(str(cm.exception), "key must contain at least 30 bytes")
 
+    def test_master_keys(self):
+        key = secrets.token_bytes(30)
+        master_keys = [(secrets.token_bytes(30), b"\x01"), (key, b"\x02")]
+
+        policy = Policy(key=key)
+        self.assertEqual(policy.master_keys, [])
+
+        # Setting master keys clears the key, and vice versa.
+        policy.master_keys = master_keys
+        self.assertEqual(policy.master_keys, master_keys)
+        self.assertEqual(policy.key, None)
+        self.assertEqual(policy.copy().master_keys, master_keys)
+
+        policy.key = key
+        self.assertEqual(policy.master_keys, [])
+
+        # Key is not bytes.
+        with self.assertRaises(TypeError) as cm:
+            policy.master_keys = [(1234, b"\x01")]
+        self.assertEqual(str(cm.exception), "key and MKI must be bytes")
+
+        # Key is too short.
+        with self.assertRaises(ValueError) as cm:
+            policy.master_keys = [(b"0", b"\x01")]
+        self.assertEqual(str(cm.exception), "key must contain at least 30 bytes")
+
+        # MKI is empty.
+        with self.assertRaises(ValueError) as cm:
+            policy.master_keys = [(key, b"")]
+        self.assertEqual(str(cm.exception), "MKI must contain between 1 and 128 bytes")
+
+        # Too many keys.
+        with self.assertRaises(ValueError) as cm:
+            policy.master_keys = [(key, bytes([i])) for i in range(17)]
+        self.assertEqual(str(cm.exception), "at most 16 master keys are supported")
+        self.assertEqual(policy.key, key)
+
+    def test_pickle(self):
+        key = secrets.token_bytes(30)
+        policy = Policy(
+            key=key,
+            ssrc_type=Policy.SSRC_SPECIFIC,
+            ssrc_value=1234,
+            srtp_profile=Policy.SRTP_PROFILE_AES128_CM_SHA1_32,
+        )
+        policy.allow_repeat_tx = True
+        policy.enc_xtn_hdr = [1, 3]
+        policy.window_size = 512
+
+        clone = pickle.loads(pickle.dumps(policy))
+        self.assertEqual(clone.allow_repeat_tx, True)
+        self.assertEqual(clone.enc_xtn_hdr, [1, 3])
+        self.assertEqual(clone.key, key)
+        self.assertEqual(clone.master_keys, [])
+        self.assertEqual(clone.srtp_profile, Policy.SRTP_PROFILE_AES128_CM_SHA1_32)
+        self.assertEqual(clone.ssrc_type, Policy.SSRC_SPECIFIC)
+        self.assertEqual(clone.ssrc_value, 1234)
+        self.assertEqual(clone.window_size, 512)
+
+        policy.master_keys = [(key, b"\x01")]
+        clone = pickle.loads(pickle.dumps(policy))
+        self.assertEqual(clone.key, None)
+        self.assertEqual(clone.master_keys, [(key, b"\x01")])
+
     def test_srtp_policy(self):
         # Default profile.
         policy = Policy()
@@ -206,9 +572,14 @@ class SessionTest(TestCase):
                     tx_session.protect(4567)
                 self.assertEqual(str(cm.exception), "packet must be bytes")
 
+                # maximum length
+                trailer = profile.protected_rtp_length - len(RTP)
+                packet = RTP[0:3] + b"\x01" + RTP[4:12] + b"0" * (1488 - trailer)
+                self.assertEqual(len(tx_session.protect(packet)), 1500)
+
                 # bad length
                 with self.assertRaises(ValueError) as cm:
-                    tx_session.protect(b"0" * (1501 - pylibsrtp.SRTP_MAX_TRAILER_LEN))
+                    tx_session.protect(RTP[0:12] + b"0" * (1489 - trailer))
                 self.assertEqual(str(cm.exception), "packet is too long")
 
                 # unprotect RTP
@@ -244,10 +615,9 @@ class SessionTest(TestCase):
                 self.assertEqual(str(cm.exception), "packet must be bytes")
 
                 # bad length
+                trailer = profile.protected_rtcp_length - len(RTCP)
                 with self.assertRaises(ValueError) as cm:
-                    tx_session.protect_rtcp(
-                        b"0" * (1501 - pylibsrtp.SRTP_MAX_SRTCP_TRAILER_LEN)
-                    )
+                    tx_session.protect_rtcp(b"0" * (1501 - trailer))
                 self.assertEqual(str(cm.exception), "packet is too long")
 
                 # unprotect RTCP
@@ -261,6 +631,888 @@ class SessionTest(TestCase):
                 unprotected = rx_session.unprotect_rtcp(protected)
                 self.assertEqual(unprotected, RTCP)
 
+    def test_rtp_max_packet_size(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+                trailer = profile.protected_rtp_length - len(RTP)
+                jumbo = RTP[0:12] + b"\xd4" * (9000 - 12 - trailer)
+
+                # protect RTP
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    ),
+                    max_packet_size=9000,
+                )
+                self.assertEqual(tx_session.max_packet_size, 9000)
+                protected = tx_session.protect(jumbo)
+                self.assertEqual(len(protected), 9000)
+
+                # bad length
+                with self.assertRaises(ValueError) as cm:
+                    tx_session.protect(jumbo + b"\xd4")
+                self.assertEqual(str(cm.exception), "packet is too long")
+
+                # unprotect RTP
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    )
+                )
+                with self.assertRaises(ValueError) as cm:
+                    rx_session.unprotect(protected)
+                self.assertEqual(str(cm.exception), "packet is too long")
+
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    ),
+                    max_packet_size=9000,
+                )
+                self.assertEqual(rx_session.unprotect(protected), jumbo)
+                small = RTP[0:3] + b"\x01" + RTP[4:]
+                self.assertEqual(rx_session.unprotect(tx_session.protect(small)), small)
+
+    def test_mki(self):
+        master_keys = [
+            (secrets.token_bytes(30), b"\x00\x01"),
+            (secrets.token_bytes(30), b"\x00\x02"),
+        ]
+        tx_policy = Policy(ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        tx_policy.master_keys = master_keys
+        rx_policy = Policy(ssrc_type=Policy.SSRC_ANY_INBOUND)
+        rx_policy.master_keys = master_keys
+        tx_session = Session(policy=tx_policy)
+        rx_session = Session(policy=rx_policy)
+        self.assertEqual(tx_session.use_mki, False)
+        self.assertEqual(tx_session.mki_index, 0)
+
+        tx_session.use_mki = True
+        rx_session.use_mki = True
+        for seq, mki_index in enumerate([0, 1, 0]):
+            tx_session.mki_index = mki_index
+            packet = RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:]
+            protected = tx_session.protect(packet)
+            self.assertEqual(len(protected), len(packet) + 2 + 10)
+            self.assertEqual(protected[-12:-10], master_keys[mki_index][1])
+            self.assertEqual(rx_session.unprotect(protected), packet)
+
+        with self.assertRaises(ValueError) as cm:
+            tx_session.mki_index = 16
+        self.assertEqual(str(cm.exception), "mki_index must be less than 16")
+
+        # Unknown MKI.
+        tx_session.mki_index = 2
+        with self.assertRaises(Error) as cm:
+            tx_session.protect(RTP[0:2] + b"\x00\x03" + RTP[4:])
+        self.assertEqual(str(cm.exception), "error MKI present in packet is invalid")
+
+    def test_update(self):
+        old_key = secrets.token_bytes(30)
+        new_key = secrets.token_bytes(30)
+        tx_session = Session(
+            policy=Policy(key=old_key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        )
+        rx_session = Session(
+            policy=Policy(key=old_key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+        )
+        packets = [RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(4)]
+        self.assertEqual(
+            rx_session.unprotect(tx_session.protect(packets[0])), packets[0]
+        )
+        in_flight = tx_session.protect(packets[1])
+
+        # Rekey both sessions in place.
+        tx_session.update(Policy(key=new_key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session.update(Policy(key=new_key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+        self.assertEqual(
+            rx_session.unprotect(tx_session.protect(packets[2])), packets[2]
+        )
+
+        # The packet protected with the old key is rejected.
+        with self.assertRaises(Error) as cm:
+            rx_session.unprotect(in_flight)
+        self.assertEqual(str(cm.exception), "authentication failure")
+
+        # Replay protection survives the update.
+        protected = tx_session.protect(packets[3])
+        rx_session.unprotect(protected)
+        with self.assertRaises(Error) as cm:
+            rx_session.unprotect(protected)
+        self.assertEqual(str(cm.exception), "replay check failed (bad index)")
+
+        # Update a specific stream.
+        rx_session.update_stream(
+            Policy(key=old_key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=12345)
+        )
+        with self.assertRaises(Error) as cm:
+            rx_session.update_stream(
+                Policy(key=old_key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=1)
+            )
+        self.assertEqual(str(cm.exception), "unsupported parameter")
+
+    def test_try_unprotect(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+
+        status, protected = tx_session.try_protect(RTP)
+        self.assertEqual(status, ErrorCode.OK)
+        self.assertEqual(rx_session.try_unprotect(protected), (ErrorCode.OK, RTP))
+        self.assertEqual(
+            rx_session.try_unprotect(protected), (ErrorCode.REPLAY_FAIL, None)
+        )
+
+        status, protected = tx_session.try_protect_rtcp(RTCP)
+        self.assertEqual(status, ErrorCode.OK)
+        self.assertEqual(rx_session.try_unprotect_rtcp(protected), (ErrorCode.OK, RTCP))
+
+        # Bad packets.
+        self.assertEqual(
+            rx_session.try_unprotect(b"\x80\x08"), (ErrorCode.BAD_PARAM, None)
+        )
+        status, protected = tx_session.try_protect_rtcp(RTCP)
+        corrupted = protected[:-1] + bytes([protected[-1] ^ 1])
+        self.assertEqual(
+            rx_session.try_unprotect_rtcp(corrupted), (ErrorCode.AUTH_FAIL, None)
+        )
+        with self.assertRaises(TypeError) as cm:
+            rx_session.try_unprotect("foo")
+        self.assertEqual(str(cm.exception), "packet must be bytes")
+
+        # Failures are still counted.
+        self.assertEqual(rx_session.stats()["unprotect"]["errors"], 2)
+
+        # The raising variants carry the same code.
+        with self.assertRaises(Error) as cm:
+            rx_session.unprotect_rtcp(corrupted)
+        self.assertIs(cm.exception.code, ErrorCode.AUTH_FAIL)
+
+    def test_stats(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(
+            policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND), ssrc_stats=True
+        )
+        rx_session = Session(
+            policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND), ssrc_stats=True
+        )
+
+        protected = tx_session.protect(RTP)
+        protected2 = tx_session.protect(RTP[0:3] + b"\x01" + RTP[4:])
+        protected_rtcp = tx_session.protect_rtcp(RTCP)
+        rx_session.unprotect(protected)
+        rx_session.unprotect_rtcp(protected_rtcp)
+
+        # replay, garbage and a corrupt packet from a known SSRC
+        with self.assertRaises(Error):
+            rx_session.unprotect(protected)
+        with self.assertRaises(Error):
+            rx_session.unprotect(b"\x80\x08")
+        rx_session.unprotect_many([protected2[:-1] + bytes([protected2[-1] ^ 1])])
+
+        def counters(packets, bytes, errors=0, late=0, duplicate=0, **kwargs):
+            return dict(
+                packets=packets,
+                bytes=bytes,
+                errors=errors,
+                late=late,
+                duplicate=duplicate,
+                **kwargs,
+            )
+
+        tx_stats = tx_session.stats()
+        self.assertEqual(tx_stats["protect"], counters(2, 2 * len(RTP)))
+        self.assertEqual(tx_stats["protect_rtcp"], counters(1, len(RTCP)))
+        self.assertEqual(tx_stats["errors"], {})
+        self.assertEqual(tx_stats["template_clones"], 2)
+        self.assertEqual(sorted(tx_stats["ssrcs"].keys()), [12345, 0xF3CB2001])
+        self.assertEqual(
+            tx_stats["ssrcs"][12345]["protect"],
+            counters(2, 2 * len(RTP), highest_sequence=1),
+        )
+
+        rx_stats = rx_session.stats()
+        self.assertEqual(rx_stats["protect"], counters(0, 0))
+        self.assertEqual(rx_stats["unprotect"], counters(1, 182, errors=3, duplicate=1))
+        self.assertEqual(rx_stats["unprotect_rtcp"], counters(1, 42))
+        self.assertEqual(rx_stats["errors"], {2: 1, 7: 1, 9: 1})
+        self.assertEqual(rx_stats["template_clones"], 2)
+        self.assertEqual(
+            rx_stats["ssrcs"][12345]["unprotect"],
+            counters(1, 182, errors=2, duplicate=1, highest_sequence=0),
+        )
+        self.assertEqual(
+            rx_stats["ssrcs"][0xF3CB2001]["unprotect_rtcp"],
+            counters(1, 42, highest_sequence=None),
+        )
+
+        # Per-SSRC counters are only kept on demand.
+        rx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+        rx_session.unprotect(protected)
+        rx_session.unprotect_many([protected, protected2])
+        rx_stats = rx_session.stats()
+        self.assertEqual(rx_stats["unprotect"], counters(2, 364, errors=1, duplicate=1))
+        self.assertEqual(rx_stats["template_clones"], 1)
+        self.assertEqual(rx_stats["ssrcs"], {})
+
+    def test_replay_stats(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+        rx_policy.window_size = 64
+        rx_session = Session(policy=rx_policy, ssrc_stats=True)
+
+        # Sequence numbers wrap around.
+        protected = {
+            seq: tx_session.protect(RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:])
+            for seq in [65400, 65500, 65535, 0, 10]
+        }
+        # 65535 is reordered but within the window, the second 0 is a replay.
+        for seq in [65500, 0, 10, 65535, 0]:
+            rx_session.unprotect_many([protected[seq]])
+
+        stats = rx_session.stats()["ssrcs"][12345]["unprotect"]
+        self.assertEqual(stats["packets"], 4)
+        self.assertEqual(stats["late"], 0)
+        self.assertEqual(stats["duplicate"], 1)
+        self.assertEqual(stats["highest_sequence"], 10)
+
+        # Packet older than the replay window.
+        rx_session.unprotect_many([protected[65400]])
+        stats = rx_session.stats()["ssrcs"][12345]["unprotect"]
+        self.assertEqual(stats["late"], 1)
+
+    def test_stream_roc(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+
+        # Unknown stream.
+        with self.assertRaises(Error) as cm:
+            tx_session.get_stream_roc(12345)
+        self.assertEqual(str(cm.exception), "unsupported parameter")
+
+        rx_session.unprotect(tx_session.protect(RTP))
+        self.assertEqual(tx_session.get_stream_roc(12345), 0)
+
+        # Move the sending side to a new session, with a new rollover counter
+        # which takes effect with the next packet.
+        tx_session.set_stream_roc(12345, 3)
+        other_session = Session(
+            policy=Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=12345)
+        )
+        other_session.set_stream_roc(12345, 3)
+        packet = RTP[0:2] + b"\x00\x01" + RTP[4:]
+        self.assertEqual(other_session.protect(packet), tx_session.protect(packet))
+        self.assertEqual(tx_session.get_stream_roc(12345), 3)
+        self.assertEqual(other_session.get_stream_roc(12345), 3)
+
+    def test_export_state(self):
+        key = secrets.token_bytes(30)
+        tx_policy = Policy(ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+        tx_policy.enc_xtn_hdr = [1]
+        tx_policy.master_keys = [(key, b"\x01"), (secrets.token_bytes(30), b"\x02")]
+        tx_policy.window_size = 256
+        rx_policy = tx_policy.copy(ssrc_type=Policy.SSRC_ANY_INBOUND)
+        stream_policy = tx_policy.copy(ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=6789)
+        stream_policy.enc_xtn_hdr = []
+
+        def make_packet(ssrc, index):
+            return (
+                RTP[0:2]
+                + (index & 0xFFFF).to_bytes(2, "big")
+                + RTP[4:8]
+                + ssrc.to_bytes(4, "big")
+                + RTP[12:]
+            )
+
+        tx_session = Session(policy=tx_policy, retain_policies=True)
+        tx_session.add_stream(stream_policy)
+        tx_session.use_mki = True
+        tx_session.mki_index = 1
+        rx_session = Session(policy=rx_policy, retain_policies=True)
+        rx_session.add_stream(stream_policy)
+        rx_session.use_mki = True
+
+        # Send packets until the sequence numbers wrap around.
+        for index in range(65530, 65540):
+            for ssrc in [12345, 6789]:
+                packet = make_packet(ssrc, index)
+                self.assertEqual(
+                    rx_session.unprotect(tx_session.protect(packet)), packet
+                )
+
+        # A stream created from the wildcard policy which did not wrap around.
+        packet = make_packet(2222, 0)
+        self.assertEqual(rx_session.unprotect(tx_session.protect(packet)), packet)
+
+        # Move both sides to new sessions.
+        state = tx_session.export_state()
+        self.assertLess(len(state), 250)
+        tx_session = Session.from_state(state)
+        self.assertEqual(tx_session.use_mki, True)
+        self.assertEqual(tx_session.mki_index, 1)
+        rx_session = Session.from_state(rx_session.export_state())
+
+        # Only the stream whose rollover counter is not zero is created
+        # upfront, the other one is cloned from the wildcard policy.
+        self.assertEqual(rx_session.estimate_memory_usage()["streams"], 3)
+        with self.assertRaises(Error):
+            rx_session.get_stream_roc(2222)
+
+        # The new sessions carry on where the old ones stopped.
+        for index in range(65540, 65545):
+            for ssrc in [12345, 6789, 2222]:
+                packet = make_packet(ssrc, index)
+                self.assertEqual(
+                    rx_session.unprotect(tx_session.protect(packet)), packet
+                )
+        self.assertEqual(tx_session.get_stream_roc(12345), 1)
+
+        # New SSRCs still use the wildcard policy.
+        packet = make_packet(1111, 0)
+        self.assertEqual(rx_session.unprotect(tx_session.protect(packet)), packet)
+
+        # All the streams created from the wildcard policy are rekeyed along
+        # with it.
+        tx_policy.master_keys = [(secrets.token_bytes(30), b"\x01")]
+        rx_session.update(tx_policy.copy(ssrc_type=Policy.SSRC_ANY_INBOUND))
+        tx_session.mki_index = 0
+        for ssrc in [12345, 2222, 1111]:
+            packet = make_packet(ssrc, 65545)
+            with self.assertRaises(Error):
+                rx_session.unprotect(tx_session.protect(packet))
+        tx_session.update(tx_policy)
+        for ssrc in [12345, 2222, 1111]:
+            packet = make_packet(ssrc, 65546)
+            self.assertEqual(rx_session.unprotect(tx_session.protect(packet)), packet)
+
+        # Invalid states.
+        state = tx_session.export_state()
+        for data, message in [
+            (b"", "truncated session state"),
+            (state[:-1], "truncated session state"),
+            (state + b"\x00", "trailing data in session state"),
+            (b"XXXX" + state[4:], "unsupported session state"),
+        ]:
+            with self.assertRaises(ValueError) as cm:
+                Session.from_state(data)
+            self.assertEqual(str(cm.exception), message)
+
+    def test_estimate_memory_usage(self):
+        key = secrets.token_bytes(30)
+        for retain_policies in [True, False]:
+            with self.subTest(retain_policies=retain_policies):
+                session = Session(
+                    policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND),
+                    retain_policies=retain_policies,
+                )
+                usage = session.estimate_memory_usage()
+                self.assertEqual(usage["streams"], 1)
+                self.assertGreater(usage["libsrtp_bytes"], 0)
+                if retain_policies:
+                    self.assertGreater(usage["policy_bytes"], 0)
+                else:
+                    self.assertEqual(usage["policy_bytes"], 0)
+                self.assertGreaterEqual(usage["scratch_bytes"], 1500)
+                template_bytes = usage["libsrtp_bytes"]
+                template_policy_bytes = usage["policy_bytes"]
+
+                # Streams created from the wildcard policy.
+                for ssrc in [1, 2, 3]:
+                    session.protect(RTP[0:8] + ssrc.to_bytes(4, "big") + RTP[12:])
+                usage = session.estimate_memory_usage()
+                self.assertEqual(usage["streams"], 4)
+                # Cloned streams share the session keys of the wildcard policy.
+                clone_bytes = (usage["libsrtp_bytes"] - template_bytes) // 3
+                self.assertLess(clone_bytes, template_bytes // 4)
+                self.assertEqual(usage["policy_bytes"], template_policy_bytes)
+
+                # A stream with a larger replay window.
+                policy = Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=4)
+                policy.window_size = 1024
+                session.add_stream(policy)
+                policy.key = None
+                usage = session.estimate_memory_usage()
+                self.assertEqual(usage["streams"], 5)
+                self.assertEqual(
+                    usage["libsrtp_bytes"],
+                    2 * template_bytes + 3 * clone_bytes + (1024 - 128) // 8,
+                )
+                if retain_policies:
+                    self.assertGreater(usage["policy_bytes"], template_policy_bytes)
+                else:
+                    self.assertEqual(usage["policy_bytes"], template_policy_bytes)
+
+                # Removed streams.
+                session.remove_stream(1)
+                session.remove_stream(4)
+                usage = session.estimate_memory_usage()
+                self.assertEqual(usage["streams"], 3)
+                self.assertEqual(
+                    usage["libsrtp_bytes"], template_bytes + 2 * clone_bytes
+                )
+                self.assertEqual(usage["policy_bytes"], template_policy_bytes)
+
+                # Many streams, a third of which are removed.
+                def protect(ssrc, seq):
+                    session.protect(
+                        RTP[0:2]
+                        + seq.to_bytes(2, "big")
+                        + RTP[4:8]
+                        + ssrc.to_bytes(4, "big")
+                        + RTP[12:]
+                    )
+
+                for ssrc in range(100, 400):
+                    protect(ssrc, 0)
+                for ssrc in range(100, 400, 3):
+                    session.remove_stream(ssrc)
+                self.assertEqual(session.estimate_memory_usage()["streams"], 203)
+                for ssrc in range(100, 400):
+                    protect(ssrc, 1)
+                self.assertEqual(session.stats()["template_clones"], 403)
+
+                if retain_policies:
+                    Session.from_state(session.export_state())
+                else:
+                    with self.assertRaises(RuntimeError) as cm:
+                        session.export_state()
+                    self.assertEqual(
+                        str(cm.exception), "session does not retain its policies"
+                    )
+
+    def test_stream_limits(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+        seqs = {}
+
+        def send(session, ssrc):
+            seq = seqs[ssrc] = seqs.get(ssrc, -1) + 1
+            packet = (
+                RTP[0:2]
+                + seq.to_bytes(2, "big")
+                + RTP[4:8]
+                + ssrc.to_bytes(4, "big")
+                + RTP[12:]
+            )
+            self.assertEqual(session.unprotect(tx_session.protect(packet)), packet)
+
+        # Invalid limits.
+        with self.assertRaises(ValueError) as cm:
+            Session(policy=rx_policy, max_streams=0)
+        self.assertEqual(str(cm.exception), "max_streams must be at least 1")
+        with self.assertRaises(ValueError) as cm:
+            Session(policy=rx_policy, idle_timeout=0)
+        self.assertEqual(str(cm.exception), "idle_timeout must be positive")
+
+        # The least recently used stream is evicted, unlike explicit streams.
+        rx_session = Session(policy=rx_policy, max_streams=2, ssrc_stats=True)
+        rx_session.add_stream(
+            Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=100)
+        )
+        for ssrc in [1, 2, 100, 1, 3]:
+            send(rx_session, ssrc)
+        stats = rx_session.stats()
+        self.assertEqual(stats["evictions"], {"max_streams": 1, "idle": 0})
+        self.assertEqual(sorted(stats["ssrcs"].keys()), [1, 3, 100])
+        self.assertEqual(rx_session.estimate_memory_usage()["streams"], 4)
+
+        # An evicted stream is created anew.
+        send(rx_session, 2)
+        stats = rx_session.stats()
+        self.assertEqual(stats["evictions"], {"max_streams": 2, "idle": 0})
+        self.assertEqual(sorted(stats["ssrcs"].keys()), [2, 3, 100])
+        self.assertEqual(stats["template_clones"], 4)
+
+        # Idle streams are evicted.
+        with mock.patch("pylibsrtp.time.monotonic") as monotonic:
+            monotonic.return_value = 0.0
+            rx_session = Session(policy=rx_policy, idle_timeout=10, ssrc_stats=True)
+            send(rx_session, 4)
+            send(rx_session, 1)
+            send(rx_session, 2)
+
+            monotonic.return_value = 5.0
+            send(rx_session, 2)
+
+            monotonic.return_value = 12.0
+            send(rx_session, 3)
+            stats = rx_session.stats()
+            self.assertEqual(stats["evictions"], {"max_streams": 0, "idle": 2})
+            self.assertEqual(sorted(stats["ssrcs"].keys()), [2, 3])
+
+            monotonic.return_value = 16.0
+            rx_session.expire_streams()
+            stats = rx_session.stats()
+            self.assertEqual(stats["evictions"], {"max_streams": 0, "idle": 3})
+            self.assertEqual(sorted(stats["ssrcs"].keys()), [3])
+            self.assertEqual(rx_session.estimate_memory_usage()["streams"], 2)
+
+    def test_unprotect_auto(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND))
+        packets = [RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(3)]
+        protected = tx_session.protect_rtcp(RTCP)
+        corrupted = protected[:-1] + bytes([protected[-1] ^ 1])
+
+        self.assertEqual(
+            rx_session.unprotect_auto(tx_session.protect(packets[0])),
+            (False, packets[0]),
+        )
+        self.assertEqual(
+            rx_session.unprotect_auto(tx_session.protect_rtcp(RTCP)), (True, RTCP)
+        )
+        with self.assertRaises(ValueError) as cm:
+            rx_session.unprotect_auto(b"\x16\xfe\xfd")
+        self.assertEqual(str(cm.exception), "packet is neither RTP nor RTCP")
+        with self.assertRaises(TypeError) as cm:
+            rx_session.unprotect_auto("foo")
+        self.assertEqual(str(cm.exception), "packet must be bytes")
+
+        self.assertEqual(
+            rx_session.unprotect_auto_many(
+                [
+                    tx_session.protect(packets[1]),
+                    b"\x00\x01\x00\x00",
+                    tx_session.protect_rtcp(RTCP),
+                    tx_session.protect(packets[2]),
+                    corrupted,
+                ]
+            ),
+            [
+                (ErrorCode.OK, packets[1], False),
+                (ErrorCode.BAD_PARAM, None, False),
+                (ErrorCode.OK, RTCP, True),
+                (ErrorCode.OK, packets[2], False),
+                (ErrorCode.AUTH_FAIL, None, True),
+            ],
+        )
+        self.assertEqual(rx_session.unprotect_auto_many([]), [])
+
+        # Packets are counted under the operation used.
+        stats = rx_session.stats()
+        self.assertEqual(stats["unprotect"]["packets"], 3)
+        self.assertEqual(stats["unprotect_rtcp"]["packets"], 2)
+        self.assertEqual(stats["unprotect_rtcp"]["errors"], 1)
+
+    def test_reject(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_policy = Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)
+        packets = [RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(3)]
+        protected = [tx_session.protect(packet) for packet in packets]
+        others = [
+            RTP[0:2]
+            + seq.to_bytes(2, "big")
+            + RTP[4:8]
+            + b"\x00\x00\x00\x01"
+            + RTP[12:]
+            for seq in range(3)
+        ]
+        protected_others = [tx_session.protect(packet) for packet in others]
+        bogus = [packet + bytes(10) for packet in packets + others]
+
+        # Invalid parameters.
+        with self.assertRaises(ValueError) as cm:
+            Session(policy=rx_policy, reject_threshold=0)
+        self.assertEqual(str(cm.exception), "reject_threshold must be at least 1")
+        with self.assertRaises(ValueError) as cm:
+            Session(policy=rx_policy, reject_window=0)
+        self.assertEqual(str(cm.exception), "reject_window must be positive")
+
+        rx_session = Session(policy=rx_policy, reject_threshold=3, reject_window=0.5)
+
+        # Forged packets never get an SSRC with a stream rejected.
+        self.assertEqual(rx_session.unprotect(protected[0]), packets[0])
+        for _ in range(10):
+            self.assertEqual(rx_session.try_unprotect(bogus[1]), (7, None))
+        self.assertEqual(rx_session.unprotect(protected[1]), packets[1])
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 0, "ssrcs": 0})
+
+        # Failures of an SSRC without a stream are forgotten once the window
+        # elapsed.
+        for _ in range(2):
+            self.assertEqual(rx_session.try_unprotect(bogus[3]), (7, None))
+        time.sleep(0.6)
+        self.assertEqual(rx_session.try_unprotect(bogus[3]), (7, None))
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 0, "ssrcs": 0})
+
+        # The SSRC gets rejected, even for valid packets.
+        for _ in range(2):
+            self.assertEqual(rx_session.try_unprotect(bogus[4]), (7, None))
+        self.assertEqual(rx_session.try_unprotect(protected_others[0]), (7, None))
+        self.assertEqual(
+            rx_session.unprotect_many([bogus[5], protected_others[1], protected[2]]),
+            [(7, None), (7, None), (0, packets[2])],
+        )
+        stats = rx_session.stats()
+        self.assertEqual(stats["rejected"], {"packets": 3, "ssrcs": 1})
+        self.assertEqual(stats["unprotect"]["errors"], 15)
+
+        # The SSRC is accepted again once the window elapsed.
+        time.sleep(0.6)
+        self.assertEqual(rx_session.unprotect(protected_others[2]), others[2])
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 3, "ssrcs": 0})
+
+        # Adding a stream for a rejected SSRC accepts it right away.
+        rx_session = Session(reject_threshold=1)
+        self.assertEqual(
+            rx_session.try_unprotect(protected[0]), (ErrorCode.NO_CTX, None)
+        )
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 0, "ssrcs": 1})
+        rx_session.add_stream(
+            Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=12345)
+        )
+        self.assertEqual(rx_session.unprotect(protected[0]), packets[0])
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 0, "ssrcs": 0})
+
+    def test_latency_hook(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        packets = [RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(6)]
+        calls = []
+
+        with self.assertRaises(ValueError) as cm:
+            tx_session.set_latency_hook(calls.append, interval=0)
+        self.assertEqual(str(cm.exception), "interval must be at least 1")
+
+        tx_session.set_latency_hook(
+            lambda name, elapsed: calls.append((name, elapsed)), interval=2
+        )
+        for packet in packets[0:4]:
+            tx_session.protect(packet)
+        tx_session.protect_many(packets[4:6])
+        tx_session.protect_many(packets[4:6])
+        self.assertEqual(
+            [name for name, elapsed in calls], ["protect"] * 2 + ["protect_many"]
+        )
+        for name, elapsed in calls:
+            self.assertGreaterEqual(elapsed, 0)
+
+        # remove the hook
+        tx_session.set_latency_hook(None)
+        tx_session.protect(RTP[0:2] + b"\x00\x06" + RTP[4:])
+        self.assertEqual(len(calls), 3)
+
+    def test_rtp_threads(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+                packets = [
+                    RTP[0:2] + seq.to_bytes(2, "big") + RTP[4:] for seq in range(100)
+                ]
+
+                # protect RTP from several threads sharing a session
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    )
+                )
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    protected = list(executor.map(tx_session.protect, packets))
+
+                # unprotect RTP from several threads using their own session
+                def unprotect(chunk):
+                    rx_session = Session(
+                        policy=Policy(
+                            key=key,
+                            srtp_profile=profile.srtp_profile,
+                            ssrc_type=Policy.SSRC_ANY_INBOUND,
+                        )
+                    )
+                    return [rx_session.unprotect(data) for data in chunk]
+
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    for unprotected in executor.map(unprotect, [protected] * 4):
+                        self.assertEqual(unprotected, packets)
+
+    def test_rtp_into(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+                buffer = bytearray(1500)
+                buffer[0 : len(RTP)] = RTP
+
+                # protect RTP
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    )
+                )
+                length = tx_session.protect_into(buffer, len(RTP))
+                self.assertEqual(length, profile.protected_rtp_length)
+
+                # bad type
+                with self.assertRaises(TypeError) as cm:
+                    tx_session.protect_into(bytes(buffer), len(RTP))
+                self.assertEqual(str(cm.exception), "buffer must be writable")
+
+                # bad length
+                with self.assertRaises(ValueError) as cm:
+                    tx_session.protect_into(bytearray(RTP), len(RTP))
+                self.assertEqual(str(cm.exception), "buffer is too small")
+
+                # unprotect RTP, from a slice of a larger buffer
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    )
+                )
+                ring = bytearray(4000)
+                view = memoryview(ring)[2000:]
+                view[0:length] = buffer[0:length]
+                length = rx_session.unprotect_into(view, length)
+                self.assertEqual(length, len(RTP))
+                self.assertEqual(bytes(ring[2000 : 2000 + length]), RTP)
+
+                # unprotect the same packet again
+                length = profile.protected_rtp_length
+                view[0:length] = buffer[0:length]
+                with self.assertRaises(Error) as cm:
+                    rx_session.unprotect_into(view, length)
+                self.assertEqual(str(cm.exception), "replay check failed (bad index)")
+
+    def test_trailer_length_changed(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+
+        # The trailer length read before taking the session's lock may be
+        # stale if another thread changes the streams, in which case packets
+        # are refused rather than overflowing the room left for them.
+        with mock.patch.object(Session, "_Session__trailer_length", return_value=4):
+            buffer = bytearray(RTP + bytes(4))
+            with self.assertRaises(Error) as cm:
+                tx_session.protect_into(buffer, len(RTP))
+            self.assertEqual(str(cm.exception), "unsupported parameter")
+            self.assertEqual(bytes(buffer), RTP + bytes(4))
+            self.assertEqual(tx_session.protect_many([RTP, RTP]), [(2, None)] * 2)
+
+        buffer = bytearray(RTP + bytes(10))
+        self.assertEqual(tx_session.protect_into(buffer, len(RTP)), len(RTP) + 10)
+
+    def test_rtcp_into(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+                buffer = bytearray(1500)
+                buffer[0 : len(RTCP)] = RTCP
+
+                # protect RTCP
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    )
+                )
+                length = tx_session.protect_rtcp_into(buffer, len(RTCP))
+                self.assertEqual(length, profile.protected_rtcp_length)
+
+                # unprotect RTCP
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    )
+                )
+                length = rx_session.unprotect_rtcp_into(memoryview(buffer), length)
+                self.assertEqual(length, len(RTCP))
+                self.assertEqual(bytes(buffer[0:length]), RTCP)
+
+    def test_rtp_many(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+                packets = [RTP[0:3] + bytes([i]) + RTP[4:] for i in range(3)]
+
+                # protect RTP
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    )
+                )
+                results = tx_session.protect_many(packets)
+                self.assertEqual(len(results), 3)
+                for status, protected in results:
+                    self.assertEqual(status, 0)
+                    self.assertEqual(len(protected), profile.protected_rtp_length)
+
+                # bad type
+                with self.assertRaises(TypeError) as cm:
+                    tx_session.protect_many([RTP, 4567])
+                self.assertEqual(str(cm.exception), "packet must be bytes")
+
+                # empty batch
+                self.assertEqual(tx_session.protect_many([]), [])
+
+                # unprotect RTP, with a corrupt packet in the middle
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    )
+                )
+                protected = [data for status, data in results]
+                protected[1] = protected[1][:-1] + bytes([protected[1][-1] ^ 1])
+                self.assertEqual(
+                    rx_session.unprotect_many(protected),
+                    [(0, packets[0]), (7, None), (0, packets[2])],
+                )
+
+    def test_rtcp_many(self):
+        for profile in SRTP_PROFILES:
+            with self.subTest(profile=profile):
+                key = secrets.token_bytes(profile.key_length)
+
+                # protect RTCP
+                tx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_OUTBOUND,
+                    )
+                )
+                results = tx_session.protect_rtcp_many([RTCP, RTCP])
+                self.assertEqual(len(results), 2)
+                for status, protected in results:
+                    self.assertEqual(status, 0)
+                    self.assertEqual(len(protected), profile.protected_rtcp_length)
+
+                # unprotect RTCP, the second copy is a replay
+                rx_session = Session(
+                    policy=Policy(
+                        key=key,
+                        srtp_profile=profile.srtp_profile,
+                        ssrc_type=Policy.SSRC_ANY_INBOUND,
+                    )
+                )
+                self.assertEqual(
+                    rx_session.unprotect_rtcp_many(
+                        [results[0][1], results[0][1], results[1][1]]
+                    ),
+                    [(0, RTCP), (9, None), (0, RTCP)],
+                )
+
     def test_rtp_specific_ssrc(self):
         for profile in SRTP_PROFILES:
             with self.subTest(profile=profile):
@@ -289,3 +1541,141 @@ class SessionTest(TestCase):
                 )
                 unprotected = rx_session.unprotect(protected)
                 self.assertEqual(unprotected, RTP)
+
+
+class SessionGroupTest(TestCase):
+    def make_rtp(self, ssrc, seq=0):
+        return (
+            RTP[0:2]
+            + seq.to_bytes(2, "big")
+            + RTP[4:8]
+            + ssrc.to_bytes(4, "big")
+            + RTP[12:]
+        )
+
+    def test_add_remove(self):
+        key = secrets.token_bytes(30)
+        group = SessionGroup()
+        session1 = Session()
+        session2 = Session()
+        lock = session1._lock
+        self.assertEqual(len(group), 0)
+
+        for ssrc in range(1, 11):
+            group.add_stream(
+                session1 if ssrc % 2 else session2,
+                Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=ssrc),
+            )
+        self.assertEqual(len(group), 10)
+        self.assertIn(1, group)
+        self.assertIs(group.get(1), session1)
+        self.assertIs(group.get(2), session2)
+        self.assertIsNone(group.get(11))
+        self.assertIs(session1._lock, lock)
+
+        # wildcard policy
+        with self.assertRaises(ValueError) as cm:
+            group.add_stream(
+                session1, Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)
+            )
+        self.assertEqual(str(cm.exception), "policy must be for a specific SSRC")
+
+        # duplicate SSRC
+        with self.assertRaises(ValueError) as cm:
+            group.add(1, session2)
+        self.assertEqual(str(cm.exception), "SSRC 1 is already in the group")
+
+        # session in another group
+        with self.assertRaises(ValueError) as cm:
+            SessionGroup().add(1, session1)
+        self.assertEqual(str(cm.exception), "session belongs to another group")
+
+        # remove streams
+        for ssrc in range(1, 11):
+            group.remove_stream(ssrc)
+        self.assertEqual(len(group), 0)
+        self.assertIs(session1._lock, lock)
+        with self.assertRaises(ValueError) as cm:
+            group.remove_stream(1)
+        self.assertEqual(str(cm.exception), "SSRC 1 is not in the group")
+
+    def test_rtp_many(self):
+        keys = [secrets.token_bytes(30) for i in range(50)]
+        tx_session = Session()
+        rx_group = SessionGroup()
+        for ssrc, key in enumerate(keys, start=1):
+            tx_session.add_stream(
+                Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=ssrc)
+            )
+            rx_group.add_stream(
+                Session(ssrc_stats=True),
+                Policy(key=key, ssrc_type=Policy.SSRC_SPECIFIC, ssrc_value=ssrc),
+            )
+
+        packets = [self.make_rtp(ssrc) for ssrc in range(50, 0, -1)]
+        protected = [data for status, data in tx_session.protect_many(packets)]
+        results = rx_group.unprotect_many(protected + [self.make_rtp(51), b"\x80\x08"])
+        self.assertEqual(
+            results,
+            [(0, packet) for packet in packets] + [(13, None), (2, None)],
+        )
+        self.assertEqual(
+            rx_group.get(7).stats()["ssrcs"][7]["unprotect"],
+            {
+                "packets": 1,
+                "bytes": 182,
+                "errors": 0,
+                "late": 0,
+                "duplicate": 0,
+                "highest_sequence": 0,
+            },
+        )
+
+        # protect through the group
+        tx_group = SessionGroup()
+        for ssrc in range(1, 51):
+            tx_group.add(ssrc, tx_session)
+        results = tx_group.protect_many([self.make_rtp(3, seq=1)])
+        self.assertEqual(rx_group.unprotect_many([results[0][1]])[0][0], 0)
+
+    def test_session_features(self):
+        key = secrets.token_bytes(30)
+        tx_session = Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND))
+        rx_session = Session(
+            policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND),
+            reject_threshold=1,
+        )
+        calls = []
+        rx_session.set_latency_hook(lambda name, elapsed: calls.append(name))
+        rx_group = SessionGroup()
+        rx_group.add(1, rx_session)
+        rx_group.add(2, rx_session)
+
+        # The member's latency hook is called once per batch, and the SSRC
+        # without a stream gets rejected by the member.
+        packets = [self.make_rtp(1), self.make_rtp(2)]
+        protected = [data for status, data in tx_session.protect_many(packets)]
+        self.assertEqual(
+            rx_group.unprotect_many([protected[0], packets[1] + bytes(10)]),
+            [(0, packets[0]), (7, None)],
+        )
+        self.assertEqual(rx_group.unprotect_many([protected[1]]), [(7, None)])
+        self.assertEqual(calls, ["unprotect_many", "unprotect_many"])
+        self.assertEqual(rx_session.stats()["rejected"], {"packets": 1, "ssrcs": 1})
+
+    def test_rtcp_many(self):
+        key = secrets.token_bytes(30)
+        tx_group = SessionGroup()
+        tx_group.add(
+            0xF3CB2001,
+            Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_OUTBOUND)),
+        )
+        rx_group = SessionGroup()
+        rx_group.add(
+            0xF3CB2001,
+            Session(policy=Policy(key=key, ssrc_type=Policy.SSRC_ANY_INBOUND)),
+        )
+
+        results = tx_group.protect_rtcp_many([RTCP])
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(rx_group.unprotect_rtcp_many([results[0][1]]), [(0, RTCP)])